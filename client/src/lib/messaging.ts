@@ -12,33 +12,100 @@ import notify from './notify';
 import DetailsView from '../components/DetailsView.svelte';
 import { ADD_ADMIN, REMOVE_ADMIN, ADD_MEMBER, REMOVE_MEMBER } from './flags';
 
-function fetchUserChats() {
+// messages are grouped into days in the user's local time
+const TIMEZONE = Intl.DateTimeFormat().resolvedOptions().timeZone;
+
+const CHATS_PAGE_SIZE = 50;
+
+// pages come most recently active first, the store is kept oldest
+// first, so older pages are prepended
+function fetchUserChats(before: string | null = null) {
   const userId = get(user).id;
-  socket.emit('get_user_chats', { id: userId }, (payload: Payload) => {
-    if (payload.status_code !== 200) return;
-    chatsAndRoomsStore.set(payload.data);
-  });
+  socket.emit(
+    'get_user_chats',
+    { id: userId, before, limit: CHATS_PAGE_SIZE },
+    (payload: Payload) => {
+      if (payload.status_code !== 200) return;
+
+      const page = [...payload.data].reverse().map((chatOrRoom) => {
+        chatOrRoom.msgCount = chatOrRoom.unread;
+        return chatOrRoom;
+      });
+      if (before) {
+        chatsAndRoomsStore.update((chatsAndRooms) => [
+          ...page,
+          ...chatsAndRooms
+        ]);
+      } else {
+        chatsAndRoomsStore.set(page);
+      }
+
+      if (payload.data.length === CHATS_PAGE_SIZE) {
+        fetchUserChats(payload.data[payload.data.length - 1].id);
+      }
+    }
+  );
 }
 
 function fetchCurrentChatOrRoom() {
   const chatId = get(state).chat;
   const roomId = get(state).room;
   if (chatId) {
-    socket.emit('get_chat', { id: chatId }, (payload: Payload) => {
-      if (payload.status_code !== 200) return;
-      chatStore.set(payload.data);
-      roomStore.set(null);
-    });
+    socket.emit(
+      'get_chat',
+      { id: chatId, tz: TIMEZONE },
+      (payload: Payload) => {
+        if (payload.status_code !== 200) return;
+        chatStore.set(payload.data);
+        roomStore.set(null);
+      }
+    );
     return;
   }
 
-  socket.emit('get_room', { id: roomId }, (payload: Payload) => {
+  socket.emit('get_room', { id: roomId, tz: TIMEZONE }, (payload: Payload) => {
     if (payload.status_code !== 200) return;
     roomStore.set(payload.data);
     chatStore.set(null);
   });
 }
 
+let fetchingOlder = false;
+
+function fetchOlderMessages() {
+  const current = get(chatStore) ? get(chatStore) : get(roomStore);
+  if (!current || !current.next_cursor || fetchingOlder) return;
+
+  const isChat = current.type === 'chat';
+  const event = isChat ? 'get_chat' : 'get_room';
+  fetchingOlder = true;
+  socket.emit(
+    event,
+    { id: current.id, before: current.next_cursor, tz: TIMEZONE },
+    (payload: Payload) => {
+      fetchingOlder = false;
+      if (payload.status_code !== 200) return;
+
+      const currentStore = isChat ? chatStore : roomStore;
+      currentStore.update((chatOrRoom) => {
+        if (!chatOrRoom || chatOrRoom.id !== current.id) return chatOrRoom;
+
+        const older: DayMessages[] = payload.data.messages;
+        const first = chatOrRoom.messages[0];
+        const last = older[older.length - 1];
+        if (first && last && first.date === last.date) {
+          first.messages = [...last.messages, ...first.messages];
+          older.pop();
+        }
+        chatOrRoom.messages = [...older, ...chatOrRoom.messages];
+        chatOrRoom.next_cursor = payload.data.next_cursor;
+
+        return chatOrRoom;
+      });
+    }
+  );
+}
+
 function openChat(e: Event) {
   e.preventDefault();
 
@@ -53,7 +120,7 @@ function openChat(e: Event) {
     target.parentElement.parentElement.dataset.type;
   const event = type === 'chat' ? 'get_chat' : 'get_room';
 
-  socket.emit(event, { id: id }, (payload) => {
+  socket.emit(event, { id: id, tz: TIMEZONE }, (payload) => {
     if (payload.status_code !== 200) return;
 
     document.querySelector('#details-popup')?.remove();
@@ -93,9 +160,13 @@ function newChat(e: Event) {
   });
   for (const chat of chats) {
     if (chat.user_1 === username || chat.user_2 === username) {
-      socket.emit('get_chat', { id: chat.id }, (payload: Payload) => {
-        chatStore.set(payload.data);
-      });
+      socket.emit(
+        'get_chat',
+        { id: chat.id, tz: TIMEZONE },
+        (payload: Payload) => {
+          chatStore.set(payload.data);
+        }
+      );
       roomStore.set(null);
       changeState('home', chat.id, null);
       document.querySelector('#details-popup').remove();
@@ -111,8 +182,36 @@ function newChat(e: Event) {
   switchView(e);
 }
 
+// the server throttles too, this only saves sending what it drops
+const TYPING_THROTTLE_MS = 2000;
+let typingIn: string | null = null;
+let typingSentAt = 0;
+
+function typingStart() {
+  const current = get(chatStore) ? get(chatStore) : get(roomStore);
+  if (!current) return;
+
+  const now = Date.now();
+  if (typingIn === current.id && now - typingSentAt < TYPING_THROTTLE_MS)
+    return;
+  if (typingIn && typingIn !== current.id) typingStop();
+
+  typingIn = current.id;
+  typingSentAt = now;
+  socket.emit('typing_start', { id: current.id });
+}
+
+function typingStop() {
+  if (!typingIn) return;
+
+  socket.emit('typing_stop', { id: typingIn });
+  typingIn = null;
+  typingSentAt = 0;
+}
+
 function sendMessage(e: SubmitEvent) {
   e.preventDefault();
+  typingStop();
 
   let current = get(chatStore) ? get(chatStore) : get(roomStore);
   const when = new Date().toISOString();
@@ -161,7 +260,9 @@ function sendMessage(e: SubmitEvent) {
   socket.emit('new_message', newMessagePayload, (payload: Payload) => {
     if (payload.status_code !== 201) return;
 
-    current = addMessageToChat(current, message);
+    // the stored message, with its id and sequence number
+    const sent: Message = payload.data || message;
+    current = addMessageToChat(current, sent);
     if (get(chatStore)) {
       chatStore.set(<Chat>current);
       roomStore.set(null);
@@ -172,7 +273,7 @@ function sendMessage(e: SubmitEvent) {
       changeState('home', null, current.id);
     }
 
-    updateChatList(current.id, message);
+    updateChatList(current.id, sent);
     textInput.value = '';
     textInput.focus();
   });
@@ -180,7 +281,12 @@ function sendMessage(e: SubmitEvent) {
 
 function addMessageToChat(chat: Chat | Room, message: Message) {
   let found = false;
-  const date = message.when.split('T')[0];
+  const when = new Date(message.when);
+  const date = [
+    when.getFullYear(),
+    String(when.getMonth() + 1).padStart(2, '0'),
+    String(when.getDate()).padStart(2, '0')
+  ].join('-');
 
   for (const dayMessage of chat.messages) {
     if (dayMessage.date === date) {
@@ -199,6 +305,19 @@ function addMessageToChat(chat: Chat | Room, message: Message) {
   return chat;
 }
 
+// the server batches these, so one is sent per message seen
+function markRead(
+  chat: { id: string; type: string },
+  message: Message | null
+) {
+  if (message && message.seq)
+    socket.emit('mark_read', {
+      id: chat.id,
+      type: chat.type,
+      seq: message.seq
+    });
+}
+
 function updateChatList(chatId: string, message: Message) {
   const current = get(chatStore) ? get(chatStore) : get(roomStore);
   const isCurrent = current && current.id === chatId;
@@ -209,10 +328,12 @@ function updateChatList(chatId: string, message: Message) {
 
   if (!message) {
     chatToUpdate.msgCount = 0;
+    markRead(chatToUpdate, chatToUpdate.last_msg);
     return;
   }
 
   chatToUpdate.last_msg = message;
+  if (isCurrent) markRead(chatToUpdate, message);
   if (chatToUpdate.msgCount && !isCurrent) {
     chatToUpdate.msgCount += 1;
   } else if (!isCurrent) {
@@ -464,9 +585,12 @@ function editRoomName(e: Event) {
 export {
   fetchUserChats,
   fetchCurrentChatOrRoom,
+  fetchOlderMessages,
   openChat,
   newChat,
   sendMessage,
+  typingStart,
+  typingStop,
   addOrRemoveMembers,
   addOrRemoveAdmin,
   leaveRoom,
@@ -1,6 +1,13 @@
 import io from 'socket.io-client';
 import { get } from 'svelte/store';
-import { activeChats, chatStore, roomStore, user, state } from '../lib/store';
+import {
+  activeChats,
+  chatStore,
+  roomStore,
+  user,
+  state,
+  typing
+} from '../lib/store';
 import {
   addMessageToChat,
   fetchUserChats,
@@ -19,17 +26,88 @@ const socket = io(`${SERVER_URL}`, {
   withCredentials: true
 });
 
+let connectedBefore = false;
+
 socket.on('connect', () => {
   console.log('connected');
+  if (connectedBefore) syncConversations(null);
+  connectedBefore = true;
+  syncPending(null);
 });
 
 socket.on('disconnect', () => {
   console.log('disconnected');
 });
 
-socket.on('new_message', (payload) => {
+// delivers the events missed while offline, one batch at a time,
+// acknowledging each batch when asking for the next one
+function syncPending(ack: string | null) {
+  socket.emit('sync_pending', { ack }, (payload: Payload) => {
+    if (payload.status_code !== 200) return;
+
+    for (const { event, data } of payload.data.events) {
+      if (event === 'new_message') onNewMessage(data, true);
+    }
+    if (payload.data.events.length) syncPending(payload.data.ack);
+  });
+}
+
+// fetches the messages sent in the loaded chats and rooms while
+// disconnected, from the sequence number of their last message
+function syncConversations(ids: string[] | null) {
+  const seqs = {};
+  for (const chatOrRoom of get(activeChats)) {
+    if (ids && !ids.includes(chatOrRoom.id)) continue;
+    if (chatOrRoom.last_msg && chatOrRoom.last_msg.seq)
+      seqs[chatOrRoom.id] = chatOrRoom.last_msg.seq;
+  }
+  if (!Object.keys(seqs).length) return;
+
+  socket.emit('sync', { seqs }, (payload: Payload) => {
+    if (payload.status_code !== 200) return;
+
+    const more = [];
+    for (const [id, { messages, more: hasMore }] of Object.entries(
+      payload.data
+    )) {
+      const chatOrRoom = get(activeChats).find((c) => c.id === id);
+      for (const message of messages)
+        onNewMessage({ message, id, type: chatOrRoom.type }, true);
+      if (hasMore) more.push(id);
+    }
+    if (more.length) syncConversations(more);
+  });
+}
+
+socket.on('new_message', (payload) => onNewMessage(payload));
+
+// indicators expire unless refreshed, so a lost stop clears itself
+socket.on('typing', (payload) => {
+  const expires = Date.now() + payload.ttl;
+  typing.update((all) => {
+    const users = { ...(all[payload.id] || {}) };
+    for (const username of payload.typing) users[username] = expires;
+    for (const username of payload.stopped) delete users[username];
+    return { ...all, [payload.id]: users };
+  });
+  setTimeout(() => {
+    typing.update((all) => {
+      const users = { ...(all[payload.id] || {}) };
+      for (const [username, until] of Object.entries(users)) {
+        if (until <= Date.now()) delete users[username];
+      }
+      return { ...all, [payload.id]: users };
+    });
+  }, payload.ttl);
+});
+
+function onNewMessage(payload, quiet = false) {
   const msg: Message = payload.message;
   const chatOrRoomId = payload.id;
+  const known = get(activeChats).find((c) => c.id === chatOrRoomId);
+  // already delivered, e.g. by a sync
+  if (msg.seq && known && known.last_msg && known.last_msg.seq >= msg.seq)
+    return;
   let current = get(chatStore) ? get(chatStore) : get(roomStore);
   const isCurrent = current && current.id === chatOrRoomId;
   const notificationMsg = `@${msg.sender}: ${msg.text.slice(0, 20)} ${
@@ -50,6 +128,7 @@ socket.on('new_message', (payload) => {
   }
 
   updateChatList(chatOrRoomId, msg);
+  if (quiet) return;
   notify
     .fire({
       icon: 'info',
@@ -71,7 +150,7 @@ socket.on('new_message', (payload) => {
         });
       }
     });
-});
+}
 
 function newRoomOrRoomUpdate(event: string, payload) {
   fetchUserChats();
@@ -10,10 +10,14 @@ const activeChats: Writable<(Chat | Room)[]> = writable([]);
 const chatStore: Writable<Chat> = writable(null);
 const roomStore: Writable<Room> = writable(null);
 
+// chat or room id -> username -> when the indicator expires, in ms
+const typing: Writable<Record<string, Record<string, number>>> = writable({});
+
 export {
   user,
   state,
   activeChats,
   chatStore,
-  roomStore
+  roomStore,
+  typing
 };
@@ -208,7 +208,8 @@ function formatDate(date: string, time = false) {
   });
   const today = new Date();
   const yesterday = new Date(today);
-  const d = new Date(date);
+  // day dates are local, so parse them as local midnight
+  const d = new Date(date.length === 10 ? `${date}T00:00` : date);
 
   yesterday.setDate(today.getDate() - 1);
 
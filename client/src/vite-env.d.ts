@@ -15,9 +15,11 @@ type Paragraph = HTMLParagraphElement;
 type Input = HTMLInputElement;
 
 type Message = {
+  id?: string;
   sender: string;
   when: string;
   text: string;
+  seq?: number | null;
 };
 
 type DayMessages = {
@@ -33,7 +35,9 @@ type Chat = {
   user_1: string;
   user_2: string;
   messages: DayMessages[];
+  next_cursor: string | null;
   msgCount: number = 0;
+  unread?: number;
 };
 
 type Room = {
@@ -43,11 +47,13 @@ type Room = {
   last_msg: Message;
   type: string;
   messages: DayMessages[];
+  next_cursor: string | null;
   members: string[];
   admins: string[];
   creator: string;
   updated_at: string;
   msgCount: number;
+  unread?: number;
 };
 
 type User = {
@@ -4,19 +4,36 @@ init file - defines the factory function
 """
 from contextlib import asynccontextmanager
 
-from socketio import AsyncServer, ASGIApp, AsyncAioPikaManager
-from fastapi import FastAPI
+from socketio import AsyncServer, ASGIApp
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from loguru import logger
 
 from app.routers.auth import auth_router
-from app.db import init_db, get_mongo_uri, get_rabbitmq_uri
+from app.middlewares.auth import authenticate
+from app.encoders import JSON, FastJSONResponse
+from app.db import (
+    init_db,
+    get_mongo_uri,
+    get_async_redis,
+    check_caches,
+    close_caches,
+    MESSAGE_BUFFER,
+    USER_CACHE,
+    USERNAME_INDEX,
+    PRESENCE,
+    READ_CURSORS,
+    TYPING,
+)
+from app.settings import settings
+from app.managers import client_manager, LocalFirst
 
 
 sio = AsyncServer(
     async_mode="asgi",
-    client_manager=AsyncAioPikaManager(get_rabbitmq_uri()),
+    client_manager=client_manager(),
     cors_allowed_origins=[],
+    json=JSON,
 )
 
 sio_app = ASGIApp(
@@ -37,14 +54,37 @@ ORIGINS = [
 async def lifecycle(app: FastAPI):
     """app lifecycle"""
     # logger.info('starting app')
+    await check_caches()
     await init_db(get_mongo_uri())
+    if settings.MESSAGE_WRITE_BEHIND:
+        MESSAGE_BUFFER.start()
+    pubsub = get_async_redis(settings.REDIS_SESSION_DB)
+    USER_CACHE.start(pubsub)
+    if settings.USERNAME_INDEX:
+        USERNAME_INDEX.start(pubsub)
+    PRESENCE.start(sio.emit)
+    READ_CURSORS.start()
+    TYPING.start(sio.emit)
     yield
     # logger.info('stopping app')
+    await PRESENCE.stop()
+    await TYPING.stop()
+    if isinstance(sio.manager, LocalFirst):
+        await sio.manager.stop()
+    await MESSAGE_BUFFER.stop()
+    await READ_CURSORS.stop()
+    await USER_CACHE.stop()
+    await USERNAME_INDEX.stop()
+    await pubsub.aclose()
+    await close_caches()
 
 
 def create_app() -> FastAPI:
     """app factory function"""
-    app = FastAPI(lifespan=lifecycle)
+    app = FastAPI(
+        lifespan=lifecycle,
+        default_response_class=FastJSONResponse,
+    )
     app.add_middleware(
         CORSMiddleware,
         allow_origins=ORIGINS,
@@ -59,4 +99,22 @@ def create_app() -> FastAPI:
     async def root():
         return {"message": "Welcome to the PopChat API!"}
 
+    if not settings.METRICS_ENABLED:
+        return app
+
+    @app.get("/api/metrics", dependencies=[Depends(authenticate)])
+    async def metrics():
+        return {
+            "message_buffer": MESSAGE_BUFFER.stats(),
+            "user_cache": USER_CACHE.stats(),
+            "username_index": USERNAME_INDEX.stats(),
+            "read_cursors": READ_CURSORS.stats(),
+            "typing": TYPING.stats(),
+            "client_manager": (
+                sio.manager.stats()
+                if isinstance(sio.manager, LocalFirst)
+                else {}
+            ),
+        }
+
     return app
@@ -3,7 +3,24 @@
 Instantiates a database storage engine instance.
 """
 from redis.exceptions import ConnectionError
-from .engine import Cache, init_db, get_mongo_uri, get_rabbitmq_uri
+from .engine import (
+    Cache,
+    init_db,
+    get_mongo_uri,
+    get_rabbitmq_uri,
+    get_redis_uri,
+    get_async_redis,
+)
+from .buffer import MessageBuffer
+from .user_cache import UserCache
+from .membership import MembershipIndex
+from .inbox import Inbox
+from .presence import Presence
+from .pending import PendingQueue
+from .read_cursors import ReadCursors
+from .sequences import Sequences
+from .typing import Typing
+from .username_index import UsernameIndex
 
 from app.settings import settings
 
@@ -12,9 +29,78 @@ SESSION_CACHE = Cache(
     ttl=settings.REDIS_TTL,
     db=settings.REDIS_SESSION_DB,
 )
-SOCKETIO_CACHE = Cache(
-    ttl=settings.REDIS_TTL,
-    db=settings.REDIS_SOCKETIO_DB,
+PRESENCE_REDIS = get_async_redis(settings.REDIS_SOCKETIO_DB)
+
+
+async def check_caches() -> None:
+    """
+    checks that redis is reachable, called at startup
+    instead of at import time, so importing never blocks
+
+    :raises ConnectionError if it is not
+    """
+    if not await SESSION_CACHE.ping() or not await PRESENCE_REDIS.ping():
+        raise ConnectionError("redis cache is not available")
+
+
+async def close_caches() -> None:
+    """closes the redis connection pools"""
+    await SESSION_CACHE.close()
+    await PRESENCE_REDIS.aclose()
+    await INDEX_REDIS.aclose()
+
+
+MESSAGE_BUFFER = MessageBuffer(
+    max_size=settings.MESSAGE_FLUSH_SIZE,
+    interval_ms=settings.MESSAGE_FLUSH_INTERVAL_MS,
+    max_retries=settings.MESSAGE_FLUSH_RETRIES,
+)
+
+USER_CACHE = UserCache(
+    max_size=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    channel=settings.USER_CACHE_CHANNEL,
+)
+
+USERNAME_INDEX = UsernameIndex(
+    max_size=settings.USERNAME_INDEX_MAX,
+    channel=settings.USERNAME_INDEX_CHANNEL,
+)
+
+INDEX_REDIS = get_async_redis(settings.REDIS_INDEX_DB)
+
+MEMBERSHIP = MembershipIndex(
+    redis=INDEX_REDIS,
+    ttl=settings.MEMBERSHIP_TTL,
+)
+
+INBOX = Inbox(
+    redis=INDEX_REDIS,
+    ttl=settings.INBOX_TTL,
+)
+
+PRESENCE = Presence(
+    redis=PRESENCE_REDIS,
+    ttl=settings.PRESENCE_TTL,
+    heartbeat=settings.PRESENCE_HEARTBEAT,
+    coalesce_ms=settings.PRESENCE_COALESCE_MS,
+)
+
+SEQUENCES = Sequences(
+    redis=INDEX_REDIS,
+    ttl=settings.SEQUENCE_TTL,
+)
+
+PENDING = PendingQueue(
+    redis=INDEX_REDIS,
+    max_len=settings.PENDING_MAX_LEN,
+    max_age=settings.PENDING_MAX_AGE,
+)
+
+READ_CURSORS = ReadCursors(coalesce_ms=settings.READ_COALESCE_MS)
+
+TYPING = Typing(
+    throttle_ms=settings.TYPING_THROTTLE_MS,
+    interval_ms=settings.TYPING_INTERVAL_MS,
+    ttl_ms=settings.TYPING_TTL_MS,
 )
-if not SESSION_CACHE.ping() or not SOCKETIO_CACHE.ping():
-    raise ConnectionError("redis cache is not available")
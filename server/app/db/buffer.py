@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Defines the write-behind buffer for messages.
+"""
+import asyncio
+from time import perf_counter
+
+from beanie import PydanticObjectId
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.models.chat import Chat
+from app.models.room import Room
+from app.models.message import Message
+from app.models.bucket import MessageBucket
+from app.settings import settings, MessageStorage
+from app.utils import last_msg_pipeline
+
+
+DUPLICATE_KEY = 11000
+
+
+class MessageBuffer:
+    """
+    collects messages in memory and persists them in batches,
+    every `max_size` messages or `interval_ms` milliseconds,
+    whichever comes first. a failed batch is queued again, and a
+    message still not written after `max_retries` flushes is
+    written on its own, then dropped and logged if that fails too,
+    so one bad message cannot hold the others back
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        interval_ms: int,
+        max_retries: int = 3,
+    ) -> None:
+        """initializes the buffer"""
+
+        self.max_size = max_size
+        self.interval = interval_ms / 1000
+        self.max_retries = max_retries
+        self.pending: list[tuple[type[Chat] | type[Room], Message]] = []
+        # message id -> failed flushes, for the messages queued again
+        self.attempts: dict[PydanticObjectId, int] = {}
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.enqueued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def put(self, cls: type[Chat] | type[Room], message: Message) -> None:
+        """
+        queues a message for persistence. the message must
+        already have its id and chat_id set
+        """
+        self.pending.append((cls, message))
+        self.enqueued += 1
+        if len(self.pending) >= self.max_size:
+            self.wakeup.set()
+
+    def start(self) -> None:
+        """starts the periodic flush task"""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """
+        stops the flush task and drains the buffer. never raises,
+        each message is retried at most `max_retries` times
+        """
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        while self.pending:
+            await self.flush()
+
+    async def run(self) -> None:
+        """flushes the buffer until cancelled"""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            if self.pending:
+                await self.flush()
+
+    async def flush(self) -> None:
+        """persists the buffered messages, never raises"""
+
+        batch, self.pending = self.pending, []
+        retry = any(msg.id in self.attempts for _, msg in batch)
+        start = perf_counter()
+        try:
+            await self.write(batch, retry)
+            self.flushed += len(batch)
+            for _, message in batch:
+                self.attempts.pop(message.id, None)
+        except Exception as err:
+            self.failures += 1
+            logger.error(f"failed to flush {len(batch)} messages: {err}")
+            await self.retry(batch)
+        finally:
+            self.flushes += 1
+            self.last_flush_ms = (perf_counter() - start) * 1000
+            self.max_flush_ms = max(self.max_flush_ms, self.last_flush_ms)
+
+    async def retry(
+        self,
+        batch: list[tuple[type[Chat] | type[Room], Message]],
+    ) -> None:
+        """
+        queues a failed batch again, and writes the messages out of
+        retries one by one, dropping the ones that still fail
+        """
+        again, exhausted = [], []
+        for item in batch:
+            attempts = self.attempts.get(item[1].id, 0) + 1
+            if attempts < self.max_retries:
+                self.attempts[item[1].id] = attempts
+                again.append(item)
+            else:
+                self.attempts.pop(item[1].id, None)
+                exhausted.append(item)
+        self.pending = again + self.pending
+
+        for cls, message in exhausted:
+            try:
+                await self.write([(cls, message)], retry=True)
+                self.flushed += 1
+            except Exception as err:
+                self.dropped += 1
+                logger.error(
+                    f"dropped message {message.id} of {cls.__name__} "
+                    f"{message.chat_id} after {self.max_retries} failed "
+                    f"flushes: {err}. message: {message.to_doc()}"
+                )
+
+    async def write(
+        self,
+        batch: list[tuple[type[Chat] | type[Room], Message]],
+        retry: bool = False,
+    ) -> None:
+        """
+        moves each parent forward to its newest message and its
+        highest sequence number, then inserts the messages whose
+        parent exists
+
+        :param retry: whether some messages may have been written
+            by a failed flush already
+        """
+
+        latest: dict[PydanticObjectId, tuple[type, Message]] = {}
+        high: dict[PydanticObjectId, int] = {}
+        for cls, message in batch:
+            current = latest.get(message.chat_id)
+            if current is None or current[1].when < message.when:
+                latest[message.chat_id] = (cls, message)
+            high[message.chat_id] = max(
+                message.seq, high.get(message.chat_id, 0)
+            )
+
+        missing: set[PydanticObjectId] = set()
+        for cls in (Chat, Room):
+            c_ids = [c_id for c_id, (c, _) in latest.items() if c is cls]
+            if not c_ids:
+                continue
+
+            ops = [
+                UpdateOne(
+                    {"_id": c_id, "is_deleted": False},
+                    last_msg_pipeline(latest[c_id][1], high[c_id]),
+                )
+                for c_id in c_ids
+            ]
+            collection = cls.get_motor_collection()
+            result = await collection.bulk_write(ops, ordered=False)
+            if result.matched_count < len(ops):
+                found = await collection.distinct(
+                    "_id", {"_id": {"$in": c_ids}, "is_deleted": False}
+                )
+                missing.update(set(c_ids) - set(found))
+
+        messages = [msg for _, msg in batch if msg.chat_id not in missing]
+        if not messages:
+            return
+
+        if settings.MESSAGE_STORAGE == MessageStorage.BUCKET.value:
+            if retry:
+                # an ordered write stops at its first error, after
+                # pushing the messages before it, and pushing one
+                # again would store it twice
+                stored = await MessageBucket.get_motor_collection().distinct(
+                    "messages._id",
+                    {
+                        "chat_id": {"$in": [m.chat_id for m in messages]},
+                        "messages._id": {"$in": [m.id for m in messages]},
+                    },
+                )
+                stored = set(stored)
+                messages = [m for m in messages if m.id not in stored]
+                if not messages:
+                    return
+
+            # ordered, so each upsert sees the bucket sizes left by
+            # the previous ones
+            await MessageBucket.get_motor_collection().bulk_write(
+                [
+                    UpdateOne(
+                        *MessageBucket.append_update(
+                            msg, settings.MESSAGE_BUCKET_SIZE
+                        ),
+                        upsert=True,
+                    )
+                    for msg in messages
+                ],
+                ordered=True,
+            )
+            return
+
+        try:
+            await Message.insert_many(messages, ordered=False)
+        except BulkWriteError as err:
+            # messages written by a previous, partially failed flush
+            # are already persisted
+            errors = err.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY for error in errors):
+                raise
+
+    def stats(self) -> dict:
+        """returns the buffer metrics"""
+        return {
+            "depth": len(self.pending),
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "retrying": len(self.attempts),
+            "dropped": self.dropped,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+        }
@@ -5,8 +5,9 @@ Defines the storage engine.
 """
 from typing import TypeVar
 
-from redis import Redis, ConnectionPool
-from redis.retry import Retry
+from redis.asyncio import Redis, ConnectionPool
+from redis.asyncio.client import Pipeline
+from redis.asyncio.retry import Retry
 from redis.backoff import ExponentialBackoff
 from decouple import config
 from motor.motor_asyncio import AsyncIOMotorClient
@@ -16,6 +17,8 @@ from app.models.user import User
 from app.models.chat import Chat
 from app.models.room import Room
 from app.models.message import Message
+from app.models.bucket import MessageBucket
+from app.models.read_state import ReadState
 from app.settings import settings
 
 
@@ -50,6 +53,42 @@ def get_rabbitmq_uri() -> str:
     )
 
 
+def get_redis_uri(db: int) -> str:
+    """returns the redis uri"""
+    if settings.REDIS_PASSWD:
+        return (
+            f"redis://:{settings.REDIS_PASSWD}"
+            f"@{settings.REDIS_HOST}:{settings.REDIS_PORT}/{db}"
+        )
+
+    return f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}/{db}"
+
+
+REDIS_RETRY_POLICY = Retry(
+    ExponentialBackoff(),
+    retries=5,
+)
+
+
+def get_async_redis(db: int) -> Redis:
+    """
+    returns an asyncio redis client drawing its connections from
+    its own bounded pool, which retries failed commands with
+    backoff and checks idle connections before reusing them
+    """
+    conn = ConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=db,
+        password=settings.REDIS_PASSWD,
+        decode_responses=True,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        retry=REDIS_RETRY_POLICY,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+    return Redis(connection_pool=conn)
+
+
 async def init_db(uri: str) -> None:
     """
     initializes the db
@@ -61,69 +100,79 @@ async def init_db(uri: str) -> None:
 
     await init_beanie(
         database=client[settings.DB_NAME],
-        document_models=[User, Chat, Room, Message],
+        document_models=[
+            User,
+            Chat,
+            Room,
+            Message,
+            MessageBucket,
+            ReadState,
+        ],
+    )
+    # users created before username search was indexed
+    await User.get_motor_collection().update_many(
+        {"username_lower": None},
+        [{"$set": {"username_lower": {"$toLower": "$username"}}}],
     )
 
 
 class Cache:
     """
-    a redis cache for storing session keys
+    an asyncio redis cache for storing session keys. every
+    instance draws its connections from its own pool, see
+    `get_async_redis`, so concurrent handlers never wait on each
+    other's round trips
     """
 
-    HOST = settings.REDIS_HOST
-    PORT = settings.REDIS_PORT
-    PASSWD = settings.REDIS_PASSWD
-    RETRY_POLICY = Retry(
-        ExponentialBackoff(),
-        retries=5,
-    )
-
     def __init__(self, db: int, ttl: int) -> None:
         """initializes the redis client"""
 
-        conn = ConnectionPool(
-            host=self.HOST,
-            port=self.PORT,
-            db=db,
-            password=self.PASSWD,
-            decode_responses=True,
-            retry=self.RETRY_POLICY,
-        )
-        self.redis = Redis(connection_pool=conn)
+        self.redis = get_async_redis(db)
         self.TTL = ttl
 
-    def ping(self) -> bool:
+    async def ping(self) -> bool:
         """checks if the cache is available"""
-        return self.redis.ping()
+        return await self.redis.ping()
 
-    def get(self, key: str) -> str | None:
+    async def get(self, key: str) -> str | None:
         """fetches a value from the cache"""
         if key is None:
             return None
 
-        return self.redis.get(key)
+        return await self.redis.get(key)
 
-    def setv(self, key: str, value: str) -> None:
+    async def setv(self, key: str, value: str) -> None:
         """
         sets a value in the cache with a ttl
         """
         if key is None or value is None:
             return None
 
-        self.redis.set(key, value)
+        await self.redis.set(key, value)
 
-    def setex(self, key: str, value: str) -> None:
+    async def setex(self, key: str, value: str) -> None:
         """
         sets a value in the cache with a ttl
         """
         if key is None or value is None:
             return None
 
-        self.redis.setex(key, self.TTL, value)
+        await self.redis.setex(key, self.TTL, value)
 
-    def delete(self, key: str) -> None:
+    async def delete(self, key: str) -> None:
         """deletes a value from the cache"""
         if key is None:
             return None
 
-        self.redis.delete(key)
+        await self.redis.delete(key)
+
+    def pipeline(self, transaction: bool = False) -> Pipeline:
+        """
+        returns a pipeline, to batch commands in one round trip.
+        use it as an async context manager and `await execute()`
+        """
+        return self.redis.pipeline(transaction=transaction)
+
+    async def close(self) -> None:
+        """closes the connections of the pool"""
+        await self.redis.aclose()
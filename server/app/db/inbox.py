@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Defines the per-user inbox.
+"""
+from datetime import datetime, UTC
+
+from beanie import PydanticObjectId
+from beanie.operators import Or
+from redis.asyncio import Redis
+
+from app.encoders import JSON
+from app.models.chat import Chat
+from app.models.room import Room
+from app.models.user import User
+from app.schemas.models import ChatSchema, RoomSchema
+
+
+# moves a conversation forward in the summary and in the inboxes
+# of its members, never backwards. inboxes that are not built are
+# skipped, they are rebuilt from mongo when next read
+# KEYS[1]: the summary, KEYS[2...]: member inboxes, then their markers
+# ARGV[1]: activity in ms, ARGV[2]: conversation id,
+# ARGV[3]: last message json or "", ARGV[4]: updated_at,
+# ARGV[5]: sequence number of the last message, 0 if none
+TOUCH = """
+local at = tonumber(redis.call("HGET", KEYS[1], "at") or "0")
+if tonumber(ARGV[1]) > at then
+    redis.call("HSET", KEYS[1], "at", ARGV[1], "updated_at", ARGV[4])
+    if ARGV[3] ~= "" then
+        redis.call("HSET", KEYS[1], "last_msg", ARGV[3])
+    end
+end
+local seq = tonumber(redis.call("HGET", KEYS[1], "seq") or "0")
+if tonumber(ARGV[5]) > seq then
+    redis.call("HSET", KEYS[1], "seq", ARGV[5])
+end
+local n = (#KEYS - 1) / 2
+for i = 2, n + 1 do
+    if redis.call("EXISTS", KEYS[n + i]) == 1 then
+        redis.call("ZADD", KEYS[i], "GT", ARGV[1], ARGV[2])
+    end
+end
+return n
+"""
+
+
+def to_ms(when: datetime) -> int:
+    """converts a datetime, naive ones being UTC, to epoch ms"""
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=UTC)
+
+    return int(when.timestamp() * 1000)
+
+
+def to_iso(when: datetime) -> str:
+    """formats a datetime the way the api does"""
+    when_str = when.isoformat()
+    return when_str if "+" in when_str else when_str + "Z"
+
+
+class Inbox:
+    """
+    the chat list of every user, as a redis sorted set of the ids
+    of their conversations scored by last activity, next to one
+    summary hash per conversation holding what the list shows.
+    sending a message updates one summary and one score per member
+    instead of the list being recomputed from mongo on every read
+    """
+
+    STATIC_FIELDS = ("id", "type", "name", "user_1", "user_2")
+
+    def __init__(self, redis: Redis, ttl: int) -> None:
+        """initializes the inbox"""
+        self.redis = redis
+        self.ttl = ttl
+        self.touch_script = redis.register_script(TOUCH)
+
+    @staticmethod
+    def key(user_id) -> str:
+        """returns the key of the inbox of a user"""
+        return f"inbox:{user_id}"
+
+    @staticmethod
+    def marker(user_id) -> str:
+        """returns the key marking the inbox of a user as built"""
+        return f"inbox:{user_id}:built"
+
+    @staticmethod
+    def summary(c_id) -> str:
+        """returns the key of the summary of a conversation"""
+        return f"summary:{c_id}"
+
+    async def touch(
+        self,
+        c_id,
+        member_ids: list,
+        when: datetime,
+        last_msg: dict | None = None,
+    ) -> None:
+        """
+        records activity in a conversation
+
+        :param c_id: id of the chat or room
+        :param member_ids: ids of the members whose inbox to update
+        :param when: when the activity happened
+        :param last_msg: the serialized message sent, if any
+        """
+        keys = [self.summary(c_id)]
+        keys += [self.key(user_id) for user_id in member_ids]
+        keys += [self.marker(user_id) for user_id in member_ids]
+        await self.touch_script(
+            keys=keys,
+            args=[
+                to_ms(when),
+                str(c_id),
+                JSON.dumps(last_msg) if last_msg else "",
+                to_iso(when),
+                (last_msg or {}).get("seq") or 0,
+            ],
+        )
+
+    async def add(self, c_id, member_ids: list) -> None:
+        """puts a conversation in the inboxes of new members"""
+        at = await self.redis.hget(self.summary(c_id), "at")
+        when = datetime.fromtimestamp(int(at) / 1000, UTC) if at else None
+        await self.touch(c_id, member_ids, when or datetime.now(UTC))
+
+    async def remove(self, c_id, member_ids: list) -> None:
+        """takes a conversation out of the inboxes of former members"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in member_ids:
+                pipe.zrem(self.key(user_id), str(c_id))
+            await pipe.execute()
+
+    async def forget(self, c_id) -> None:
+        """drops the static part of a summary, e.g. after a rename"""
+        await self.redis.hdel(self.summary(c_id), "info")
+
+    async def drop(self, c_id, member_ids: list) -> None:
+        """removes a deleted conversation"""
+        await self.remove(c_id, member_ids)
+        await self.redis.delete(self.summary(c_id))
+
+    async def load(self, user: User) -> None:
+        """rebuilds the inbox of a user from mongo"""
+
+        chats = await Chat.find(
+            Or(
+                Chat.user_1.username == user.username,
+                Chat.user_2.username == user.username,
+            ),
+            Chat.is_deleted == False,  # noqa E712
+            projection_model=ChatSchema,
+            fetch_links=True,
+        ).to_list()
+
+        rooms = await Room.find(
+            Room.members.username == user.username,
+            Room.is_deleted == False,  # noqa E712
+            projection_model=RoomSchema,
+            fetch_links=True,
+        ).to_list()
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self.key(user.id))
+            for chat_or_room in [*chats, *rooms]:
+                await self.write_summary(pipe, chat_or_room, [user.id])
+            pipe.set(self.marker(user.id), 1, ex=self.ttl)
+            pipe.expire(self.key(user.id), self.ttl)
+            await pipe.execute()
+
+    async def write_summary(
+        self,
+        pipe,
+        chat_or_room: ChatSchema | RoomSchema,
+        member_ids: list,
+    ) -> None:
+        """queues the writes of a summary loaded from mongo"""
+        data = chat_or_room.model_dump()
+        info = {k: data[k] for k in self.STATIC_FIELDS if k in data}
+        last_msg = chat_or_room.last_msg
+        when = last_msg.when if last_msg else chat_or_room.updated_at
+        when = when or datetime.now(UTC)
+        pipe.hset(self.summary(chat_or_room.id), "info", JSON.dumps(info))
+        for user_id in member_ids:
+            pipe.zadd(
+                self.key(user_id), {chat_or_room.id: to_ms(when)}, gt=True
+            )
+        await self.touch_script(
+            keys=[self.summary(chat_or_room.id)],
+            args=[
+                to_ms(when),
+                chat_or_room.id,
+                JSON.dumps(data["last_msg"]) if last_msg else "",
+                to_iso(when),
+                (last_msg.seq or 0) if last_msg else 0,
+            ],
+            client=pipe,
+        )
+
+    async def load_summary(self, c_id: str) -> bool:
+        """
+        rebuilds the summary of a conversation from mongo
+
+        :return False if the conversation does not exist
+        """
+        oid = PydanticObjectId(c_id)
+        chat_or_room = await Chat.find(
+            Chat.id == oid,
+            Chat.is_deleted == False,  # noqa E712
+            projection_model=ChatSchema,
+            fetch_links=True,
+        ).first_or_none()
+        if chat_or_room is None:
+            chat_or_room = await Room.find(
+                Room.id == oid,
+                Room.is_deleted == False,  # noqa E712
+                projection_model=RoomSchema,
+                fetch_links=True,
+            ).first_or_none()
+        if chat_or_room is None:
+            return False
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            await self.write_summary(pipe, chat_or_room, [])
+            await pipe.execute()
+        return True
+
+    async def cached_ids(self, user: User) -> list[str] | None:
+        """
+        returns the ids of all the conversations of a user, or
+        None if their inbox is not built
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(self.marker(user.id))
+            pipe.zrange(self.key(user.id), 0, -1)
+            built, c_ids = await pipe.execute()
+
+        return c_ids if built else None
+
+    async def ids(self, user: User) -> list[str]:
+        """returns the ids of all the conversations of a user"""
+        if not await self.redis.exists(self.marker(user.id)):
+            await self.load(user)
+
+        return await self.redis.zrevrange(self.key(user.id), 0, -1)
+
+    async def page(
+        self,
+        user: User,
+        before: str | None = None,
+        limit: int | None = None,
+    ) -> list[dict]:
+        """
+        reads one page of the inbox of a user, newest first,
+        building it from mongo if needed
+
+        :param user: the user object
+        :param before: id of the last conversation of the previous page
+        :param limit: maximum number of conversations, all if None
+        :return the summaries of the conversations
+        :raises ValueError if `before` is not in the inbox
+        """
+        if not await self.redis.exists(self.marker(user.id)):
+            await self.load(user)
+
+        key = self.key(user.id)
+        if before is None:
+            stop = -1 if limit is None else limit - 1
+            c_ids = await self.redis.zrevrange(key, 0, stop)
+        else:
+            score = await self.redis.zscore(key, before)
+            if score is None:
+                raise ValueError("invalid cursor")
+            # conversations active in the same ms as the cursor come
+            # in descending id order, before the older ones
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zrevrangebyscore(key, score, score)
+                pipe.zrevrangebyscore(
+                    key,
+                    f"({score}",
+                    "-inf",
+                    start=0 if limit is not None else None,
+                    num=limit,
+                )
+                ties, older = await pipe.execute()
+            c_ids = [c_id for c_id in ties if c_id < before] + older
+            if limit is not None:
+                c_ids = c_ids[:limit]
+
+        summaries = await self.summaries(c_ids)
+        return [summary for summary in summaries if summary is not None]
+
+    async def seq(self, c_id) -> int:
+        """
+        returns the sequence number of the last message of a
+        conversation, 0 if it has none or does not exist
+        """
+        [summary] = await self.summaries([str(c_id)])
+        return summary["seq"] if summary else 0
+
+    async def summaries(self, c_ids: list[str]) -> list[dict | None]:
+        """reads the summaries of conversations, rebuilding lost ones"""
+        fields = ("info", "last_msg", "updated_at", "seq")
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for c_id in c_ids:
+                pipe.hmget(self.summary(c_id), *fields)
+            rows = await pipe.execute()
+
+        for i, c_id in enumerate(c_ids):
+            if rows[i][0] is None and await self.load_summary(c_id):
+                rows[i] = await self.redis.hmget(self.summary(c_id), *fields)
+
+        summaries = []
+        for info, last_msg, updated_at, seq in rows:
+            if info is None:
+                summaries.append(None)
+                continue
+            summary = JSON.loads(info)
+            summary["last_msg"] = JSON.loads(last_msg) if last_msg else None
+            summary["updated_at"] = updated_at
+            summary["seq"] = int(seq or 0)
+            summaries.append(summary)
+
+        return summaries
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Defines the conversation membership index.
+"""
+from beanie import PydanticObjectId
+from redis.asyncio import Redis
+
+from app.models.chat import Chat
+from app.models.room import Room
+
+
+# changes a set only while the entry it belongs to is built, so
+# a mutation never leaves a partial set behind for a missing entry
+# KEYS[1]: the members set of the entry, KEYS[2]: the set to change
+# ARGV[1]: SADD or SREM, ARGV[2...]: user ids
+CHANGE_IF_BUILT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return 0
+end
+return redis.call(ARGV[1], KEYS[2], unpack(ARGV, 2))
+"""
+
+
+class MembershipIndex:
+    """
+    redis sets of the member ids (and, for rooms, admin ids plus
+    the creator id) of every conversation, for authorization checks
+    without reading linked users from mongo. entries are built from
+    mongo on first use, expire after `ttl` seconds of not being
+    rebuilt, and are updated after every mongo write
+    """
+
+    def __init__(self, redis: Redis, ttl: int) -> None:
+        """initializes the index"""
+        self.redis = redis
+        self.ttl = ttl
+        self.change_if_built = redis.register_script(CHANGE_IF_BUILT)
+
+    @staticmethod
+    def key(c_type: str, c_id: str, role: str) -> str:
+        """returns the key of one set of a conversation"""
+        return f"{c_type}:{c_id}:{role}"
+
+    async def load(self, c_type: str, c_id: str) -> bool:
+        """
+        builds the entry of a conversation from mongo
+
+        :return False if the conversation does not exist
+        """
+        if not PydanticObjectId.is_valid(c_id):
+            return False
+
+        c_id = str(c_id)
+        if c_type == "chat":
+            chat = await Chat.get_motor_collection().find_one(
+                {"_id": PydanticObjectId(c_id), "is_deleted": False},
+                {"user_1": 1, "user_2": 1},
+            )
+            if chat is None:
+                return False
+            await self.set_chat(c_id, [chat["user_1"].id, chat["user_2"].id])
+            return True
+
+        room = await Room.get_motor_collection().find_one(
+            {"_id": PydanticObjectId(c_id), "is_deleted": False},
+            {"creator": 1, "members": 1, "admins": 1},
+        )
+        if room is None:
+            return False
+        await self.set_room(
+            c_id,
+            room["creator"].id,
+            [ref.id for ref in room["members"]],
+            [ref.id for ref in room["admins"]],
+        )
+        return True
+
+    async def set_chat(self, chat_id: str, members: list) -> None:
+        """(re)writes the entry of a chat"""
+        key = self.key("chat", chat_id, "members")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.sadd(key, *map(str, members))
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def set_room(
+        self,
+        room_id: str,
+        creator,
+        members: list,
+        admins: list,
+    ) -> None:
+        """(re)writes the entry of a room"""
+        members_key = self.key("room", room_id, "members")
+        admins_key = self.key("room", room_id, "admins")
+        creator_key = self.key("room", room_id, "creator")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(members_key, admins_key)
+            pipe.sadd(members_key, *map(str, members))
+            if admins:
+                pipe.sadd(admins_key, *map(str, admins))
+            pipe.set(creator_key, str(creator))
+            for key in (members_key, admins_key, creator_key):
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    async def drop(self, c_type: str, c_id: str) -> None:
+        """removes the entry of a deleted conversation"""
+        await self.redis.delete(
+            *(
+                self.key(c_type, c_id, role)
+                for role in ("members", "admins", "creator")
+            )
+        )
+
+    async def check(self, c_type: str, c_id: str, role: str, user_id) -> bool:
+        """checks if a user is in a set, building the entry on a miss"""
+        members_key = self.key(c_type, c_id, "members")
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.exists(members_key)
+            pipe.sismember(self.key(c_type, c_id, role), str(user_id))
+            built, found = await pipe.execute()
+
+        if built:
+            return bool(found)
+        if not await self.load(c_type, c_id):
+            return False
+
+        return await self.redis.sismember(
+            self.key(c_type, c_id, role), str(user_id)
+        )
+
+    async def members(self, c_type: str, c_id: str) -> list[str]:
+        """returns the member ids of a chat or room"""
+        key = self.key(c_type, c_id, "members")
+        member_ids = await self.redis.smembers(key)
+        if not member_ids and await self.load(c_type, c_id):
+            member_ids = await self.redis.smembers(key)
+
+        return list(member_ids)
+
+    async def is_member(self, c_type: str, c_id: str, user_id) -> bool:
+        """checks if a user is a member of a chat or room"""
+        return await self.check(c_type, c_id, "members", user_id)
+
+    async def is_admin(self, room_id: str, user_id) -> bool:
+        """checks if a user is an admin of a room"""
+        return await self.check("room", room_id, "admins", user_id)
+
+    async def is_creator(self, room_id: str, user_id) -> bool:
+        """checks if a user created a room"""
+        creator_key = self.key("room", room_id, "creator")
+        creator = await self.redis.get(creator_key)
+        if creator is None:
+            if not await self.load("room", room_id):
+                return False
+            creator = await self.redis.get(creator_key)
+
+        return creator == str(user_id)
+
+    async def admins_among(self, room_id: str, user_ids: list) -> list[str]:
+        """returns the ids in `user_ids` that are admins of a room"""
+        user_ids = [str(user_id) for user_id in user_ids]
+        if not await self.redis.exists(self.key("room", room_id, "members")):
+            await self.load("room", room_id)
+
+        flags = await self.redis.smismember(
+            self.key("room", room_id, "admins"), user_ids
+        )
+        return [user_id for user_id, flag in zip(user_ids, flags) if flag]
+
+    async def change(
+        self,
+        c_type: str,
+        c_id: str,
+        role: str,
+        op: str,
+        user_ids: list,
+    ) -> None:
+        """adds or removes ids from a set of a built entry"""
+        if not user_ids:
+            return
+
+        await self.change_if_built(
+            keys=[
+                self.key(c_type, c_id, "members"),
+                self.key(c_type, c_id, role),
+            ],
+            args=[op, *map(str, user_ids)],
+        )
+
+    async def add_members(self, room_id: str, user_ids: list) -> None:
+        """records new members of a room"""
+        await self.change("room", room_id, "members", "SADD", user_ids)
+
+    async def remove_members(self, room_id: str, user_ids: list) -> None:
+        """forgets members of a room, and their admin status"""
+        await self.change("room", room_id, "admins", "SREM", user_ids)
+        await self.change("room", room_id, "members", "SREM", user_ids)
+
+    async def add_admin(self, room_id: str, user_id) -> None:
+        """records a new admin of a room"""
+        await self.change("room", room_id, "admins", "SADD", [user_id])
+
+    async def remove_admin(self, room_id: str, user_id) -> None:
+        """forgets an admin of a room"""
+        await self.change("room", room_id, "admins", "SREM", [user_id])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Defines the offline delivery queue.
+"""
+from time import time
+
+from redis.asyncio import Redis
+
+from app.encoders import JSON
+
+
+class PendingQueue:
+    """
+    a redis stream per user of the events sent while they were
+    offline. streams are trimmed to the last `max_len` events and
+    to the last `max_age` seconds, and expire once idle that long.
+    a reconnecting client reads them in batches, acknowledging each
+    batch with the id of its last event, which trims it away, so a
+    reconnect costs what was missed instead of full histories
+    """
+
+    def __init__(self, redis: Redis, max_len: int, max_age: int) -> None:
+        """initializes the queue"""
+        self.redis = redis
+        self.max_len = max_len
+        self.max_age = max_age
+
+    @staticmethod
+    def key(user_id) -> str:
+        """returns the key of the stream of a user"""
+        return f"pending:{user_id}"
+
+    @staticmethod
+    def next_id(entry_id: str) -> str:
+        """returns the smallest stream id greater than `entry_id`"""
+        ms, _, seq = entry_id.partition("-")
+        return f"{int(ms)}-{int(seq or 0) + 1}"
+
+    async def push(self, user_ids: list, event: str, data: dict) -> None:
+        """
+        queues an event for offline users
+
+        :param user_ids: ids of the users to deliver it to
+        :param event: name of the socket.io event
+        :param data: payload of the event
+        """
+        if not user_ids:
+            return
+
+        fields = {"event": event, "data": JSON.dumps(data)}
+        oldest = int((time() - self.max_age) * 1000)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                key = self.key(user_id)
+                pipe.xadd(key, fields, maxlen=self.max_len, approximate=True)
+                pipe.xtrim(key, minid=oldest, approximate=True)
+                pipe.expire(key, self.max_age)
+            await pipe.execute()
+
+    async def read(
+        self,
+        user_id,
+        ack: str | None,
+        limit: int,
+    ) -> tuple[list[dict], str | None]:
+        """
+        acknowledges the events delivered so far and reads the next
+        batch, oldest first
+
+        :param user_id: id of the user
+        :param ack: id of the last event of the previous batch
+        :param limit: maximum number of events
+        :return the events and the id to acknowledge them with
+        :raises ValueError if `ack` is not a stream id
+        """
+        key = self.key(user_id)
+        start = "-"
+        if ack is not None:
+            try:
+                start = self.next_id(ack)
+            except ValueError:
+                raise ValueError("invalid ack")
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if ack is not None:
+                pipe.xtrim(key, minid=start)
+            pipe.xrange(key, min=start, count=limit)
+            entries = (await pipe.execute())[-1]
+
+        events = [
+            {"event": fields["event"], "data": JSON.loads(fields["data"])}
+            for _, fields in entries
+        ]
+        return events, entries[-1][0] if entries else None
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Defines the presence service.
+"""
+import asyncio
+from time import time
+from typing import Awaitable, Callable
+
+from loguru import logger
+from redis.asyncio import Redis
+
+
+# drops the expired sids of a user, then adds one
+# KEYS[1]: the sids of the user, ARGV[1]: now in ms,
+# ARGV[2]: expiry of the sid in ms, ARGV[3]: the sid
+# returns 1 if the user just came online
+ADD = """
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+local was_online = redis.call("ZCARD", KEYS[1]) > 0
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[3])
+redis.call("PEXPIREAT", KEYS[1], ARGV[2])
+if was_online then return 0 end
+return 1
+"""
+
+# removes one sid of a user and drops the expired ones
+# KEYS[1]: the sids of the user, ARGV[1]: now in ms, ARGV[2]: the sid
+# returns 1 if the user just went offline
+REMOVE = """
+if redis.call("ZREM", KEYS[1], ARGV[2]) == 0 then return 0 end
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+if redis.call("ZCARD", KEYS[1]) > 0 then return 0 end
+return 1
+"""
+
+
+class Presence:
+    """
+    tracks the sids of every connected user as a redis sorted set
+    scored by expiry, so a user stays online while any of their
+    tabs or devices is connected to any worker. each worker keeps
+    the sids of its own connections alive with a heartbeat; the
+    sids of a worker that dies expire after `ttl` seconds.
+
+    users coming online or going offline are announced to their
+    conversations in one `presence` event per conversation every
+    `coalesce_ms` milliseconds, with the last state of each user
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        ttl: int,
+        heartbeat: int,
+        coalesce_ms: int,
+    ) -> None:
+        """initializes the service"""
+
+        self.redis = redis
+        self.ttl_ms = ttl * 1000
+        self.heartbeat = heartbeat
+        self.coalesce = coalesce_ms / 1000
+        self.add_script = redis.register_script(ADD)
+        self.remove_script = redis.register_script(REMOVE)
+        # sid -> (user id, username, conversation ids), this node only
+        self.local: dict[str, tuple[str, str, list[str]]] = {}
+        # user id -> (online, username, conversation ids)
+        self.changes: dict[str, tuple[bool, str, list[str]]] = {}
+        self.emit: Callable[..., Awaitable] | None = None
+        self.tasks: list[asyncio.Task] = []
+
+    @staticmethod
+    def key(user_id) -> str:
+        """returns the key of the sids of a user"""
+        return f"presence:{user_id}"
+
+    @staticmethod
+    def now_ms() -> int:
+        """returns the current time in ms"""
+        return int(time() * 1000)
+
+    async def add(
+        self,
+        user_id,
+        sid: str,
+        username: str,
+        c_ids: list[str],
+    ) -> None:
+        """
+        records a connection
+
+        :param user_id: id of the user
+        :param sid: the socket id of the connection
+        :param username: the username of the user, for the events
+        :param c_ids: ids of the chats and rooms to notify
+        """
+        user_id = str(user_id)
+        self.local[sid] = (user_id, username, c_ids)
+        now = self.now_ms()
+        came_online = await self.add_script(
+            keys=[self.key(user_id)],
+            args=[now, now + self.ttl_ms, sid],
+        )
+        if came_online:
+            self.changes[user_id] = (True, username, c_ids)
+
+    async def remove(self, sid: str) -> None:
+        """forgets a connection of this node"""
+        entry = self.local.pop(sid, None)
+        if entry is None:
+            return
+
+        user_id, username, c_ids = entry
+        went_offline = await self.remove_script(
+            keys=[self.key(user_id)],
+            args=[self.now_ms(), sid],
+        )
+        if went_offline:
+            self.changes[user_id] = (False, username, c_ids)
+
+    def username(self, sid: str) -> str | None:
+        """returns the username of a connection of this node"""
+        entry = self.local.get(sid)
+        return entry[1] if entry else None
+
+    async def sids(self, user_ids: list) -> dict[str, list[str]]:
+        """
+        returns the live sids of each of `user_ids`, in one round trip
+
+        :return the sids of the users, by user id
+        """
+        user_ids = [str(user_id) for user_id in user_ids]
+        if not user_ids:
+            return {}
+
+        now = self.now_ms()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrangebyscore(self.key(user_id), f"({now}", "+inf")
+            results = await pipe.execute()
+
+        return dict(zip(user_ids, results))
+
+    async def online(self, user_ids: list) -> set[str]:
+        """returns the ids of the users among `user_ids` online"""
+        sids = await self.sids(user_ids)
+        return {user_id for user_id, found in sids.items() if found}
+
+    def start(self, emit: Callable[..., Awaitable]) -> None:
+        """
+        starts the heartbeat and the presence events
+
+        :param emit: the function emitting socket.io events
+        """
+        self.emit = emit
+        if not self.tasks:
+            self.tasks = [
+                asyncio.create_task(self.beat()),
+                asyncio.create_task(self.announce()),
+            ]
+
+    async def stop(self) -> None:
+        """stops the tasks and drops the connections of this node"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+        for sid in list(self.local):
+            await self.remove(sid)
+
+    async def beat(self) -> None:
+        """keeps the sids of this node alive, until cancelled"""
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.refresh()
+            except Exception as err:
+                logger.error(f"presence heartbeat failed: {err}")
+
+    async def refresh(self) -> None:
+        """pushes the expiry of the sids of this node forward"""
+        if not self.local:
+            return
+
+        expires = self.now_ms() + self.ttl_ms
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for sid, (user_id, _, _) in list(self.local.items()):
+                key = self.key(user_id)
+                pipe.zadd(key, {sid: expires}, xx=True)
+                pipe.pexpireat(key, expires)
+            await pipe.execute()
+
+    async def announce(self) -> None:
+        """emits the coalesced presence changes, until cancelled"""
+        while True:
+            await asyncio.sleep(self.coalesce)
+            if not self.changes:
+                continue
+
+            changes, self.changes = self.changes, {}
+            events: dict[str, dict[str, list[str]]] = {}
+            for online, username, c_ids in changes.values():
+                status = "online" if online else "offline"
+                for c_id in c_ids:
+                    event = events.setdefault(
+                        c_id, {"online": [], "offline": []}
+                    )
+                    event[status].append(username)
+
+            for c_id, event in events.items():
+                try:
+                    await self.emit("presence", event, to=c_id)
+                except Exception as err:
+                    logger.error(f"presence event failed: {err}")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Defines the read cursors.
+"""
+import asyncio
+
+from beanie import PydanticObjectId
+from loguru import logger
+from pymongo import UpdateOne
+
+from app.models.read_state import ReadState
+
+
+class ReadCursors:
+    """
+    the sequence number of the last message each user has read in
+    each of their conversations. unread counts are the distance to
+    the sequence number of the conversation, so no message is ever
+    scanned. read acks come in bursts as clients scroll, so they are
+    kept in memory and written every `coalesce_ms` milliseconds, as
+    one `$max` update per user, which never moves a cursor back
+    """
+
+    def __init__(self, coalesce_ms: int) -> None:
+        """initializes the cursors"""
+
+        self.interval = coalesce_ms / 1000
+        # user id -> conversation id -> sequence number, not written yet
+        self.pending: dict[str, dict[str, int]] = {}
+        self.task: asyncio.Task | None = None
+        self.marked = 0
+        self.written = 0
+
+    def mark(self, user_id, c_id, seq: int) -> None:
+        """
+        records that a user has read a conversation up to a message
+
+        :param user_id: id of the user
+        :param c_id: id of the chat or room
+        :param seq: sequence number of the last message read
+        """
+        self.marked += 1
+        seqs = self.pending.setdefault(str(user_id), {})
+        c_id = str(c_id)
+        if seq > seqs.get(c_id, 0):
+            seqs[c_id] = seq
+
+    async def get(self, user_id) -> dict[str, int]:
+        """
+        returns the cursors of a user, including the ones this
+        worker has not written yet
+
+        :return the sequence numbers, by conversation id
+        """
+        state = await ReadState.get_motor_collection().find_one(
+            {"_id": PydanticObjectId(user_id)}
+        )
+        seqs = state["seqs"] if state else {}
+        for c_id, seq in self.pending.get(str(user_id), {}).items():
+            if seq > seqs.get(c_id, 0):
+                seqs[c_id] = seq
+
+        return seqs
+
+    def start(self) -> None:
+        """starts the periodic write task"""
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """stops the write task and writes what is left"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        if self.pending:
+            await self.flush()
+
+    async def run(self) -> None:
+        """writes the cursors until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.pending:
+                continue
+            try:
+                await self.flush()
+            except Exception as err:
+                logger.error(f"failed to write read cursors: {err}")
+
+    async def flush(self) -> None:
+        """writes the pending cursors, keeping them on failure"""
+
+        batch, self.pending = self.pending, {}
+        ops = [
+            UpdateOne(
+                {"_id": PydanticObjectId(user_id)},
+                {
+                    "$max": {
+                        f"seqs.{c_id}": seq for c_id, seq in seqs.items()
+                    }
+                },
+                upsert=True,
+            )
+            for user_id, seqs in batch.items()
+        ]
+        try:
+            await ReadState.get_motor_collection().bulk_write(
+                ops, ordered=False
+            )
+        except Exception:
+            for user_id, seqs in batch.items():
+                current = self.pending.setdefault(user_id, {})
+                for c_id, seq in seqs.items():
+                    current[c_id] = max(seq, current.get(c_id, 0))
+            raise
+
+        self.written += len(ops)
+
+    def stats(self) -> dict:
+        """returns the cursor metrics"""
+        return {
+            "pending": len(self.pending),
+            "marked": self.marked,
+            "written": self.written,
+        }
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Defines the per-conversation sequence counters.
+"""
+from redis.asyncio import Redis
+
+
+# takes the next number of a seeded counter, keeping it alive
+# KEYS[1]: the counter, ARGV[1]: ttl in seconds
+# returns nil if the counter is not seeded
+NEXT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return false
+end
+local seq = redis.call("INCR", KEYS[1])
+redis.call("EXPIRE", KEYS[1], ARGV[1])
+return seq
+"""
+
+# seeds a counter, unless another worker did first, then takes the
+# next number
+# KEYS[1]: the counter, ARGV[1]: the seed, ARGV[2]: ttl in seconds
+SEED = """
+redis.call("SET", KEYS[1], ARGV[1], "NX")
+local seq = redis.call("INCR", KEYS[1])
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return seq
+"""
+
+# gives back a number whose message was not written, if no other
+# number was taken since
+# KEYS[1]: the counter, ARGV[1]: the number
+RELEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DECR", KEYS[1])
+end
+return false
+"""
+
+
+class Sequences:
+    """
+    the counter of the sequence numbers of each conversation, in
+    redis, so a send takes its number without a mongo round trip.
+    the `seq` of a chat or room is the high-water mark of its
+    persisted messages; a counter is seeded from it on first use
+    and expires after `ttl` seconds without a send, long after the
+    messages it numbered were flushed, so reseeding never hands a
+    number out twice
+    """
+
+    def __init__(self, redis: Redis, ttl: int) -> None:
+        """initializes the counters"""
+        self.redis = redis
+        self.ttl = ttl
+        self.next_script = redis.register_script(NEXT)
+        self.seed_script = redis.register_script(SEED)
+        self.release_script = redis.register_script(RELEASE)
+
+    @staticmethod
+    def key(c_id) -> str:
+        """returns the key of the counter of a conversation"""
+        return f"seq:{c_id}"
+
+    async def next(self, cls, c_id) -> int | None:
+        """
+        takes the next sequence number of a chat or room
+
+        :param cls: Chat or Room
+        :param c_id: id of the chat or room
+        :return the number, None if the conversation does not exist
+        """
+        key = self.key(c_id)
+        seq = await self.next_script(keys=[key], args=[self.ttl])
+        if seq is not None:
+            return int(seq)
+
+        parent = await cls.get_motor_collection().find_one(
+            {"_id": c_id, "is_deleted": False}, {"seq": 1}
+        )
+        if parent is None:
+            return None
+
+        seq = await self.seed_script(
+            keys=[key], args=[parent.get("seq") or 0, self.ttl]
+        )
+        return int(seq)
+
+    async def current(self, c_id) -> int | None:
+        """
+        returns the last number handed out in a conversation, which
+        can be ahead of its persisted `seq` while messages are
+        buffered. None if the counter is not seeded
+        """
+        seq = await self.redis.get(self.key(c_id))
+        return int(seq) if seq is not None else None
+
+    async def release(self, c_id, seq: int) -> bool:
+        """
+        gives back a number whose message could not be written. it
+        is only taken back if it is still the last one handed out,
+        otherwise the conversation keeps a gap
+
+        :return True if the number was taken back
+        """
+        released = await self.release_script(
+            keys=[self.key(c_id)], args=[seq]
+        )
+        return released is not None
+
+    async def drop(self, c_id) -> None:
+        """forgets the counter of a deleted conversation"""
+        await self.redis.delete(self.key(c_id))
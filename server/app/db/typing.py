@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Defines the typing indicators.
+"""
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+
+class Typing:
+    """
+    relays who is typing in each conversation. nothing is stored
+    anywhere but in this node's memory: a connection is heard at
+    most once every `throttle_ms` per conversation while it keeps
+    typing, and the changes heard in a conversation are broadcast
+    through the client manager in one `typing` event every
+    `interval_ms`, so keystrokes cost a bounded number of manager
+    messages however fast anyone types. clients drop an indicator
+    `ttl_ms` after it was last broadcast, so a missed stop or a
+    dead node never leaves one behind
+    """
+
+    def __init__(self, throttle_ms: int, interval_ms: int, ttl_ms: int) -> None:
+        """initializes the indicators"""
+
+        self.throttle = throttle_ms / 1000
+        self.interval = interval_ms / 1000
+        self.ttl_ms = ttl_ms
+        self.clock: Callable[[], float] = monotonic
+        # sid -> conversation id -> (username, when last heard)
+        self.active: dict[str, dict[str, tuple[str, float]]] = {}
+        # conversation id -> username -> typing, not broadcast yet
+        self.changes: dict[str, dict[str, bool]] = {}
+        self.emit: Callable[..., Awaitable] | None = None
+        self.task: asyncio.Task | None = None
+        self.received = 0
+        self.throttled = 0
+        self.broadcasts = 0
+
+    def start_typing(self, sid: str, c_id: str, username: str) -> bool:
+        """
+        records a keystroke of a connection in a conversation
+
+        :return False if it was throttled
+        """
+        self.received += 1
+        now = self.clock()
+        typing = self.active.setdefault(sid, {})
+        last = typing.get(c_id)
+        if last is not None and now - last[1] < self.throttle:
+            self.throttled += 1
+            return False
+
+        typing[c_id] = (username, now)
+        self.changes.setdefault(c_id, {})[username] = True
+        return True
+
+    def stop_typing(self, sid: str, c_id: str) -> None:
+        """records that a connection stopped typing in a conversation"""
+        self.received += 1
+        typing = self.active.get(sid, {})
+        entry = typing.pop(c_id, None)
+        if not typing:
+            self.active.pop(sid, None)
+        if entry is not None:
+            self.changes.setdefault(c_id, {})[entry[0]] = False
+
+    def forget(self, sid: str) -> None:
+        """stops every indicator of a closed connection"""
+        for c_id, (username, _) in self.active.pop(sid, {}).items():
+            self.changes.setdefault(c_id, {})[username] = False
+
+    def start(self, emit: Callable[..., Awaitable]) -> None:
+        """
+        starts the broadcasts
+
+        :param emit: the function emitting socket.io events
+        """
+        self.emit = emit
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """stops the broadcasts"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self) -> None:
+        """broadcasts the coalesced changes, until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """broadcasts one event per conversation with changes"""
+        if not self.changes:
+            return
+
+        changes, self.changes = self.changes, {}
+        for c_id, users in changes.items():
+            event = {
+                "id": c_id,
+                "typing": [name for name, on in users.items() if on],
+                "stopped": [name for name, on in users.items() if not on],
+                "ttl": self.ttl_ms,
+            }
+            self.broadcasts += 1
+            try:
+                await self.emit("typing", event, to=c_id)
+            except Exception as err:
+                logger.error(f"typing event failed: {err}")
+
+    def stats(self) -> dict:
+        """returns the indicator metrics"""
+        return {
+            "connections": len(self.active),
+            "received": self.received,
+            "throttled": self.throttled,
+            "broadcasts": self.broadcasts,
+        }
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Defines the process-local user cache.
+"""
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from app.models.user import User
+
+
+class UserCache:
+    """
+    a bounded LRU cache of users with a ttl, indexed by id and by
+    username. cached users are shared between callers and must not
+    be mutated. workers evict changed users from each other's cache
+    through a redis pub/sub channel
+    """
+
+    RETRY_DELAY = 1
+
+    def __init__(self, max_size: int, ttl: int, channel: str) -> None:
+        """initializes the cache"""
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.channel = channel
+        self.users: OrderedDict[str, tuple[float, User]] = OrderedDict()
+        self.usernames: dict[str, str] = {}
+        self.redis: Redis | None = None
+        self.task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, user_id: str | None) -> User | None:
+        """returns a live entry, counting the hit or miss"""
+        entry = self.users.get(user_id) if user_id else None
+        if entry is None or entry[0] < monotonic():
+            if entry is not None:
+                self.evict(user_id)
+            self.misses += 1
+            return None
+
+        self.users.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def get_by_id(self, user_id: str) -> User | None:
+        """fetches a user by id"""
+        return self.lookup(str(user_id))
+
+    def get_by_username(self, username: str) -> User | None:
+        """fetches a user by username"""
+        return self.lookup(self.usernames.get(username))
+
+    def put(self, user: User) -> None:
+        """caches a user, evicting the least recently used if full"""
+        user_id = str(user.id)
+        self.evict(user_id)
+        self.users[user_id] = (monotonic() + self.ttl, user)
+        self.usernames[user.username] = user_id
+        while len(self.users) > self.max_size:
+            self.evict(next(iter(self.users)))
+            self.evictions += 1
+
+    def evict(self, user_id: str) -> None:
+        """drops a user from this worker's cache"""
+        entry = self.users.pop(user_id, None)
+        if entry is None:
+            return
+
+        username = entry[1].username
+        if self.usernames.get(username) == user_id:
+            del self.usernames[username]
+
+    def clear(self) -> None:
+        """drops every cached user"""
+        self.users.clear()
+        self.usernames.clear()
+
+    async def invalidate(self, user_id: str) -> None:
+        """drops a changed user from the cache of every worker"""
+        self.evict(str(user_id))
+        self.invalidations += 1
+        if self.redis is not None:
+            await self.redis.publish(self.channel, str(user_id))
+
+    def start(self, redis: Redis) -> None:
+        """starts listening for invalidations from other workers"""
+        self.redis = redis
+        if self.task is None:
+            self.task = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        """stops the listener"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def listen(self) -> None:
+        """evicts the users other workers invalidate, until cancelled"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # invalidations sent while unsubscribed were missed
+                self.clear()
+                async for msg in pubsub.listen():
+                    if msg["type"] == "message":
+                        self.evict(msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"user cache listener failed: {err}")
+                await asyncio.sleep(self.RETRY_DELAY)
+            finally:
+                await pubsub.reset()
+
+    def stats(self) -> dict:
+        """returns the cache metrics"""
+        return {
+            "size": len(self.users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
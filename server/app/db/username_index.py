@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Defines the in-memory username index.
+"""
+import asyncio
+from bisect import bisect_left, insort
+
+from loguru import logger
+from redis.asyncio import Redis
+
+from app.encoders import JSON
+from app.models.user import User
+
+
+class UsernameIndex:
+    """
+    a sorted array of (lowercase username, username, email, id)
+    entries answering username prefix searches from memory. it is
+    loaded from mongo in the background at startup and new users
+    are added through a redis pub/sub channel. until it is loaded,
+    or if the users outgrow `max_size`, searches fall back to mongo
+    """
+
+    RETRY_DELAY = 1
+    LOAD_BATCH = 10_000
+
+    def __init__(self, max_size: int, channel: str) -> None:
+        """initializes the index"""
+
+        self.max_size = max_size
+        self.channel = channel
+        self.entries: list[tuple[str, str, str, str]] = []
+        # new users announced while loading, added once loaded
+        self.pending: list[tuple[str, str, str, str]] | None = None
+        self.ready = False
+        self.redis: Redis | None = None
+        self.task: asyncio.Task | None = None
+        self.hits = 0
+        self.fallbacks = 0
+
+    def add(self, entry: tuple[str, str, str, str]) -> None:
+        """inserts an entry unless it is already there"""
+        if not self.ready:
+            if self.pending is not None:
+                self.pending.append(entry)
+            return
+
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            return
+
+        if len(self.entries) >= self.max_size:
+            logger.warning("username index is full, searching mongo")
+            self.ready = False
+            self.entries = []
+            return
+
+        insort(self.entries, entry)
+
+    @staticmethod
+    def entry(user: User | dict) -> tuple[str, str, str, str]:
+        """returns the entry of a user or raw user document"""
+        if isinstance(user, dict):
+            username, email, user_id = (
+                user["username"],
+                user["email"],
+                user["_id"],
+            )
+        else:
+            username, email, user_id = user.username, user.email, user.id
+
+        return username.lower(), username, email, str(user_id)
+
+    def search(
+        self,
+        prefix: str,
+        exclude: str,
+        after: str | None,
+        limit: int,
+    ) -> list[dict]:
+        """
+        returns the users whose username starts with `prefix`,
+        like `users_search`
+
+        :param prefix: the lowercase prefix
+        :param exclude: id of the user making the request
+        :param after: the lowercase last username of the previous page
+        :param limit: maximum number of matches
+        """
+        self.hits += 1
+        start = prefix if after is None or after < prefix else after
+        i = bisect_left(self.entries, (start,))
+        if after is not None and start == after:
+            while i < len(self.entries) and self.entries[i][0] == after:
+                i += 1
+
+        matches = []
+        for lower, username, email, user_id in self.entries[i:]:
+            if not lower.startswith(prefix) or len(matches) >= limit:
+                break
+            if user_id != exclude:
+                matches.append(
+                    {"username": username, "email": email, "id": user_id}
+                )
+
+        return matches
+
+    async def publish(self, user: User) -> None:
+        """announces a new user to the index of every worker"""
+        if self.redis is not None:
+            await self.redis.publish(self.channel, JSON.dumps(user))
+
+    def start(self, redis: Redis) -> None:
+        """starts loading the index and listening for new users"""
+        self.redis = redis
+        if self.task is None:
+            self.task = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        """stops the listener"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def load(self) -> None:
+        """(re)loads every username from mongo"""
+        self.ready = False
+        self.pending = []
+        entries = []
+        cursor = (
+            User.get_motor_collection()
+            .find({}, {"username": 1, "email": 1})
+            .batch_size(self.LOAD_BATCH)
+        )
+        async for user in cursor:
+            if len(entries) >= self.max_size:
+                logger.warning("too many users to index, searching mongo")
+                self.entries = []
+                self.pending = None
+                return
+            entries.append(self.entry(user))
+
+        entries.sort()
+        self.entries = entries
+        self.ready = True
+        pending, self.pending = self.pending, None
+        for entry in pending:
+            self.add(entry)
+        logger.info(f"username index loaded {len(entries)} users")
+
+    async def listen(self) -> None:
+        """
+        adds the users other workers announce, until cancelled.
+        the index is reloaded after every (re)subscription, as new
+        users may have been missed in between
+        """
+        while True:
+            pubsub = self.redis.pubsub()
+            loader = None
+            try:
+                await pubsub.subscribe(self.channel)
+                loader = asyncio.create_task(self.load())
+                async for msg in pubsub.listen():
+                    if msg["type"] != "message":
+                        continue
+                    user = JSON.loads(msg["data"])
+                    user["_id"] = user.pop("id")
+                    self.add(self.entry(user))
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"username index listener failed: {err}")
+                await asyncio.sleep(self.RETRY_DELAY)
+            finally:
+                if loader is not None:
+                    loader.cancel()
+                await pubsub.reset()
+
+    def stats(self) -> dict:
+        """returns the index metrics"""
+        return {
+            "ready": self.ready,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+        }
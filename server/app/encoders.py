@@ -0,0 +1,201 @@
+"""
+json encoders for socket.io packets and api responses
+"""
+from datetime import datetime
+from functools import wraps
+import json
+from typing import Any, Awaitable, Callable
+
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from loguru import logger
+from pydantic import BaseModel
+
+from app.settings import settings, JSONEncoder, Encoding
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+
+def default(obj: Any) -> Any:
+    """
+    encodes the types the json encoders do not know about
+
+    :param obj: the object to encode
+    :raises TypeError if the object cannot be encoded
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+
+    if isinstance(obj, datetime):
+        obj_str = obj.isoformat()
+        return obj_str if obj.tzinfo else obj_str + "Z"
+
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+class StdJSON:
+    """the standard library json module, with `default` wired in"""
+
+    @staticmethod
+    def dumps(obj: Any, **kwargs) -> str:
+        """encodes an object to a json string"""
+        kwargs.setdefault("separators", (",", ":"))
+        return json.dumps(obj, default=default, **kwargs)
+
+    @staticmethod
+    def dumpb(obj: Any) -> bytes:
+        """encodes an object to json bytes"""
+        return StdJSON.dumps(obj).encode()
+
+    @staticmethod
+    def loads(s: str | bytes, **kwargs) -> Any:
+        """decodes a json string"""
+        return json.loads(s, **kwargs)
+
+
+class OrJSON:
+    """orjson behind the json module interface socket.io expects"""
+
+    OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z if orjson else 0
+
+    @staticmethod
+    def dumps(obj: Any, **kwargs) -> str:
+        """
+        encodes an object to a json string. formatting kwargs of
+        the standard library version are ignored, the output is
+        always compact
+        """
+        return OrJSON.dumpb(obj).decode()
+
+    @staticmethod
+    def dumpb(obj: Any) -> bytes:
+        """encodes an object to json bytes"""
+        return orjson.dumps(obj, default=default, option=OrJSON.OPTIONS)
+
+    @staticmethod
+    def loads(s: str | bytes, **kwargs) -> Any:
+        """decodes a json string"""
+        return orjson.loads(s)
+
+
+def get_json() -> type[StdJSON] | type[OrJSON]:
+    """returns the json encoder selected in the settings"""
+    if settings.JSON_ENCODER == JSONEncoder.ORJSON.value:
+        if orjson is not None:
+            return OrJSON
+
+        logger.warning("orjson is not installed, falling back to json")
+
+    return StdJSON
+
+
+JSON = get_json()
+
+
+class FastJSONResponse(JSONResponse):
+    """a json response rendered by the configured encoder"""
+
+    def render(self, content: Any) -> bytes:
+        """renders the response body"""
+        return JSON.dumpb(content)
+
+
+class MsgPack:
+    """msgpack, with the same `default` hook as the json encoders"""
+
+    @staticmethod
+    def dumpb(obj: Any) -> bytes:
+        """encodes an object to msgpack bytes"""
+        return msgpack.packb(obj, default=default, use_bin_type=True)
+
+    @staticmethod
+    def loads(b: bytes) -> Any:
+        """decodes msgpack bytes"""
+        return msgpack.unpackb(b, raw=False)
+
+
+# the encoding negotiated by each connection on this node
+SID_ENCODINGS: dict[str, str] = {}
+
+
+def negotiate(sid: str, auth: dict) -> str:
+    """
+    records the encoding a connection asked for in its `auth`
+    dict. connections that ask for nothing, or for msgpack when
+    it is disabled or not installed, fall back to json. msgpack
+    is an optional dependency, off unless `MSGPACK_ENABLED` is set
+
+    :param sid: the socket id of the client
+    :param auth: authentication dict passed by the client
+    :return the encoding in use
+    """
+    wanted = auth.get("encoding")
+    if wanted == Encoding.MSGPACK.value and settings.MSGPACK_ENABLED:
+        if msgpack is not None:
+            SID_ENCODINGS[sid] = wanted
+            return wanted
+
+        logger.warning("msgpack is not installed, falling back to json")
+
+    return Encoding.JSON.value
+
+
+def forget(sid: str) -> None:
+    """drops the encoding of a disconnected client"""
+    SID_ENCODINGS.pop(sid, None)
+
+
+def encode_args(data: Any) -> Any:
+    """
+    encodes the arguments of an event for msgpack clients. a tuple
+    is several arguments, each is encoded on its own
+    """
+    if data is None:
+        return None
+
+    if isinstance(data, tuple):
+        return tuple(MsgPack.dumpb(arg) for arg in data)
+
+    return MsgPack.dumpb(data)
+
+
+def encode_for(sid: str, payload: Any) -> Any:
+    """
+    encodes a payload sent to a single client. msgpack clients
+    get it as bytes, which socket.io sends as a binary attachment,
+    everyone else gets it as is
+    """
+    if payload is not None and SID_ENCODINGS.get(sid) == Encoding.MSGPACK.value:
+        return MsgPack.dumpb(payload)
+
+    return payload
+
+
+def packed(
+    handler: Callable[..., Awaitable[Any]],
+) -> Callable[..., Awaitable[Any]]:
+    """
+    encodes the acknowledgement of an event handler with `encode_for`.
+    handlers return plain dicts, built by `response` without being
+    validated again. there is no pre-encoded variant: a cached room
+    or chat payload would depend on its members' usernames and on
+    every change to the conversation, and going stale is worse than
+    encoding it again
+    """
+
+    @wraps(handler)
+    async def wrapper(sid: str, *args, **kwargs) -> Any:
+        return encode_for(sid, await handler(sid, *args, **kwargs))
+
+    return wrapper
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Defines the socket.io client managers.
+"""
+import asyncio
+
+from loguru import logger
+from socketio import AsyncManager, AsyncAioPikaManager, AsyncRedisManager
+
+from app.db import get_rabbitmq_uri, get_redis_uri
+from app.encoders import SID_ENCODINGS, encode_args
+from app.settings import settings, ClientManager, Encoding
+
+
+class PerEncoding(AsyncManager):
+    """
+    delivers events to the sids of this node in the encoding each
+    of them negotiated, see `negotiate`: a broadcast is encoded
+    once for the json clients and once for the msgpack ones, not
+    once per connection. pub/sub managers list it after their base
+    so that it sits right above `AsyncManager`, where they deliver
+    locally, whether the event was emitted here or on another node
+    """
+
+    async def emit(
+        self,
+        event,
+        data,
+        namespace,
+        room=None,
+        skip_sid=None,
+        callback=None,
+        **kwargs,
+    ):
+        """delivers an event to the sids of this node"""
+        if callback is not None or not SID_ENCODINGS:
+            return await super().emit(
+                event,
+                data,
+                namespace,
+                room=room,
+                skip_sid=skip_sid,
+                callback=callback,
+                **kwargs,
+            )
+
+        skip_sid = skip_sid if isinstance(skip_sid, list) else [skip_sid]
+        binary = [
+            sid
+            for sid, _ in self.get_participants(namespace, room)
+            if sid not in skip_sid
+            and SID_ENCODINGS.get(sid) == Encoding.MSGPACK.value
+        ]
+        if not binary:
+            return await super().emit(
+                event, data, namespace, room=room, skip_sid=skip_sid, **kwargs
+            )
+
+        await asyncio.gather(
+            super().emit(
+                event,
+                data,
+                namespace,
+                room=room,
+                skip_sid=skip_sid + binary,
+                **kwargs,
+            ),
+            super().emit(
+                event, encode_args(data), namespace, room=binary, **kwargs
+            ),
+        )
+
+
+class LocalFirst:
+    """
+    makes a pub/sub client manager deliver to the sids of this
+    node before anything is published, and publish only what other
+    nodes may have to deliver: an emit to sids all connected here
+    is never published, and the others are published in order by a
+    background task instead of the emitter waiting on the broker.
+    emits with a callback keep the stock path, their ack ids must
+    reach the node that asked. payloads are published after `emit`
+    returns, so they must not be changed afterwards
+    """
+
+    def __init__(self, *args, queue_size: int = 0, **kwargs) -> None:
+        """initializes the manager"""
+        super().__init__(*args, **kwargs)
+        self.queue_size = queue_size
+        self.outbox: asyncio.Queue | None = None
+        self.publisher: asyncio.Task | None = None
+        self.local_only = 0
+        self.published = 0
+
+    def is_local(self, room, namespace: str) -> bool:
+        """
+        checks if `room` only names sids connected to this node.
+        a list, tuple or set names several rooms, anything else,
+        e.g. an ObjectId, is the name of one
+        """
+        if room is None:
+            return False
+
+        rooms = room if isinstance(room, (list, tuple, set)) else [room]
+        return all(self.is_connected(sid, namespace) for sid in rooms)
+
+    async def emit(
+        self,
+        event,
+        data,
+        namespace=None,
+        room=None,
+        skip_sid=None,
+        callback=None,
+        **kwargs,
+    ):
+        """delivers an event here, then queues it for other nodes"""
+        if kwargs.get("ignore_queue") or callback is not None:
+            return await super().emit(
+                event,
+                data,
+                namespace=namespace,
+                room=room,
+                skip_sid=skip_sid,
+                callback=callback,
+                **kwargs,
+            )
+
+        namespace = namespace or "/"
+        message = {
+            "method": "emit",
+            "event": event,
+            "data": data,
+            "namespace": namespace,
+            "room": room,
+            "skip_sid": skip_sid,
+            "callback": None,
+            "host_id": self.host_id,
+        }
+        await self._handle_emit(message)
+        if self.is_local(room, namespace):
+            self.local_only += 1
+            return
+
+        if self.publisher is None:
+            self.outbox = asyncio.Queue(maxsize=self.queue_size)
+            self.publisher = asyncio.create_task(self.publish_all())
+        # only waits when the broker has fallen `queue_size` behind
+        await self.outbox.put(message)
+
+    async def publish_all(self) -> None:
+        """publishes the queued emits in order, until cancelled"""
+        while True:
+            message = await self.outbox.get()
+            try:
+                await self._publish(message)
+                self.published += 1
+            except Exception as err:
+                logger.error(f"failed to publish {message['event']}: {err}")
+            finally:
+                self.outbox.task_done()
+
+    async def stop(self, timeout: float = 5) -> None:
+        """publishes what is queued, then stops the publisher"""
+        if self.publisher is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.outbox.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"dropped {self.outbox.qsize()} queued emits")
+        self.publisher.cancel()
+        await asyncio.gather(self.publisher, return_exceptions=True)
+        self.publisher = None
+
+    def stats(self) -> dict:
+        """returns the manager metrics"""
+        return {
+            "local_only": self.local_only,
+            "published": self.published,
+            "queued": self.outbox.qsize() if self.outbox else 0,
+        }
+
+
+class RabbitMQManager(LocalFirst, AsyncAioPikaManager, PerEncoding):
+    """rabbitmq client manager with local delivery first"""
+
+
+class RedisManager(LocalFirst, AsyncRedisManager, PerEncoding):
+    """redis pub/sub client manager with local delivery first"""
+
+
+def client_manager() -> AsyncManager:
+    """
+    returns the client manager chosen in the settings. the local
+    one keeps everything in this process, for a single node
+    """
+    manager = settings.SOCKETIO_MANAGER
+    if manager == ClientManager.LOCAL.value:
+        return PerEncoding()
+
+    if manager == ClientManager.REDIS.value:
+        return RedisManager(
+            get_redis_uri(settings.REDIS_SOCKETIO_DB),
+            channel=settings.SOCKETIO_CHANNEL,
+            queue_size=settings.SOCKETIO_PUBLISH_QUEUE,
+        )
+
+    return RabbitMQManager(
+        get_rabbitmq_uri(),
+        channel=settings.SOCKETIO_CHANNEL,
+        queue_size=settings.SOCKETIO_PUBLISH_QUEUE,
+    )
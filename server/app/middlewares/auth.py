@@ -12,7 +12,7 @@ from beanie.operators import Or
 from app.models.user import User
 from app.utils import create_passwd_hash, verify_passwd
 from app.settings import settings
-from app.db import SESSION_CACHE
+from app.db import SESSION_CACHE, USERNAME_INDEX
 
 
 JWT = JwtAccessCookie(
@@ -33,7 +33,7 @@ async def authenticate(
     if not user:
         raise HTTPException(status_code=401, detail="invalid token")
 
-    cached_token = SESSION_CACHE.get(str(user.id))
+    cached_token = await SESSION_CACHE.get(str(user.id))
     if not cached_token or token != cached_token:
         raise HTTPException(status_code=401, detail="you are not logged in")
 
@@ -58,6 +58,8 @@ async def register_user(email: str, username: str, passwd: str) -> User:
     except Exception as err:
         raise HTTPException(status_code=500, detail="user registration failed")
 
+    await USERNAME_INDEX.publish(new_user)
+
     return new_user
 
 
@@ -92,10 +94,7 @@ async def login_user(
         httponly=True,
         samesite="strict",
     )
-    prev_token = SESSION_CACHE.get(str(user.id))
-    if prev_token:
-        SESSION_CACHE.delete(str(user.id))
-
-    SESSION_CACHE.setex(str(user.id), token)
+    # replaces the previous session, if any
+    await SESSION_CACHE.setex(str(user.id), token)
 
     return user
@@ -2,7 +2,11 @@
 chat middlewares
 """
 
-from beanie.operators import Or, In, And, RegEx, AddToSet, Pull
+import asyncio
+from datetime import datetime, UTC
+import re
+
+from beanie.operators import Or, In, And, AddToSet, Pull
 from beanie import PydanticObjectId
 from enum import Enum
 
@@ -10,16 +14,38 @@ from app import sio
 from app.models.user import User
 from app.models.room import Room
 from app.models.chat import Chat
-from app.models.message import Message
+from app.models.message import Message, serialize_message_doc
+from app.models.bucket import MessageBucket
 from app.schemas.models import (
     ResponseModel,
+    response,
     MessageSchema,
-    ChatSchema,
-    RoomSchema,
 )
-from app.db import SOCKETIO_CACHE
+from app.db import (
+    MESSAGE_BUFFER,
+    USER_CACHE,
+    MEMBERSHIP,
+    INBOX,
+    USERNAME_INDEX,
+    PRESENCE,
+    PENDING,
+    READ_CURSORS,
+    SEQUENCES,
+)
+from app.settings import settings, MessageStorage
+from app.utils import (
+    group_messages,
+    get_timezone,
+    last_msg_pipeline,
+    make_snippet,
+    user_room,
+)
 
 
+# usernames are letters and digits, see `UserBase`
+SEARCH_TERM = re.compile(r"[A-Za-z0-9]{1,16}")
+MAX_SEARCH_QUERY = 100
+
 # ROOM OPERATION FLAGS
 ADD_MEMBER = 10
 REMOVE_MEMBER = 11
@@ -44,24 +70,62 @@ class Ops(Enum):
         return value in [cls.ADD_MEMBER, cls.RM_MEMBER]
 
 
-async def users_search(user_id: str, term: str) -> list[dict]:
+async def users_search(
+    user_id: str,
+    term: str,
+    after: str | None = None,
+    limit: int | None = None,
+) -> list[dict]:
     """
-    searches the users collection and return a list
-    of matches
+    searches the users collection for usernames starting with a
+    term, case-insensitively, in username order. the prefix is
+    matched as a range on the indexed lowercase username, so no
+    pattern from the client ever reaches mongo. when the in-memory
+    username index is enabled and loaded, it answers instead
 
     :param user_id: the id of the user making the request
     :param term: the search term
+    :param after: the last username of the previous page
+    :param limit: maximum number of matches
     :return list matching user objects
+    :raises ValueError on an invalid term, cursor or limit
     """
     if not term or not user_id:
         return []
 
+    if not SEARCH_TERM.fullmatch(term):
+        raise ValueError("invalid search term")
+    if after is not None and not SEARCH_TERM.fullmatch(after):
+        raise ValueError("invalid cursor")
+
+    if limit is None:
+        limit = settings.SEARCH_PAGE_SIZE
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("invalid limit")
+    limit = min(limit, settings.SEARCH_PAGE_MAX)
+
+    # every username starting with `prefix` sorts in [prefix, upper)
+    prefix = term.lower()
+    if USERNAME_INDEX.ready:
+        return USERNAME_INDEX.search(
+            prefix, str(user_id), after and after.lower(), limit
+        )
+    if settings.USERNAME_INDEX:
+        USERNAME_INDEX.fallbacks += 1
+
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    bounds = {"$gte": prefix, "$lt": upper}
+    if after is not None and after.lower() >= prefix:
+        bounds = {"$gt": after.lower(), "$lt": upper}
+
     matches = (
         await User.find(
-            RegEx(User.username, term),
+            {"username_lower": bounds},
             User.id != PydanticObjectId(user_id),
         )
-        .sort(+User.username)
+        .sort(+User.username_lower)
+        .limit(limit)
         .to_list()
     )
 
@@ -70,7 +134,8 @@ async def users_search(user_id: str, term: str) -> list[dict]:
 
 async def fetch_user_by_id_or_username(user_id: str) -> User | None:
     """
-    fetches a user by id or username
+    fetches a user by id or username, from the user cache
+    when possible. the returned user is shared, do not mutate it
 
     :param user_id: the id or username of the user
     :return the user object
@@ -81,62 +146,605 @@ async def fetch_user_by_id_or_username(user_id: str) -> User | None:
     is_object_id = PydanticObjectId.is_valid(user_id)
 
     if is_object_id:
+        user = USER_CACHE.get_by_id(user_id)
+        if user is not None:
+            return user
         user_id = PydanticObjectId(user_id)
         user = await User.find(User.id == user_id).first_or_none()
     else:
+        user = USER_CACHE.get_by_username(user_id)
+        if user is not None:
+            return user
         user = await User.find(User.username == user_id).first_or_none()
 
+    if user is not None:
+        USER_CACHE.put(user)
+
     return user
 
 
-async def fetch_user_chats(user: User) -> list[dict]:
+async def fetch_user_chats(
+    user: User,
+    before: str | None = None,
+    limit: int | None = None,
+) -> list[dict]:
     """
-    fetches a user's chats and rooms
+    fetches a user's chats and rooms from their inbox, most
+    recently active first, with the number of messages they have
+    not read in each
 
     :param user: the user object
+    :param before: id of the last chat or room of the previous page
+    :param limit: maximum number of chats and rooms, all if None
     :return list of chats and rooms
+    :raises ValueError on an invalid cursor or limit
     """
     if user is None:
         return None
 
-    chats = await Chat.find(
-        Or(
-            Chat.user_1.username == user.username,
-            Chat.user_2.username == user.username,
-        ),
-        Chat.is_deleted == False,  # noqa E712
-        projection_model=ChatSchema,
-        fetch_links=True,
-    ).to_list()
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("invalid limit")
+        limit = min(limit, settings.INBOX_PAGE_MAX)
 
-    rooms = await Room.find(
-        Room.members.username == user.username,
-        Room.is_deleted == False,  # noqa E712
-        projection_model=RoomSchema,
-        fetch_links=True,
-    ).to_list()
+    chats_or_rooms, read = await asyncio.gather(
+        INBOX.page(user, before, limit),
+        READ_CURSORS.get(user.id),
+    )
+    for chat_or_room in chats_or_rooms:
+        seq = chat_or_room["seq"]
+        chat_or_room["unread"] = max(0, seq - read.get(chat_or_room["id"], 0))
+
+    return chats_or_rooms
+
+
+async def fetch_user_chat_ids(user: User) -> list[str]:
+    """
+    fetches the ids of a user's chats and rooms, from their inbox
+    if it is built, otherwise with index-only queries that resolve
+    no links, so reconnect storms stay cheap
+
+    :param user: the user object
+    :return ids of chats and rooms
+    """
+    c_ids = await INBOX.cached_ids(user)
+    if c_ids is not None:
+        return c_ids
+
+    live = {"is_deleted": False}
+    chats, rooms = await asyncio.gather(
+        Chat.get_motor_collection()
+        .find(
+            {
+                "$or": [{"user_1.$id": user.id}, {"user_2.$id": user.id}],
+                **live,
+            },
+            {"_id": 1},
+        )
+        .to_list(length=None),
+        Room.get_motor_collection()
+        .find({"members.$id": user.id, **live}, {"_id": 1})
+        .to_list(length=None),
+    )
+
+    return [str(doc["_id"]) for doc in [*chats, *rooms]]
+
+
+async def touch_inbox(c_id, member_ids: list, message: Message) -> None:
+    """moves a chat or room to the top of its members' inboxes"""
+    await INBOX.touch(c_id, member_ids, message.when, message.model_dump())
+
+
+async def queue_for_offline(
+    member_ids: list[str],
+    sender_id,
+    event: str,
+    data: dict,
+) -> None:
+    """
+    queues an event for the members of a chat or room who are
+    offline, they get it when they next sync
+
+    :param member_ids: ids of the members of the chat or room
+    :param sender_id: id of the user who caused the event
+    """
+    member_ids = [uid for uid in member_ids if uid != str(sender_id)]
+    online = await PRESENCE.online(member_ids)
+    offline = [uid for uid in member_ids if uid not in online]
+    await PENDING.push(offline, event, data)
+
+
+async def resolve_cursor(
+    cursor: str,
+) -> tuple[datetime, PydanticObjectId | None]:
+    """
+    resolves a pagination cursor to a (when, id) position
+
+    :param cursor: a message id or an ISO 8601 timestamp
+    :return the position of the cursor in the history
+    :raises ValueError if the cursor is neither
+    """
+    if PydanticObjectId.is_valid(cursor):
+        msg_id = PydanticObjectId(cursor)
+        message = await Message.find_one(Message.id == msg_id)
+        if message is None:
+            raise ValueError("invalid cursor")
+
+        return message.when, msg_id
+
+    return datetime.fromisoformat(cursor), None
+
+
+def page_limit(limit: int | None) -> int:
+    """
+    returns the number of messages in a history page
+
+    :raises ValueError if `limit` is not a positive number
+    """
+    if limit is None:
+        return settings.MESSAGE_PAGE_SIZE
 
-    rooms_chats = sorted([*chats, *rooms], key=lambda a: a.updated_at)
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("invalid limit")
 
-    return [room_or_chat.model_dump() for room_or_chat in rooms_chats]
+    return min(limit, settings.MESSAGE_PAGE_MAX)
+
+
+async def fetch_messages(
+    c_id: str | PydanticObjectId,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int | None = None,
+) -> tuple[list[Message], str | None]:
+    """
+    fetches one page of the messages of a chat or room, oldest first.
+    without a cursor, the latest page is returned
+
+    :param c_id: id of chat or room
+    :param before: message id or timestamp to page backwards from
+    :param after: message id or timestamp to page forwards from
+    :param limit: maximum number of messages in the page
+    :return the page and the cursor to the next page, if any
+    :raises ValueError on an invalid cursor or limit, or when
+        both `before` and `after` are given
+    """
+    if c_id is None:
+        return [], None
+
+    if before and after:
+        raise ValueError("only one of before and after can be given")
+
+    limit = page_limit(limit)
+    query = {"chat_id": PydanticObjectId(c_id)}
+    cursor = before or after
+    op = "$lt" if after is None else "$gt"
+    if cursor:
+        when, msg_id = await resolve_cursor(cursor)
+        if msg_id is None:
+            query["when"] = {op: when}
+        else:
+            query["$or"] = [
+                {"when": {op: when}},
+                {"when": when, "_id": {op: msg_id}},
+            ]
+
+    direction = -1 if after is None else 1
+    page = (
+        await Message.find(query)
+        .sort([("when", direction), ("_id", direction)])
+        .limit(limit + 1)
+        .to_list()
+    )
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    next_cursor = str(page[-1].id) if has_more else None
+    if after is None:
+        page.reverse()
+
+    return page, next_cursor
+
+
+async def fetch_bucket_messages(
+    c_id: str | PydanticObjectId,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    fetches one page of the messages of a chat or room from the day
+    buckets, oldest first, like `fetch_messages`. the buckets of one
+    date at a time are read, nearest first, until the page is full.
+    messages sent in the same ms are never split across pages, so
+    a page can hold a few more than `limit`
+
+    :param c_id: id of chat or room
+    :param before: date or timestamp to page backwards from
+    :param after: date or timestamp to page forwards from
+    :param limit: maximum number of messages in the page
+    :return the page and the cursor to the next page, the timestamp
+        of its last message, if there are more
+    :raises ValueError on an invalid cursor or limit, or when
+        both `before` and `after` are given
+    """
+    if c_id is None:
+        return [], None
+
+    if before and after:
+        raise ValueError("only one of before and after can be given")
+
+    limit = page_limit(limit)
+    older = after is None
+    bound = before or after
+    if bound:
+        bound = datetime.fromisoformat(bound)
+        if bound.tzinfo is not None:
+            bound = bound.astimezone(UTC).replace(tzinfo=None)
+
+    oid = PydanticObjectId(c_id)
+    buckets = MessageBucket.get_motor_collection()
+    # a date can span several buckets, full ones, the migration's
+    # parts and live ones, so each date is read whole
+    dates = {}
+    if bound:
+        dates = {"$lte" if older else "$gte": bound.date().isoformat()}
+    page: list[dict] = []
+    while len(page) <= limit:
+        query = {"chat_id": oid, **({"date": dates} if dates else {})}
+        nearest = await buckets.find_one(
+            query, {"date": 1}, sort=[("date", -1 if older else 1)]
+        )
+        if nearest is None:
+            break
+
+        date = nearest["date"]
+        docs = await buckets.find(
+            {"chat_id": oid, "date": date}, {"messages": 1}
+        ).to_list(length=None)
+        messages = [msg for doc in docs for msg in doc["messages"]]
+        if bound:
+            messages = [
+                msg
+                for msg in messages
+                if (msg["when"] < bound if older else msg["when"] > bound)
+            ]
+        messages.sort(key=lambda msg: (msg["when"], msg["_id"]), reverse=older)
+        page += messages
+        dates = {"$lt" if older else "$gt": date}
+
+    size = limit
+    while size < len(page) and page[size]["when"] == page[size - 1]["when"]:
+        size += 1
+    next_cursor = None
+    if size < len(page):
+        next_cursor = page[size - 1]["when"].isoformat()
+    page = page[:size]
+    if older:
+        page.reverse()
+
+    return page, next_cursor
+
+
+async def dump_with_messages(
+    chat_or_room: Chat | Room,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int | None = None,
+    tz: str | int | None = None,
+) -> dict:
+    """
+    serializes a chat or room together with one page of its
+    messages grouped by date, in the client's timezone
+
+    :param chat_or_room: the chat or room object
+    :param before: cursor or timestamp to page backwards from
+    :param after: cursor or timestamp to page forwards from
+    :param limit: maximum number of messages in the page
+    :param tz: the client's IANA zone or UTC offset in minutes
+    :return the serialized chat or room
+    :raises ValueError on an invalid cursor, limit or timezone, or
+        when both `before` and `after` are given
+    """
+    tz = get_timezone(tz)
+    if settings.MESSAGE_STORAGE == MessageStorage.BUCKET.value:
+        fetch = fetch_bucket_messages
+    else:
+        fetch = fetch_messages
+    messages, next_cursor = await fetch(chat_or_room.id, before, after, limit)
+    days = group_messages(messages, tz)
+
+    data = chat_or_room.model_dump()
+    data["messages"] = days
+    data["next_cursor"] = next_cursor
+
+    return data
+
+
+async def search_conversation(
+    c_id: str,
+    query: str,
+    cursor: tuple[float, PydanticObjectId] | None,
+    limit: int,
+) -> list[dict]:
+    """
+    runs a text search in one conversation, best matches first
+
+    :param c_id: id of the chat or room
+    :param query: the search query
+    :param cursor: the (score, id) of the last result of the
+        previous page
+    :param limit: maximum number of results
+    """
+    match = {
+        "chat_id": PydanticObjectId(c_id),
+        "$text": {"$search": query},
+    }
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor is not None:
+        score, msg_id = cursor
+        pipeline.append(
+            {
+                "$match": {
+                    "$or": [
+                        {"score": {"$lt": score}},
+                        {"score": score, "_id": {"$lt": msg_id}},
+                    ]
+                }
+            }
+        )
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit},
+        {"$project": {"chat_id": 0}},
+    ]
+
+    messages = Message.get_motor_collection()
+    return await messages.aggregate(pipeline).to_list(length=limit)
+
+
+async def messages_search(
+    user: User,
+    query: str,
+    c_id: str | None = None,
+    cursor: str | None = None,
+    limit: int | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    searches the messages of the conversations a user belongs to,
+    or of one of them. the text index is prefixed by `chat_id`, so
+    each conversation is searched on its own, a bounded number at a
+    time, and the results are merged by relevance
+
+    :param user: the user searching
+    :param query: the search query
+    :param c_id: id of a chat or room to search in
+    :param cursor: the cursor returned with the previous page
+    :param limit: maximum number of results
+    :return the results, with their conversation id and a snippet,
+        and the cursor to the next page, if any
+    :raises ValueError on an invalid query, cursor or limit
+    :raises PermissionError if the user is not a member of `c_id`
+    """
+    query = (query or "").strip()
+    if not query or len(query) > MAX_SEARCH_QUERY:
+        raise ValueError("invalid query")
+
+    if limit is None:
+        limit = settings.MESSAGE_SEARCH_PAGE_SIZE
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("invalid limit")
+    limit = min(limit, settings.MESSAGE_SEARCH_PAGE_MAX)
+
+    position = None
+    if cursor is not None:
+        score, _, msg_id = cursor.partition(":")
+        if not PydanticObjectId.is_valid(msg_id):
+            raise ValueError("invalid cursor")
+        position = float(score), PydanticObjectId(msg_id)
+
+    c_ids = await INBOX.ids(user)
+    if c_id is not None:
+        if str(c_id) not in c_ids:
+            raise PermissionError("not a member of the chat or room")
+        c_ids = [str(c_id)]
+
+    semaphore = asyncio.Semaphore(settings.MESSAGE_SEARCH_CONCURRENCY)
+
+    async def search(c_id: str) -> list[dict]:
+        async with semaphore:
+            return await search_conversation(c_id, query, position, limit + 1)
+
+    pages = await asyncio.gather(*(search(c_id) for c_id in c_ids))
+    results = [
+        (doc, c_id) for c_id, docs in zip(c_ids, pages) for doc in docs
+    ]
+    results.sort(key=lambda r: (r[0]["score"], r[0]["_id"]), reverse=True)
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        last = results[-1][0]
+        next_cursor = f"{last['score']}:{last['_id']}"
+
+    return [
+        {
+            "id": c_id,
+            "type": doc.get("chat_type"),
+            "message": serialize_message_doc(doc),
+            "snippet": make_snippet(doc["text"], query),
+            "score": doc["score"],
+        }
+        for doc, c_id in results
+    ], next_cursor
+
+
+async def messages_after(c_id: str, seq: int, limit: int) -> list[dict]:
+    """
+    returns the messages of a conversation after a sequence number,
+    in order, including the ones this worker has not flushed yet
+
+    :param c_id: id of the chat or room
+    :param seq: the last sequence number the client has
+    :param limit: maximum number of messages
+    """
+    oid = PydanticObjectId(c_id)
+    if settings.MESSAGE_STORAGE == MessageStorage.BUCKET.value:
+        docs = await (
+            MessageBucket.get_motor_collection()
+            .aggregate(
+                [
+                    {"$match": {"chat_id": oid, "messages.seq": {"$gt": seq}}},
+                    {"$unwind": "$messages"},
+                    {"$match": {"messages.seq": {"$gt": seq}}},
+                    {"$sort": {"messages.seq": 1}},
+                    {"$limit": limit},
+                    {"$replaceRoot": {"newRoot": "$messages"}},
+                ]
+            )
+            .to_list(length=limit)
+        )
+    else:
+        docs = await (
+            Message.get_motor_collection()
+            .find({"chat_id": oid, "seq": {"$gt": seq}})
+            .sort("seq", 1)
+            .limit(limit)
+            .to_list(length=limit)
+        )
+    messages = {doc["seq"]: serialize_message_doc(doc) for doc in docs}
+
+    if settings.MESSAGE_WRITE_BEHIND:
+        for _, message in MESSAGE_BUFFER.pending:
+            if message.chat_id == oid and message.seq > seq:
+                messages.setdefault(message.seq, message.model_dump())
+
+    return [messages[n] for n in sorted(messages)[:limit]]
+
+
+async def sync_messages(
+    user: User,
+    seqs: dict,
+    limit: int | None = None,
+) -> dict[str, dict]:
+    """
+    returns what a user missed in their conversations, given the
+    last sequence number they have of each. a conversation whose
+    messages jump a number has a gap, e.g. a message another worker
+    has not flushed yet, which the next sync fills in
+
+    :param user: the user syncing
+    :param seqs: the last sequence number of each chat or room, by id
+    :param limit: maximum number of messages per conversation
+    :return the new messages of each conversation, oldest first, and
+        whether it has more after them, by id
+    :raises ValueError on an invalid map, conversation or limit
+    """
+    if limit is None:
+        limit = settings.SYNC_PAGE_SIZE
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError("invalid limit")
+    limit = min(limit, settings.SYNC_PAGE_MAX)
+
+    if not isinstance(seqs, dict) or not seqs:
+        raise ValueError("invalid sequence numbers")
+    if len(seqs) > settings.SYNC_MAX_CONVERSATIONS:
+        raise ValueError("too many chats or rooms")
+    for seq in seqs.values():
+        if not isinstance(seq, int) or isinstance(seq, bool) or seq < 0:
+            raise ValueError("invalid sequence numbers")
+
+    c_ids = set(await INBOX.ids(user))
+    if not c_ids.issuperset(seqs):
+        raise ValueError("invalid chat or room id")
+
+    semaphore = asyncio.Semaphore(settings.SYNC_CONCURRENCY)
+
+    async def read(c_id: str) -> list[dict]:
+        async with semaphore:
+            return await messages_after(c_id, seqs[c_id], limit + 1)
+
+    pages = await asyncio.gather(*(read(c_id) for c_id in seqs))
+    return {
+        c_id: {"messages": page[:limit], "more": len(page) > limit}
+        for c_id, page in zip(seqs, pages)
+    }
+
+
+async def append_message(
+    cls: type[Chat] | type[Room],
+    c_id: PydanticObjectId,
+    message: Message,
+) -> bool:
+    """
+    takes the next sequence number of the conversation, inserts the
+    message, then points the parent chat or room at it, so a failed
+    insert leaves the parent as it was. the parent is only moved
+    forward if the message is newer than its current last message,
+    so concurrent senders cannot overwrite each other. no history
+    is loaded and no document hooks are run
+
+    :param cls: Chat or Room
+    :param c_id: id of the parent chat or room
+    :param message: the message to append
+
+    :returns True if the parent exists, False otherwise
+    :raises the error of a failed insert, after giving its
+        sequence number back
+    """
+
+    message.id = message.id or PydanticObjectId()
+    message.chat_id = c_id
+    message.seq = await SEQUENCES.next(cls, c_id)
+    if message.seq is None:
+        return False
+
+    try:
+        if settings.MESSAGE_STORAGE == MessageStorage.BUCKET.value:
+            await MessageBucket.get_motor_collection().update_one(
+                *MessageBucket.append_update(
+                    message, settings.MESSAGE_BUCKET_SIZE
+                ),
+                upsert=True,
+            )
+        else:
+            await message.insert()
+    except Exception:
+        # unless someone sent since, so sync sees no gap
+        await SEQUENCES.release(c_id, message.seq)
+        raise
+
+    result = await cls.get_motor_collection().update_one(
+        {"_id": c_id, "is_deleted": False},
+        last_msg_pipeline(message),
+    )
+    return result.matched_count > 0
 
 
 async def add_message(
     c_id: str,
     msg: MessageSchema,
     c_type: str,
-) -> tuple[bool, ResponseModel | None]:
-    """adds a new message to a room or chat
+) -> tuple[Message | None, ResponseModel | None]:
+    """adds a new message to a room or chat. the caller moves it
+    to the top of the members' inboxes with `touch_inbox`, with
+    the members it resolved for the rest of the fan-out
 
     :param c_id: id of chat or room
     :param msg: the message object
     :param c_type: chat type ('room' or 'chat')
 
-    :returns True or False
+    :returns the message, with its id and sequence number, or None
     """
 
     if not c_id or not msg or not c_type:
-        return ResponseModel(
+        return None, ResponseModel(
             message="invalid payload",
             status_code=400,
         )
@@ -146,30 +754,49 @@ async def add_message(
     elif c_type == "chat":
         cls = Chat
     else:
-        return False, ResponseModel(
+        return None, ResponseModel(
             message="invalid chat type",
             status_code=400,
         )
 
-    chat_or_room = await cls.find_one(cls.id == PydanticObjectId(c_id))
-    if chat_or_room is None:
-        return False, ResponseModel(
+    if not PydanticObjectId.is_valid(c_id):
+        return None, ResponseModel(
             message="invalid chat or room id",
             status_code=404,
         )
 
-    message = Message(**msg)
+    try:
+        message = Message(**msg, chat_type=c_type)
+    except Exception as err:
+        return None, ResponseModel(
+            message="invalid message payload",
+            status_code=400,
+        )
+
+    if settings.MESSAGE_WRITE_BEHIND:
+        message.id = PydanticObjectId()
+        message.chat_id = PydanticObjectId(c_id)
+        # from redis, the buffer persists the high-water mark
+        message.seq = await SEQUENCES.next(cls, message.chat_id)
+        if message.seq is None:
+            return None, ResponseModel(
+                message="invalid chat or room id",
+                status_code=404,
+            )
+        MESSAGE_BUFFER.put(cls, message)
+        return message, None
 
     try:
         # TODO: do not insert message by default if all
         # members are online
-        await message.insert()
-        await chat_or_room.fetch_link(cls.messages)
-        chat_or_room.messages.append(message)
-        await chat_or_room.save_changes()
-        return True, None
+        if not await append_message(cls, PydanticObjectId(c_id), message):
+            return None, ResponseModel(
+                message="invalid chat or room id",
+                status_code=404,
+            )
+        return message, None
     except Exception as err:
-        return False, ResponseModel(
+        return None, ResponseModel(
             message="failed to add message",
             status_code=500,
         )
@@ -214,12 +841,23 @@ async def new_room(
             creator=creator_db,
             members=[*members_db, creator_db],
             admins=[creator_db],
-            messages=[],
         ).create()
+        member_ids = [*(member.id for member in members_db), creator_db.id]
+        await MEMBERSHIP.set_room(
+            new_room.id, creator_db.id, member_ids, [creator_db.id]
+        )
+        await INBOX.touch(new_room.id, member_ids, new_room.created_at)
+        # the clients of the members join the room when told to
         for member in members_db:
-            member_sid = SOCKETIO_CACHE.get(str(member.id))
-            if member_sid:
-                await sio.enter_room(member_sid, new_room.id)
+            data = {
+                "id": str(new_room.id),
+                "member": member.username,
+                "name": name,
+                "admin": creator_db.username,
+            }
+            await sio.emit(
+                "add_to_room", ("new", data), to=user_room(member.id)
+            )
 
         return new_room, None
     except Exception as err:
@@ -244,7 +882,7 @@ async def new_chat(
         )
 
     try:
-        msg = await Message(**msg).create()
+        msg = Message(**msg, chat_type="chat")
     except Exception as err:
         return None, ResponseModel(
             message="invalid message payload",
@@ -285,14 +923,19 @@ async def new_chat(
         new_chat = await Chat(
             user_1=users[0],
             user_2=users[1],
-            messages=[msg.to_ref()],
         ).create()
+        await MEMBERSHIP.set_chat(new_chat.id, [user.id for user in users])
+        await append_message(Chat, new_chat.id, msg)
+        await touch_inbox(new_chat.id, [user.id for user in users], msg)
+        sender, recipient = (
+            users if users[0].username == user_1 else users[::-1]
+        )
+        READ_CURSORS.mark(sender.id, new_chat.id, msg.seq)
+        new_chat.last_msg = msg
+        new_chat.last_msg_at = msg.when
         await new_chat.fetch_all_links()
-        user_2_sid = SOCKETIO_CACHE.get(str(users[1].id))
-        if user_2_sid:
-            data = {"id": str(new_chat.id), "texter": user_1}
-            await sio.enter_room(user_2_sid, str(new_chat.id))
-            await sio.emit("new_chat", data, to=user_2_sid)
+        data = {"id": str(new_chat.id), "texter": user_1}
+        await sio.emit("new_chat", data, to=user_room(recipient.id))
 
         return new_chat, None
     except Exception as err:
@@ -303,6 +946,19 @@ async def new_chat(
         )
 
 
+async def catch_up(room: Room, member_ids: list) -> None:
+    """
+    moves the read cursors of new members of a room to its last
+    message, so the history from before they joined is not unread
+
+    :param room: the room
+    :param member_ids: ids of the new members
+    """
+    seq = max(room.seq, await SEQUENCES.current(room.id) or 0)
+    for member_id in member_ids:
+        READ_CURSORS.mark(member_id, room.id, seq)
+
+
 async def add_or_remove_members(sid: str, payload: dict) -> dict:
     """
     adds a member to a room and sends
@@ -321,20 +977,20 @@ async def add_or_remove_members(sid: str, payload: dict) -> dict:
         if not Ops.is_member(flag):
             raise ValueError
     except (ValueError, TypeError):
-        return ResponseModel(
+        return response(
             message="invalid flag",
             status_code=400,
-        ).model_dump()
+        )
 
     if not members or not all([room_id, len(members), admin]):
-        return ResponseModel(
+        return response(
             message="invalid payload",
             status_code=400,
-        ).model_dump()
+        )
 
     room = await Room.find_one(Room.id == PydanticObjectId(room_id))
     if room is None:
-        return ResponseModel(
+        return response(
             message="invalid room id",
             status_code=404,
         )
@@ -343,23 +999,25 @@ async def add_or_remove_members(sid: str, payload: dict) -> dict:
         await fetch_user_by_id_or_username(member) for member in members
     ]
     if None in members_in_db or len(members_in_db) == 0:
-        return ResponseModel(
+        return response(
             message="invalid member(s) username",
             status_code=404,
-        ).model_dump()
+        )
 
-    await room.fetch_link(Room.admins)
     admin_in_db = await fetch_user_by_id_or_username(admin)
-    if admin_in_db not in room.admins:
-        return ResponseModel(
+    if admin_in_db is None or not await MEMBERSHIP.is_admin(
+        room_id, admin_in_db.id
+    ):
+        return response(
             message="not an admin",
             status_code=403,
-        ).model_dump()
-    if set(members).intersection(set([ad.username for ad in room.admins])):
-        return ResponseModel(
+        )
+    member_ids = [member.id for member in members_in_db]
+    if await MEMBERSHIP.admins_among(room_id, member_ids):
+        return response(
             message="cannot remove admin, revoke admin privilege first",
             status_code=403,
-        ).model_dump()
+        )
 
     members_ref = [user.to_ref() for user in members_in_db]
     if flag == Ops.ADD_MEMBER.value:
@@ -371,6 +1029,13 @@ async def add_or_remove_members(sid: str, payload: dict) -> dict:
         room = await room.update(Pull(In(Room.admins, members_ref)))
 
     await room.save_changes()
+    if flag == Ops.ADD_MEMBER.value:
+        await MEMBERSHIP.add_members(room_id, member_ids)
+        await INBOX.add(room_id, member_ids)
+        await catch_up(room, member_ids)
+    else:
+        await MEMBERSHIP.remove_members(room_id, member_ids)
+        await INBOX.remove(room_id, member_ids)
     for member in members_in_db:
         data = {
             "id": room_id,
@@ -378,24 +1043,22 @@ async def add_or_remove_members(sid: str, payload: dict) -> dict:
             "name": room.name,
             "admin": admin,
         }
-        member_sid = SOCKETIO_CACHE.get(str(member.id))
-        if member_sid:
-            await sio.enter_room(member_sid, room_id)
+        # the member is told through their own room, and their
+        # clients join or leave the room in response
+        to = [room_id, user_room(member.id)]
         if flag == Ops.ADD_MEMBER.value:
-            await sio.emit(
-                "add_to_room", ("new", data), to=room_id, skip_sid=sid
-            )
+            await sio.emit("add_to_room", ("new", data), to=to, skip_sid=sid)
         else:
             await sio.emit(
-                "remove_from_room", ("remove", data), to=room_id, skip_sid=sid
+                "remove_from_room", ("remove", data), to=to, skip_sid=sid
             )
 
     room = await Room.get(room.id, fetch_links=True)
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
-        data=room.model_dump(),
-    ).model_dump()
+        data=await dump_with_messages(room),
+    )
 
 
 async def add_or_remove_admin(sid: str, payload: dict) -> dict:
@@ -414,38 +1077,39 @@ async def add_or_remove_admin(sid: str, payload: dict) -> dict:
         if not Ops.is_admin(flag):
             raise ValueError
     except (ValueError, TypeError):
-        return ResponseModel(
+        return response(
             message="invalid flag",
             status_code=400,
-        ).model_dump()
+        )
 
     if not all([room_id, member, admin]):
-        return ResponseModel(
+        return response(
             message="invalid payload",
             status_code=400,
-        ).model_dump()
+        )
 
     room = await Room.find_one(Room.id == PydanticObjectId(room_id))
     if room is None:
-        return ResponseModel(
+        return response(
             message="invalid room id",
             status_code=404,
         )
 
     member_in_db = await fetch_user_by_id_or_username(member)
     if not member_in_db:
-        return ResponseModel(
+        return response(
             message="invalid member username",
             status_code=404,
-        ).model_dump()
+        )
 
-    await room.fetch_link(Room.creator)
     admin_in_db = await fetch_user_by_id_or_username(admin)
-    if admin_in_db != room.creator:
-        return ResponseModel(
+    if admin_in_db is None or not await MEMBERSHIP.is_creator(
+        room_id, admin_in_db.id
+    ):
+        return response(
             message="not the creator",
             status_code=403,
-        ).model_dump()
+        )
 
     data = {
         "id": room_id,
@@ -460,6 +1124,10 @@ async def add_or_remove_admin(sid: str, payload: dict) -> dict:
         room = await room.update(Pull({Room.admins: member_ref}))
 
     await room.save_changes()
+    if flag == ADD_ADMIN:
+        await MEMBERSHIP.add_admin(room_id, member_in_db.id)
+    else:
+        await MEMBERSHIP.remove_admin(room_id, member_in_db.id)
     if flag == Ops.ADD_ADMIN.value:
         await sio.emit("add_admin", ("grant", data), to=room_id, skip_sid=sid)
     else:
@@ -468,11 +1136,11 @@ async def add_or_remove_admin(sid: str, payload: dict) -> dict:
         )
     room = await Room.get(room.id, fetch_links=True)
 
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
-        data=room.model_dump(),
-    ).model_dump()
+        data=await dump_with_messages(room),
+    )
 
 
 async def exit_room_middleware(
@@ -502,31 +1170,32 @@ async def exit_room_middleware(
         )
 
     user = await fetch_user_by_id_or_username(user_id)
-    member = user.username
     if user is None:
         return None, ResponseModel(
             message="invalid user id",
             status_code=404,
         )
 
-    await room.fetch_link(Room.creator)
-    if user == room.creator:
+    if await MEMBERSHIP.is_creator(room_id, user.id):
         return None, ResponseModel(
             message="creator cannot exit room, delete room instead",
             status_code=403,
         )
 
-    await room.fetch_link(Room.members)
-    if user not in room.members:
+    if not await MEMBERSHIP.is_member("room", room_id, user.id):
         return None, ResponseModel(
             message="user not in room",
             status_code=400,
         )
 
-    room.members.remove(user)
+    user_ref = user.to_ref()
+    room = await room.update(Pull({Room.members: user_ref}))
+    room = await room.update(Pull({Room.admins: user_ref}))
     await room.save_changes()
+    await MEMBERSHIP.remove_members(room_id, [user.id])
+    await INBOX.remove(room_id, [user.id])
 
-    return member, None
+    return user.username, None
 
 
 async def change_room_name(
@@ -543,12 +1212,15 @@ async def change_room_name(
     """
 
     if not room_id or not new_name or not admin:
-        return (
-            None,
-            ResponseModel(
-                message="invalid payload",
-                status_code=400,
-            ).model_dump(),
+        return None, ResponseModel(
+            message="invalid payload",
+            status_code=400,
+        )
+
+    if not PydanticObjectId.is_valid(room_id):
+        return None, ResponseModel(
+            message="invalid room id",
+            status_code=404,
         )
 
     room = await Room.find_one(
@@ -556,26 +1228,23 @@ async def change_room_name(
         fetch_links=True,
     )
     if room is None:
-        return (
-            None,
-            ResponseModel(
-                message="invalid room id",
-                status_code=404,
-            ).model_dump(),
+        return None, ResponseModel(
+            message="invalid room id",
+            status_code=404,
         )
 
     admin_in_db = await fetch_user_by_id_or_username(admin)
-    if admin_in_db not in room.admins:
-        return (
-            None,
-            ResponseModel(
-                message="not an admin",
-                status_code=403,
-            ).model_dump(),
+    if admin_in_db is None or not await MEMBERSHIP.is_admin(
+        room_id, admin_in_db.id
+    ):
+        return None, ResponseModel(
+            message="not an admin",
+            status_code=403,
         )
 
     room = await room.set({Room.name: new_name})
     await room.save_changes()
+    await INBOX.forget(room_id)
 
     return room, None
 
@@ -608,15 +1277,18 @@ async def purge_room(room_id: str, user_id: str) -> ResponseModel:
             status_code=404,
         )
 
-    await room.fetch_link(Room.creator)
-    if user != room.creator:
+    if not await MEMBERSHIP.is_creator(room_id, user.id):
         return ResponseModel(
             message="cannot delete room, you are not the creator",
             status_code=403,
         )
 
     # await room.delete()
+    member_ids = await MEMBERSHIP.members("room", room_id)
     room.is_deleted = True
     await room.save_changes()
+    await MEMBERSHIP.drop("room", room_id)
+    await INBOX.drop(room_id, member_ids)
+    await SEQUENCES.drop(room_id)
 
     return None
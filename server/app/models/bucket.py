@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Defines the MessageBucket model"""
+
+import pymongo
+from beanie import Document, PydanticObjectId
+from pydantic import Field, model_serializer
+from pymongo import IndexModel
+
+from app.models.message import Message, serialize_message_doc
+
+
+class MessageBucket(Document):
+    """
+    Represents one day of the messages of a chat or room.
+    A day holds as many buckets as it needs to keep each one
+    under the configured size. `part` numbers the buckets
+    written by the migration, live buckets have none
+    """
+
+    chat_id: PydanticObjectId
+    chat_type: str
+    date: str
+    n_messages: int = 0
+    part: int | None = None
+    messages: list[dict] = Field(default_factory=list)
+
+    @classmethod
+    def append_update(cls, message: Message, size: int) -> tuple[dict, dict]:
+        """
+        returns the filter and update of the upsert that appends a
+        message to a bucket of its day with room left, or starts a
+        new one
+
+        :param message: the message, with its id and chat_id set
+        :param size: the maximum number of messages in a bucket
+        """
+        return (
+            {
+                "chat_id": message.chat_id,
+                "date": message.when.date().isoformat(),
+                "n_messages": {"$lt": size},
+                # backfilled buckets are owned by the migration
+                "part": None,
+            },
+            {
+                "$push": {"messages": message.to_doc()},
+                "$inc": {"n_messages": 1},
+                "$setOnInsert": {"chat_type": message.chat_type},
+            },
+        )
+
+    @model_serializer
+    def serialize_bucket(self) -> dict:
+        """serializes the bucket in the shape of `DayMessages`"""
+        messages = sorted(self.messages, key=lambda msg: msg["when"])
+        return {
+            "date": self.date,
+            "messages": [serialize_message_doc(msg) for msg in messages],
+        }
+
+    class Settings:
+        name = "message_buckets"
+        indexes = [
+            IndexModel(
+                [
+                    ("chat_id", pymongo.ASCENDING),
+                    ("date", pymongo.ASCENDING),
+                    ("n_messages", pymongo.ASCENDING),
+                ],
+                name="chat_id_date_n_messages",
+            ),
+        ]
@@ -5,11 +5,12 @@ from datetime import datetime, UTC
 
 from beanie import Link, before_event, Update, SaveChanges
 from pydantic import model_serializer
+import pymongo
+from pymongo import IndexModel
 
 from app.models.base_model import Base
-from app.models.message import Message
+from app.models.message import Message, serialize_message_doc
 from app.models.user import User
-from app.utils import group_messages
 
 
 class Chat(Base):
@@ -19,21 +20,23 @@ class Chat(Base):
 
     user_1: Link[User]
     user_2: Link[User]
-    messages: list[Link[Message]]
     last_msg: Link[Message] | None = None
+    last_msg_at: datetime | None = None
+    # the last message embedded, see `Message.to_doc`, bucket
+    # storage has no message document for `last_msg` to link to
+    last_msg_doc: dict | None = None
+    # highest sequence number persisted, only ever moved forward
+    # by `$max`, the counter handing them out is `Sequences`
+    seq: int = 0
     is_deleted: bool = False
 
     @before_event(SaveChanges, Update)
-    def update_last_msg(self):
+    def update_updated_at(self):
         """
-        Updates the last_msg attribute of the chat
+        Updates the updated_at attribute of the chat
         """
 
         self.updated_at = datetime.now(UTC)
-        if len(self.messages) == 0:
-            return
-
-        self.last_msg = self.messages[-1]
 
     @model_serializer
     def serialize_chat(self) -> dict:
@@ -44,8 +47,11 @@ class Chat(Base):
             "id": str(self.id),
             "user_1": self.user_1.username,
             "user_2": self.user_2.username,
-            "last_msg": self.last_msg,
-            "messages": group_messages(self.messages),
+            "last_msg": (
+                serialize_message_doc(self.last_msg_doc)
+                if self.last_msg_doc
+                else self.last_msg
+            ),
             "type": "chat",
             "members": [self.user_1.username, self.user_2.username],
             "created_at": f"{self.created_at.isoformat()}Z",
@@ -55,3 +61,22 @@ class Chat(Base):
     class Settings:
         name = "chats"
         use_state_management = True
+        indexes = [
+            # covers the id-only membership query run at connect
+            IndexModel(
+                [
+                    ("user_1.$id", pymongo.ASCENDING),
+                    ("is_deleted", pymongo.ASCENDING),
+                    ("_id", pymongo.ASCENDING),
+                ],
+                name="user_1_id",
+            ),
+            IndexModel(
+                [
+                    ("user_2.$id", pymongo.ASCENDING),
+                    ("is_deleted", pymongo.ASCENDING),
+                    ("_id", pymongo.ASCENDING),
+                ],
+                name="user_2_id",
+            ),
+        ]
@@ -3,8 +3,26 @@
 
 from datetime import datetime
 
-from beanie import Document
+import pymongo
+from beanie import Document, PydanticObjectId
 from pydantic import field_serializer, field_validator, model_serializer
+from pymongo import IndexModel
+
+
+def serialize_message_doc(doc: dict) -> dict:
+    """
+    serializes a raw message document the way `Message` does
+
+    :param doc: the message document, with `_id` or `id`
+    """
+    when_str = doc["when"].isoformat()
+    return {
+        "id": str(doc.get("_id", doc.get("id"))),
+        "text": doc["text"],
+        "sender": doc["sender"],
+        "when": when_str if "+" in when_str else when_str + "Z",
+        "seq": doc.get("seq"),
+    }
 
 
 class Message(Document):
@@ -15,6 +33,10 @@ class Message(Document):
     text: str
     sender: str
     when: datetime
+    chat_id: PydanticObjectId | None = None
+    chat_type: str | None = None
+    # position in the conversation, None for older messages
+    seq: int | None = None
 
     @field_validator("when", mode="before", check_fields=True)
     def validate_when(cls, v: datetime) -> datetime:
@@ -24,16 +46,57 @@ class Message(Document):
 
         return v
 
-    @model_serializer
-    def serialize_message(self) -> dict:
-        """serializes the message"""
-        when_str = self.when.isoformat()
+    def to_doc(self) -> dict:
+        """
+        returns the message as it is embedded in a day bucket
+        and as the last message of its chat or room
+        """
         return {
-            "id": str(self.id),
+            "_id": self.id,
             "text": self.text,
             "sender": self.sender,
-            "when": when_str if "+" in when_str else when_str + "Z",
+            "when": self.when,
+            "seq": self.seq,
         }
 
+    @model_serializer
+    def serialize_message(self) -> dict:
+        """serializes the message"""
+        return serialize_message_doc(
+            {
+                "id": self.id,
+                "text": self.text,
+                "sender": self.sender,
+                "when": self.when,
+                "seq": self.seq,
+            }
+        )
+
     class Settings:
         name = "messages"
+        indexes = [
+            IndexModel(
+                [
+                    ("chat_id", pymongo.ASCENDING),
+                    ("when", pymongo.ASCENDING),
+                    ("_id", pymongo.ASCENDING),
+                ],
+                name="chat_id_when",
+            ),
+            IndexModel(
+                [
+                    ("chat_id", pymongo.ASCENDING),
+                    ("seq", pymongo.ASCENDING),
+                ],
+                name="chat_id_seq",
+            ),
+            # text search is always scoped to one conversation,
+            # which the chat_id prefix turns into an equality scan
+            IndexModel(
+                [
+                    ("chat_id", pymongo.ASCENDING),
+                    ("text", pymongo.TEXT),
+                ],
+                name="chat_id_text",
+            ),
+        ]
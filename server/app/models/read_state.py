@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+"""Defines the ReadState model"""
+
+from beanie import Document
+from pydantic import Field
+
+
+class ReadState(Document):
+    """
+    Represents how far a user has read their chats and rooms.
+    The id is the id of the user, `seqs` maps the id of each
+    conversation to the sequence number of the last message
+    read in it
+    """
+
+    seqs: dict[str, int] = Field(default_factory=dict)
+
+    class Settings:
+        name = "read_states"
@@ -6,11 +6,12 @@ from datetime import datetime, UTC
 
 from beanie import Link, before_event, Update, SaveChanges
 from pydantic import model_serializer
+import pymongo
+from pymongo import IndexModel
 
 from app.models.base_model import Base
-from app.models.message import Message
+from app.models.message import Message, serialize_message_doc
 from app.models.user import User
-from app.utils import group_messages
 
 
 class Room(Base):
@@ -23,21 +24,23 @@ class Room(Base):
     creator: Link[User]
     members: list[Link[User]]
     admins: list[Link[User]]
-    messages: list[Link[Message]]
     last_msg: Link[Message] | None = None
+    last_msg_at: datetime | None = None
+    # the last message embedded, see `Message.to_doc`, bucket
+    # storage has no message document for `last_msg` to link to
+    last_msg_doc: dict | None = None
+    # highest sequence number persisted, only ever moved forward
+    # by `$max`, the counter handing them out is `Sequences`
+    seq: int = 0
     is_deleted: bool = False
 
     @before_event(SaveChanges, Update)
-    async def update_last_msg(self):
+    async def update_updated_at(self):
         """
-        Updates the last_msg attribute of the chat
+        Updates the updated_at attribute of the room
         """
 
         self.updated_at = datetime.now(UTC)
-        if len(self.messages) == 0:
-            return
-
-        self.last_msg = self.messages[-1]
 
     @model_serializer
     def serialize_room(self) -> dict:
@@ -50,8 +53,11 @@ class Room(Base):
             "creator": self.creator.username,
             "members": [member.username for member in self.members],
             "admins": [admin.username for admin in self.admins],
-            "messages": group_messages(self.messages),
-            "last_msg": self.last_msg,
+            "last_msg": (
+                serialize_message_doc(self.last_msg_doc)
+                if self.last_msg_doc
+                else self.last_msg
+            ),
             "type": "room",
             "created_at": f"{self.created_at.isoformat()}Z",
             "updated_at": f"{self.created_at.isoformat()}Z",
@@ -60,3 +66,13 @@ class Room(Base):
     class Settings:
         name = "rooms"
         use_state_management = True
+        indexes = [
+            # backs the id-only membership query run at connect
+            IndexModel(
+                [
+                    ("members.$id", pymongo.ASCENDING),
+                    ("is_deleted", pymongo.ASCENDING),
+                ],
+                name="members_id",
+            ),
+        ]
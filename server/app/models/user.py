@@ -3,9 +3,10 @@
 Defines the User model
 """
 
-from beanie import Indexed
+from beanie import Indexed, before_event, Insert, Replace, Save
 from pydantic import model_serializer
 import pymongo
+from pymongo import IndexModel
 
 from app.models.base_model import Base
 
@@ -19,6 +20,12 @@ class User(Base):
     email: str = Indexed(str, unique=True, index_type=pymongo.TEXT)
     password: str
     reset_token: str | None = None
+    username_lower: str | None = None
+
+    @before_event(Insert, Replace, Save)
+    def set_username_lower(self) -> None:
+        """keeps the normalized username used by search in sync"""
+        self.username_lower = self.username.lower()
 
     @model_serializer
     def serialize(self) -> dict:
@@ -36,3 +43,9 @@ class User(Base):
 
     class Settings:
         name = "users"
+        indexes = [
+            IndexModel(
+                [("username_lower", pymongo.ASCENDING)],
+                name="username_lower",
+            ),
+        ]
@@ -9,7 +9,7 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import HTTPException
 
 from app.models.user import User
-from app.db import SESSION_CACHE
+from app.db import SESSION_CACHE, USER_CACHE
 from app.schemas.models import UserLogin, UserRegister, ResponseModel
 from app.middlewares.auth import register_user, authenticate, login_user
 
@@ -72,7 +72,7 @@ async def is_authenticated(
 async def logout(user: User = Depends(authenticate)) -> ResponseModel:
     """logs out a user"""
 
-    SESSION_CACHE.delete(str(user.id))
+    await SESSION_CACHE.delete(str(user.id))
 
     return ResponseModel(
         message="logged out successfully",
@@ -94,7 +94,8 @@ async def get_reset_token(
     reset_token = token_hex()
 
     user.reset_token = reset_token
-    user.save()
+    await user.save()
+    await USER_CACHE.invalidate(user.id)
 
     response.headers["X-Reset-Token"] = reset_token
 
@@ -122,7 +123,8 @@ async def reset_password(
         return HTTPException(status_code=404, detail="invalid reset token")
 
     user.set_password(new_password)
-    user.save()
+    await user.save()
+    await USER_CACHE.invalidate(user.id)
 
     return ResponseModel(
         message="password reset successful",
@@ -1,6 +1,8 @@
 """
 chat events
 """
+import asyncio
+
 from beanie import PydanticObjectId
 
 from app import sio
@@ -10,7 +12,13 @@ from app.middlewares.chat import (
     users_search,
     fetch_user_by_id_or_username,
     fetch_user_chats,
+    fetch_user_chat_ids,
+    dump_with_messages,
+    messages_search,
+    sync_messages,
     add_message,
+    touch_inbox,
+    queue_for_offline,
     new_room,
     new_chat,
     add_or_remove_members,
@@ -19,8 +27,30 @@ from app.middlewares.chat import (
     exit_room_middleware,
     purge_room,
 )
-from app.schemas.models import ResponseModel
-from app.db import SOCKETIO_CACHE, SESSION_CACHE
+from app.schemas.models import response
+from app.settings import settings, MessageStorage
+from app.db import (
+    PRESENCE,
+    SESSION_CACHE,
+    MEMBERSHIP,
+    INBOX,
+    PENDING,
+    READ_CURSORS,
+    TYPING,
+)
+from app.utils import user_room
+from app.encoders import negotiate, forget, packed
+
+
+def enter_rooms(sid: str, rooms: list[str], namespace: str = "/") -> None:
+    """
+    adds a connection to many rooms at once. entering a room only
+    touches this node's room table, so the manager's synchronous
+    primitive is called directly instead of awaiting
+    `sio.enter_room` once per room
+    """
+    for room in rooms:
+        sio.manager.basic_enter_room(sid, namespace, room)
 
 
 @sio.on("connect")
@@ -31,7 +61,9 @@ async def connect(sid: str, environ: dict, auth: dict) -> bool:
     `chat.id or room.id` as the room/chat name
 
     :param auth: Authentication dict
-        passed by the client
+        passed by the client. `encoding: "msgpack"` opts the
+        connection in to msgpack encoded acknowledgements and
+        events, see `PerEncoding`
     """
 
     if auth is None:
@@ -41,16 +73,19 @@ async def connect(sid: str, environ: dict, auth: dict) -> bool:
     if user_id is None:
         return False
 
-    user = await fetch_user_by_id_or_username(user_id)
-    if user is None or not SESSION_CACHE.get(user_id):
+    user, session = await asyncio.gather(
+        fetch_user_by_id_or_username(user_id),
+        SESSION_CACHE.get(user_id),
+    )
+    if user is None or not session:
         return False
 
-    SOCKETIO_CACHE.setv(user_id, sid)
     await sio.save_session(sid, user_id)
+    negotiate(sid, auth)
 
-    chats_or_rooms = await fetch_user_chats(user)
-    for chat_or_room in chats_or_rooms:
-        await sio.enter_room(sid, str(chat_or_room["id"]))
+    c_ids = await fetch_user_chat_ids(user)
+    enter_rooms(sid, [user_room(user.id), *c_ids])
+    await PRESENCE.add(user.id, sid, user.username, c_ids)
 
     print(f"{user.username} CONNECTED")
     return True
@@ -63,105 +98,138 @@ async def handle_disconnect(sid: str):
 
     :param sid: The socket id of the client
     """
-    user_id = await sio.get_session(sid)
-    SOCKETIO_CACHE.delete(user_id)
+    await PRESENCE.remove(sid)
+    TYPING.forget(sid)
+    forget(sid)
     print("DISCONNECTED")
 
 
 @sio.on("search_users")
+@packed
 async def get_users(sid: str, payload: dict) -> dict:
     """
-    fetches a list of users whose username matches a query
-    term
+    fetches a list of users whose username starts with a query
+    term. the page is selected by the optional `after` (the last
+    username of the previous page) and `limit` in the payload
     """
     user_id = payload.get("id")
     term = payload.get("search_term")
 
-    matches = await users_search(user_id, term)
+    try:
+        matches = await users_search(
+            user_id,
+            term,
+            after=payload.get("after"),
+            limit=payload.get("limit"),
+        )
+    except (ValueError, TypeError):
+        return response(
+            message="invalid search term, cursor or limit",
+            status_code=400,
+        )
 
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
         data=matches,
-    ).model_dump()
+    )
 
 
 @sio.on("get_user")
+@packed
 async def get_user(sid: str, payload: dict) -> dict:
     """
     fetches a user from the database
     """
 
     if not payload or len(payload) == 0:
-        return ResponseModel(
+        return response(
             message="no username or id",
             status_code=400,
-        ).model_dump()
+        )
 
     username_or_id = payload.get("id") or payload.get("username")
 
     user = await fetch_user_by_id_or_username(username_or_id)
     if user is None:
-        return ResponseModel(
+        return response(
             message="invalid id or username",
             status_code=404,
-        ).model_dump()
+        )
 
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
         data=user.model_dump(),
-    ).model_dump()
+    )
 
 
 @sio.on("get_user_chats")
+@packed
 async def get_user_chats(sid: str, payload: dict) -> dict:
     """
-    fetches all active chats and rooms for a user
+    fetches one page of the active chats and rooms of a user,
+    most recently active first. the page is selected by the
+    optional `before` (id of the last chat or room of the previous
+    page) and `limit` in the payload
 
     :param sid: The socket id of the client
     :param payload: The payload sent by the client
     """
 
     if not payload or len(payload) == 0:
-        return ResponseModel(
+        return response(
             message="no username or id",
             status_code=400,
-        ).model_dump()
+        )
 
     username_or_id = payload.get("username") or payload.get("id")
 
     user = await fetch_user_by_id_or_username(username_or_id)
     if user is None:
-        return ResponseModel(
+        return response(
             message="invalid id or username",
             status_code=404,
-        ).model_dump()
-
-    rooms_and_chats = await fetch_user_chats(user)
+        )
+
+    try:
+        rooms_and_chats = await fetch_user_chats(
+            user,
+            before=payload.get("before"),
+            limit=payload.get("limit") or settings.INBOX_PAGE_SIZE,
+        )
+    except (ValueError, TypeError):
+        return response(
+            message="invalid cursor or limit",
+            status_code=400,
+        )
 
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
         data=rooms_and_chats,
-    ).model_dump()
+    )
 
 
 @sio.on("get_chat")
+@packed
 async def get_chat(sid: str, payload: dict) -> dict:
     """
-    fetches a chat from the database and reformats
-    the messages to be grouped by date
+    fetches a chat from the database with one page of its
+    messages grouped by date. the page is selected by the
+    optional `before`/`after` cursors (message id or timestamp)
+    and `limit` in the payload, and days follow the client's
+    optional `tz` (IANA zone or UTC offset in minutes)
 
     :param sid: The socket id of the client
     :param payload: The payload sent by the client
     """
 
     if not payload or len(payload) == 0:
-        return ResponseModel(
+        return response(
             message="no chat id",
             status_code=400,
-        ).model_dump()
+        )
 
     chat_id = payload.get("id")
 
@@ -170,31 +238,47 @@ async def get_chat(sid: str, payload: dict) -> dict:
         fetch_links=True,
     ).first_or_none()
     if chat is None:
-        return ResponseModel(
+        return response(
             message="invalid chat id",
             status_code=404,
-        ).model_dump()
+        )
+
+    try:
+        data = await dump_with_messages(
+            chat,
+            before=payload.get("before"),
+            after=payload.get("after"),
+            limit=payload.get("limit"),
+            tz=payload.get("tz"),
+        )
+    except (ValueError, TypeError):
+        return response(
+            message="invalid cursor, limit or timezone",
+            status_code=400,
+        )
 
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
-        data=chat.model_dump(),
-    ).model_dump()
+        data=data,
+    )
 
 
 @sio.on("get_room")
+@packed
 async def get_room(sid: str, payload: dict) -> dict:
-    """fetches a room from the database
+    """fetches a room from the database with one page of its
+    messages, see `get_chat`
 
     :param `sid`: The socket id of the client
     :param payload: The payload sent by the client
     """
 
     if not payload or len(payload) == 0:
-        return ResponseModel(
+        return response(
             message="no room id",
             status_code=400,
-        ).model_dump()
+        )
 
     room_id = payload.get("id")
 
@@ -204,19 +288,92 @@ async def get_room(sid: str, payload: dict) -> dict:
     ).first_or_none()
 
     if room is None:
-        return ResponseModel(
+        return response(
             message="invalid room id",
             status_code=404,
-        ).model_dump()
+        )
+
+    try:
+        data = await dump_with_messages(
+            room,
+            before=payload.get("before"),
+            after=payload.get("after"),
+            limit=payload.get("limit"),
+            tz=payload.get("tz"),
+        )
+    except (ValueError, TypeError):
+        return response(
+            message="invalid cursor, limit or timezone",
+            status_code=400,
+        )
+
+    return response(
+        message="success",
+        status_code=200,
+        data=data,
+    )
+
+
+@sio.on("search_messages")
+@packed
+async def search_messages(sid: str, payload: dict) -> dict:
+    """
+    searches the messages of the connected user's chats and rooms,
+    or of the one whose `id` is in the payload, for the `query`
+    in the payload. results are ranked by relevance, and the page
+    is selected by the optional `cursor` and `limit`
+
+    :param sid: The socket id of the client
+    :param payload: The payload sent by the client
+    """
+
+    if settings.MESSAGE_STORAGE == MessageStorage.BUCKET.value:
+        return response(
+            message="message search is not available",
+            status_code=400,
+        )
+
+    if not payload or not payload.get("query"):
+        return response(
+            message="no query",
+            status_code=400,
+        )
+
+    user = await fetch_user_by_id_or_username(await sio.get_session(sid))
+    if user is None:
+        return response(
+            message="not connected",
+            status_code=401,
+        )
+
+    try:
+        results, next_cursor = await messages_search(
+            user,
+            payload.get("query"),
+            c_id=payload.get("id"),
+            cursor=payload.get("cursor"),
+            limit=payload.get("limit"),
+        )
+    except PermissionError:
+        return response(
+            message="not a member of this chat or room",
+            status_code=403,
+        )
+    except (ValueError, TypeError):
+        return response(
+            message="invalid query, cursor or limit",
+            status_code=400,
+        )
 
-    return ResponseModel(
+    return response(
         message="success",
         status_code=200,
-        data=room.model_dump(),
-    ).model_dump()
+        data={"results": results, "next_cursor": next_cursor},
+    )
 
 
 @sio.on("new_message")
+@packed
 async def new_message(sid: str, payload: dict) -> dict:
     """handles the new message event"""
 
@@ -224,36 +381,202 @@ async def new_message(sid: str, payload: dict) -> dict:
     msg = payload.get("message")
     chat_type = payload.get("type")
 
-    _, err = await add_message(room_or_chat_id, msg, chat_type)
+    message, err = await add_message(room_or_chat_id, msg, chat_type)
     if err:
         return err.model_dump()
 
-    # TODO: put the message on the queue for offline users after
-    # diffing with the sid store for online users
-
+    msg = message.model_dump()
     data = {"message": msg, "id": room_or_chat_id, "type": chat_type}
-    await sio.emit("new_message", data, to=room_or_chat_id, skip_sid=sid)
+    user_id = await sio.get_session(sid)
+    READ_CURSORS.mark(user_id, room_or_chat_id, message.seq)
+    member_ids = await MEMBERSHIP.members(chat_type, room_or_chat_id)
+    await asyncio.gather(
+        touch_inbox(room_or_chat_id, member_ids, message),
+        sio.emit("new_message", data, to=room_or_chat_id, skip_sid=sid),
+        queue_for_offline(member_ids, user_id, "new_message", data),
+    )
 
-    return ResponseModel(
+    return response(
         message="message sent successfully",
         status_code=201,
-    ).model_dump()
+        data=msg,
+    )
+
+
+@sio.on("sync")
+@packed
+async def sync(sid: str, payload: dict) -> dict:
+    """
+    returns the messages the connected user is missing, given the
+    last sequence number they have of each of their chats and rooms
+    in `seqs`, so a reconnecting client does not refetch them all.
+    a conversation with `more` set is synced again from its last
+    message
+
+    :param sid: The socket id of the client
+    :param payload: The payload sent by the client
+    """
+
+    if not payload or not payload.get("seqs"):
+        return response(
+            message="no sequence numbers",
+            status_code=400,
+        )
+
+    user = await fetch_user_by_id_or_username(await sio.get_session(sid))
+    if user is None:
+        return response(
+            message="not connected",
+            status_code=401,
+        )
+
+    try:
+        conversations = await sync_messages(
+            user, payload.get("seqs"), limit=payload.get("limit")
+        )
+    except (ValueError, TypeError) as err:
+        return response(
+            message=str(err),
+            status_code=400,
+        )
+
+    return response(
+        message="messages synced successfully",
+        status_code=200,
+        data=conversations,
+    )
+
+
+@sio.on("mark_read")
+@packed
+async def mark_read(sid: str, payload: dict) -> dict:
+    """
+    records that the connected user has read the chat or room
+    whose `id` and `type` are in the payload up to the message
+    numbered `seq`, or up to its last message if `seq` is past it.
+    acks are written in batches, see `ReadCursors`
+    """
+
+    c_id = (payload or {}).get("id")
+    c_type = (payload or {}).get("type")
+    seq = (payload or {}).get("seq")
+    if (
+        not c_id
+        or c_type not in ("chat", "room")
+        or not isinstance(seq, int)
+        or isinstance(seq, bool)
+        or seq < 1
+    ):
+        return response(
+            message="invalid chat or room id, type or sequence number",
+            status_code=400,
+        )
+
+    user_id = await sio.get_session(sid)
+    if not await MEMBERSHIP.is_member(c_type, c_id, user_id):
+        return response(
+            message="not a member",
+            status_code=403,
+        )
+
+    # a cursor past the last message would hide the next ones
+    seq = min(seq, await INBOX.seq(c_id))
+    if seq > 0:
+        READ_CURSORS.mark(user_id, c_id, seq)
+    return response(
+        message="marked as read",
+        status_code=200,
+    )
+
+
+@sio.on("sync_pending")
+@packed
+async def sync_pending(sid: str, payload: dict | None = None) -> dict:
+    """
+    acknowledges the events missed while offline delivered so far
+    and returns the next batch. clients call it after connecting,
+    passing back `ack`, until no events come back, which
+    acknowledges the last batch
+    """
+    payload = payload or {}
+    ack = payload.get("ack")
+    limit = payload.get("limit") or settings.PENDING_BATCH
+    if not isinstance(limit, int) or limit < 1:
+        return response(
+            message="invalid limit",
+            status_code=400,
+        )
+
+    limit = min(limit, settings.PENDING_BATCH_MAX)
+    user_id = await sio.get_session(sid)
+    try:
+        events, last = await PENDING.read(user_id, ack, limit)
+    except ValueError as err:
+        return response(
+            message=str(err),
+            status_code=400,
+        )
+
+    return response(
+        message="pending events retrieved successfully",
+        status_code=200,
+        data={
+            "events": events,
+            "ack": last or ack,
+        },
+    )
+
+
+@sio.on("typing_start")
+async def typing_start(sid: str, payload: dict) -> None:
+    """
+    shows the connected user as typing in the chat or room whose
+    `id` is in the payload. never acknowledged, nothing is stored
+    and the broadcasts are throttled and coalesced, see `Typing`
+    """
+
+    c_id = (payload or {}).get("id")
+    username = PRESENCE.username(sid)
+    # entered at connect or on join_room, so membership was checked
+    if not c_id or username is None or c_id not in sio.rooms(sid):
+        return
+
+    TYPING.start_typing(sid, c_id, username)
+
+
+@sio.on("typing_stop")
+async def typing_stop(sid: str, payload: dict) -> None:
+    """stops showing the connected user as typing in a chat or room"""
+
+    c_id = (payload or {}).get("id")
+    if c_id:
+        TYPING.stop_typing(sid, c_id)
 
 
 @sio.on("join_room")
+@packed
 async def join_room(sid: str, payload: dict):
     """
-    adds the user to a room
+    adds the user to a chat or room they are a member of,
+    e.g. when told they were added to it
     """
 
     room_name = payload.get("name")
     if not room_name:
         return {"error": "missing room name", "status": 400}
 
+    user_id = await sio.get_session(sid)
+    is_member = await MEMBERSHIP.is_member("room", room_name, user_id)
+    if not is_member:
+        is_member = await MEMBERSHIP.is_member("chat", room_name, user_id)
+    if not is_member:
+        return {"error": "not a member", "status": 403}
+
     await sio.enter_room(sid, room_name)
 
 
 @sio.on("leave_room")
+@packed
 async def leave_room(sid: str, payload: dict):
     """
     removes a user from a room
@@ -267,6 +590,7 @@ async def leave_room(sid: str, payload: dict):
 
 
 @sio.on("create_room")
+@packed
 async def create_room(sid: str, payload: dict) -> dict:
     """
     creates a new room and adds the creator and a mandatory
@@ -286,18 +610,19 @@ async def create_room(sid: str, payload: dict) -> dict:
     await sio.emit(
         "new_room",
         ("new", {"id": str(room.id)}),
-        to=room.id,
+        to=str(room.id),
         skip_sid=sid,
     )
 
-    return ResponseModel(
+    return response(
         message="room created successfully",
         status_code=201,
-        data=room.model_dump(),
-    ).model_dump()
+        data=await dump_with_messages(room),
+    )
 
 
 @sio.on("create_chat")
+@packed
 async def create_chat(sid: str, payload: dict) -> dict:
     """
     creates a new chat between two users
@@ -313,14 +638,15 @@ async def create_chat(sid: str, payload: dict) -> dict:
 
     await sio.enter_room(sid, str(chat.id))
 
-    return ResponseModel(
+    return response(
         message="chat created successfully",
         status_code=201,
-        data=chat.model_dump(),
-    ).model_dump()
+        data=await dump_with_messages(chat),
+    )
 
 
 @sio.on("edit_room_name")
+@packed
 async def edit_room_name(sid: str, payload: dict) -> dict:
     """
     edits the name of a room
@@ -341,14 +667,15 @@ async def edit_room_name(sid: str, payload: dict) -> dict:
         skip_sid=sid,
     )
 
-    return ResponseModel(
+    return response(
         message="room name changed successfully",
         status_code=200,
-        data=room.model_dump(),
-    ).model_dump()
+        data=await dump_with_messages(room),
+    )
 
 
 @sio.on("exit_room")
+@packed
 async def exit_room(sid: str, payload: dict) -> dict:
     """
     handler for leave_room event
@@ -369,13 +696,14 @@ async def exit_room(sid: str, payload: dict) -> dict:
         skip_sid=sid,
     )
 
-    return ResponseModel(
+    return response(
         message="successfully exited room",
         status_code=200,
-    ).model_dump()
+    )
 
 
 @sio.on("delete_room")
+@packed
 async def delete_room(sid: str, payload: dict) -> dict:
     """
     handler for delete_room event
@@ -391,14 +719,14 @@ async def delete_room(sid: str, payload: dict) -> dict:
     if err:
         return err.model_dump()
 
-    return ResponseModel(
+    return response(
         message="successfully deleted room",
         status_code=200,
-    ).model_dump()
+    )
 
 
 # shared handlers
-sio.on("add_member", handler=add_or_remove_members)
-sio.on("remove_member", handler=add_or_remove_members)
-sio.on("add_admin", handler=add_or_remove_admin)
-sio.on("remove_admin", handler=add_or_remove_admin)
+sio.on("add_member", handler=packed(add_or_remove_members))
+sio.on("remove_member", handler=packed(add_or_remove_members))
+sio.on("add_admin", handler=packed(add_or_remove_admin))
+sio.on("remove_admin", handler=packed(add_or_remove_admin))
@@ -13,6 +13,7 @@ from pydantic import (
     field_serializer,
     field_validator,
     model_serializer,
+    model_validator,
     AliasChoices,
 )
 from pydantic_core import PydanticCustomError
@@ -88,6 +89,7 @@ class MessageSchema(BaseModel):
     sender: str
     text: str
     when: datetime
+    seq: int | None = None
 
     @field_validator("id", mode="before")
     @classmethod
@@ -123,7 +125,8 @@ class GenericChat(BaseModel):
     """base class for chat and room schemas"""
 
     id: str = Field(validation_alias=AliasChoices("_id", "id"))
-    last_msg: MessageSchema | None
+    last_msg: MessageSchema | None = None
+    last_msg_doc: MessageSchema | None = Field(default=None, exclude=True)
     updated_at: datetime | None = None
 
     @field_validator("id", mode="before")
@@ -132,6 +135,14 @@ class GenericChat(BaseModel):
         """validates the id field"""
         return str(v)
 
+    @model_validator(mode="after")
+    def prefer_embedded_last_msg(self) -> "GenericChat":
+        """uses the embedded last message over the linked one"""
+        if self.last_msg_doc is not None:
+            self.last_msg = self.last_msg_doc
+
+        return self
+
     @field_serializer("updated_at", when_used="unless-none")
     def serialize_updated_at(self, v: datetime) -> str:
         """serializes the updated_at field"""
@@ -201,3 +212,16 @@ class ResponseModel(BaseModel):
     message: str
     status_code: int
     data: dict | list | None = None
+
+
+def response(
+    message: str,
+    status_code: int,
+    data: Any = None,
+) -> dict:
+    """
+    builds the same dict as `ResponseModel(...).model_dump()`
+    without validating or copying `data`, which must already be
+    serialized, e.g. by `model_dump()`
+    """
+    return {"message": message, "status_code": status_code, "data": data}
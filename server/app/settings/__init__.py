@@ -14,6 +14,35 @@ class Mode(Enum):
     TEST = "test"
 
 
+class MessageStorage(Enum):
+    """message storage layout enum"""
+
+    COLLECTION = "collection"
+    BUCKET = "bucket"
+
+
+class JSONEncoder(Enum):
+    """json encoder enum"""
+
+    JSON = "json"
+    ORJSON = "orjson"
+
+
+class Encoding(Enum):
+    """socket.io payload encoding enum"""
+
+    JSON = "json"
+    MSGPACK = "msgpack"
+
+
+class ClientManager(Enum):
+    """socket.io client manager enum"""
+
+    RABBITMQ = "rabbitmq"
+    REDIS = "redis"
+    LOCAL = "local"
+
+
 class Settings(BaseSettings):
     """common config vars"""
 
@@ -38,12 +67,106 @@ class Settings(BaseSettings):
     REDIS_PORT: int = config("REDIS_PORT", default=6379, cast=int)
     REDIS_SOCKETIO_DB: int = config("REDIS_SOCKETIO_DB", default=1, cast=int)
     REDIS_SESSION_DB: int = config("REDIS_SESSION_DB", default=0, cast=int)
+    REDIS_INDEX_DB: int = config("REDIS_INDEX_DB", default=2, cast=int)
     REDIS_PASSWD: str | None = config("REDIS_PASSWD", default=None)
+    REDIS_MAX_CONNECTIONS: int = config(
+        "REDIS_MAX_CONNECTIONS", default=100, cast=int
+    )
+    REDIS_HEALTH_CHECK_INTERVAL: int = config(
+        "REDIS_HEALTH_CHECK_INTERVAL", default=30, cast=int
+    )
     REDIS_TTL: int = config("REDIS_TTL", default=60 * 60 * 24, cast=int)
+    USER_CACHE_SIZE: int = config("USER_CACHE_SIZE", default=10_000, cast=int)
+    USER_CACHE_TTL: int = config("USER_CACHE_TTL", default=300, cast=int)
+    USER_CACHE_CHANNEL: str = config(
+        "USER_CACHE_CHANNEL", default="popchat:user_cache"
+    )
+    MEMBERSHIP_TTL: int = config(
+        "MEMBERSHIP_TTL", default=7 * 24 * 60 * 60, cast=int
+    )
+    INBOX_TTL: int = config("INBOX_TTL", default=7 * 24 * 60 * 60, cast=int)
+    SEQUENCE_TTL: int = config("SEQUENCE_TTL", default=24 * 60 * 60, cast=int)
+    INBOX_PAGE_SIZE: int = config("INBOX_PAGE_SIZE", default=50, cast=int)
+    INBOX_PAGE_MAX: int = config("INBOX_PAGE_MAX", default=200, cast=int)
+    PRESENCE_TTL: int = config("PRESENCE_TTL", default=90, cast=int)
+    PRESENCE_HEARTBEAT: int = config("PRESENCE_HEARTBEAT", default=30, cast=int)
+    PRESENCE_COALESCE_MS: int = config(
+        "PRESENCE_COALESCE_MS", default=1000, cast=int
+    )
+    PENDING_MAX_LEN: int = config("PENDING_MAX_LEN", default=1000, cast=int)
+    PENDING_MAX_AGE: int = config(
+        "PENDING_MAX_AGE", default=7 * 24 * 60 * 60, cast=int
+    )
+    PENDING_BATCH: int = config("PENDING_BATCH", default=100, cast=int)
+    PENDING_BATCH_MAX: int = config("PENDING_BATCH_MAX", default=500, cast=int)
+    TYPING_THROTTLE_MS: int = config(
+        "TYPING_THROTTLE_MS", default=2000, cast=int
+    )
+    TYPING_INTERVAL_MS: int = config(
+        "TYPING_INTERVAL_MS", default=500, cast=int
+    )
+    TYPING_TTL_MS: int = config("TYPING_TTL_MS", default=5000, cast=int)
+    READ_COALESCE_MS: int = config(
+        "READ_COALESCE_MS", default=1000, cast=int
+    )
+    SEARCH_PAGE_SIZE: int = config("SEARCH_PAGE_SIZE", default=20, cast=int)
+    SEARCH_PAGE_MAX: int = config("SEARCH_PAGE_MAX", default=50, cast=int)
+    USERNAME_INDEX: bool = config("USERNAME_INDEX", default=False, cast=bool)
+    USERNAME_INDEX_MAX: int = config(
+        "USERNAME_INDEX_MAX", default=1_000_000, cast=int
+    )
+    USERNAME_INDEX_CHANNEL: str = config(
+        "USERNAME_INDEX_CHANNEL", default="popchat:usernames"
+    )
+    SOCKETIO_MANAGER: str = config(
+        "SOCKETIO_MANAGER", default=ClientManager.RABBITMQ.value
+    )
+    SOCKETIO_CHANNEL: str = config("SOCKETIO_CHANNEL", default="socketio")
+    SOCKETIO_PUBLISH_QUEUE: int = config(
+        "SOCKETIO_PUBLISH_QUEUE", default=10_000, cast=int
+    )
     RABBITMQ_HOST: str = config("RABBITMQ_HOST", default="localhost")
     RABBITMQ_PORT: int = config("RABBITMQ_PORT", default=5672, cast=int)
     RABBITMQ_USER: str | None = config("RABBITMQ_USER", default=None)
     RABBITMQ_PASSWD: str | None = config("RABBITMQ_PASSWD", default=None)
+    JSON_ENCODER: str = config("JSON_ENCODER", default=JSONEncoder.ORJSON.value)
+    METRICS_ENABLED: bool = config("METRICS_ENABLED", default=False, cast=bool)
+    MSGPACK_ENABLED: bool = config("MSGPACK_ENABLED", default=False, cast=bool)
+    MESSAGE_PAGE_SIZE: int = config("MESSAGE_PAGE_SIZE", default=50, cast=int)
+    MESSAGE_PAGE_MAX: int = config("MESSAGE_PAGE_MAX", default=200, cast=int)
+    MESSAGE_SEARCH_PAGE_SIZE: int = config(
+        "MESSAGE_SEARCH_PAGE_SIZE", default=20, cast=int
+    )
+    MESSAGE_SEARCH_PAGE_MAX: int = config(
+        "MESSAGE_SEARCH_PAGE_MAX", default=50, cast=int
+    )
+    MESSAGE_SEARCH_CONCURRENCY: int = config(
+        "MESSAGE_SEARCH_CONCURRENCY", default=16, cast=int
+    )
+    SYNC_PAGE_SIZE: int = config("SYNC_PAGE_SIZE", default=100, cast=int)
+    SYNC_PAGE_MAX: int = config("SYNC_PAGE_MAX", default=500, cast=int)
+    SYNC_MAX_CONVERSATIONS: int = config(
+        "SYNC_MAX_CONVERSATIONS", default=500, cast=int
+    )
+    SYNC_CONCURRENCY: int = config("SYNC_CONCURRENCY", default=16, cast=int)
+    MESSAGE_STORAGE: str = config(
+        "MESSAGE_STORAGE", default=MessageStorage.COLLECTION.value
+    )
+    MESSAGE_BUCKET_SIZE: int = config(
+        "MESSAGE_BUCKET_SIZE", default=500, cast=int
+    )
+    MESSAGE_WRITE_BEHIND: bool = config(
+        "MESSAGE_WRITE_BEHIND", default=False, cast=bool
+    )
+    MESSAGE_FLUSH_SIZE: int = config(
+        "MESSAGE_FLUSH_SIZE", default=100, cast=int
+    )
+    MESSAGE_FLUSH_INTERVAL_MS: int = config(
+        "MESSAGE_FLUSH_INTERVAL_MS", default=200, cast=int
+    )
+    MESSAGE_FLUSH_RETRIES: int = config(
+        "MESSAGE_FLUSH_RETRIES", default=3, cast=int
+    )
 
 
 settings = Settings()
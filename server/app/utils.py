@@ -1,38 +1,160 @@
 """
 chat utility helper functions
 """
+from datetime import datetime, timedelta, timezone, tzinfo, UTC
+from typing import Iterable
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from bson import DBRef
 from passlib.context import CryptContext
 
-from app.schemas.models import MessageSchema, DayMessages
+from app.models.message import Message, serialize_message_doc
+from app.schemas.models import MessageSchema
+from app.settings import settings, MessageStorage
 
 
 HASHER = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
-def group_messages(messages: list[MessageSchema]) -> list[dict]:
+def get_timezone(tz: str | int | None) -> tzinfo:
+    """
+    returns the timezone a client groups its messages in
+
+    :param tz: an IANA zone name, or a UTC offset in minutes
+        east of UTC. defaults to UTC
+    :raises ValueError on an unknown zone or offset
     """
-    takes a list of messages and groups them by date
+    if tz is None or tz == "":
+        return UTC
+
+    if isinstance(tz, int) or str(tz).lstrip("+-").isdigit():
+        return timezone(timedelta(minutes=int(tz)))
+
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"unknown timezone {tz}")
+
+
+def group_messages(
+    messages: Iterable[Message | MessageSchema | dict],
+    tz: tzinfo = UTC,
+) -> list[dict]:
     """
+    takes a list of messages sorted by `when` and groups them
+    by date in a single pass, without re-validating them.
+    naive timestamps are taken to be in UTC
 
-    new_messages: list[DayMessages] = []
+    :param messages: the messages, oldest first
+    :param tz: the timezone whose dates the messages are grouped by
+    :return a list of serialized `DayMessages`
+    """
+
+    days: list[dict] = []
+    by_date: dict[str, dict] = {}
+    day = None
+    day_start = day_end = None
     for message in messages:
-        when = message.when
-        when_date = when.date().strftime("%Y-%m-%d")
-        for day in new_messages:
-            day_date = day.date
-            day_messages = day.messages
-            if day_date == when_date:
-                day_messages.append(message)
-                break
+        if isinstance(message, dict):
+            doc = message
         else:
-            new_messages.append(
-                DayMessages(
-                    date=when_date,
-                    messages=[MessageSchema(**(message.model_dump()))],
-                )
-            )
-
-    return [msg.model_dump() for msg in new_messages]
+            doc = {
+                "id": message.id,
+                "text": message.text,
+                "sender": message.sender,
+                "when": message.when,
+                "seq": message.seq,
+            }
+        when = doc["when"]
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=UTC)
+
+        if day is None or not day_start <= when < day_end:
+            local = when.astimezone(tz)
+            midnight = local.replace(hour=0, minute=0, second=0, microsecond=0)
+            day_start = midnight.astimezone(UTC)
+            day_end = (midnight + timedelta(days=1)).astimezone(UTC)
+            date = local.date().isoformat()
+            day = by_date.get(date)
+            if day is None:
+                day = by_date[date] = {"date": date, "messages": []}
+                days.append(day)
+
+        day["messages"].append(serialize_message_doc(doc))
+
+    return days
+
+
+def last_msg_pipeline(message: Message, seq: int | None = None) -> list[dict]:
+    """
+    returns an update pipeline that points a chat or room at a
+    message only if it is newer than its current last message,
+    and moves its `seq` high-water mark forward. the message is
+    embedded as `last_msg_doc`, and also linked as `last_msg` with
+    collection storage, buckets have no message document to link to
+
+    :param message: the message, with its id and seq set
+    :param seq: the highest sequence number written, if another
+        message written with it has a higher one
+    """
+    when = message.when
+    is_newer = {"$lt": [{"$ifNull": ["$last_msg_at", None]}, when]}
+    fields = {
+        "last_msg_doc": {
+            "$cond": [
+                is_newer,
+                {"$literal": message.to_doc()},
+                "$last_msg_doc",
+            ]
+        },
+        "last_msg_at": {"$max": ["$last_msg_at", when]},
+        "seq": {"$max": [{"$ifNull": ["$seq", 0]}, seq or message.seq]},
+        "updated_at": {"$max": ["$updated_at", datetime.now(UTC)]},
+    }
+    if settings.MESSAGE_STORAGE == MessageStorage.COLLECTION.value:
+        msg_ref = DBRef(Message.Settings.name, message.id)
+        fields["last_msg"] = {
+            "$cond": [is_newer, {"$literal": msg_ref}, "$last_msg"]
+        }
+
+    return [{"$set": fields}]
+
+
+def make_snippet(text: str, query: str, width: int = 80) -> str:
+    """
+    returns the part of a message around the first word of a
+    search query it contains, or its start
+
+    :param text: the text of the message
+    :param query: the search query
+    :param width: the length of the snippet, without ellipses
+    """
+    if len(text) <= width:
+        return text
+
+    lower = text.lower()
+    hits = [
+        lower.find(word)
+        for word in query.lower().replace('"', " ").split()
+        if not word.startswith("-") and word in lower
+    ]
+    start = max(min(hits, default=0) - width // 4, 0)
+    start = min(start, len(text) - width)
+    snippet = text[start : start + width]
+
+    return (
+        ("..." if start > 0 else "")
+        + snippet
+        + ("..." if start + width < len(text) else "")
+    )
+
+
+def user_room(user_id) -> str:
+    """
+    returns the socket.io room every connection of a user joins,
+    to reach the user on whichever node they are connected to
+    """
+    return f"user:{user_id}"
 
 
 def create_passwd_hash(passwd: str) -> str:
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+micro-benchmark for `group_messages`, comparing the single-pass
+grouper with the previous per-day scan on growing histories.
+CLI command to run, from the server directory:
+python3 -m benchmarks.group_messages [--sizes 1000 10000 100000]
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, UTC
+from time import perf_counter
+
+from bson import ObjectId
+
+from app.schemas.models import MessageSchema, DayMessages
+from app.utils import group_messages, get_timezone
+
+
+def legacy_group_messages(messages: list[MessageSchema]) -> list[dict]:
+    """the previous implementation, kept for comparison"""
+
+    new_messages: list[DayMessages] = []
+    for message in messages:
+        when_date = message.when.date().strftime("%Y-%m-%d")
+        for day in new_messages:
+            if day.date == when_date:
+                day.messages.append(message)
+                break
+        else:
+            new_messages.append(
+                DayMessages(
+                    date=when_date,
+                    messages=[MessageSchema(**(message.model_dump()))],
+                )
+            )
+
+    return [msg.model_dump() for msg in new_messages]
+
+
+def make_history(size: int, per_day: int) -> list[MessageSchema]:
+    """builds a history of `size` messages, `per_day` a day"""
+    start = datetime(2023, 1, 1, tzinfo=UTC)
+    step = timedelta(days=1) / per_day
+    return [
+        MessageSchema(
+            id=str(ObjectId()),
+            sender=f"user{i % 7}",
+            text=f"message number {i}",
+            when=start + i * step,
+        )
+        for i in range(size)
+    ]
+
+
+def timed(fn, *args) -> float:
+    """returns the best of three runs, in milliseconds"""
+    best = float("inf")
+    for _ in range(3):
+        start = perf_counter()
+        fn(*args)
+        best = min(best, perf_counter() - start)
+
+    return best * 1000
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="group_messages benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+    )
+    parser.add_argument("--per-day", type=int, default=100)
+    parser.add_argument("--tz", default="Africa/Lagos")
+    parser.add_argument(
+        "--skip-legacy",
+        action="store_true",
+        help="only time the single-pass grouper",
+    )
+    args = parser.parse_args()
+
+    tz = get_timezone(args.tz)
+    print(f"{'messages':>10} {'days':>6} {'legacy ms':>11} {'new ms':>9}")
+    for size in args.sizes:
+        history = make_history(size, args.per_day)
+        new_ms = timed(group_messages, history, tz)
+        legacy = "-"
+        if not args.skip_legacy:
+            legacy = f"{timed(legacy_group_messages, history):.1f}"
+        days = -(-size // args.per_day)
+        print(f"{size:>10} {days:>6} {legacy:>11} {new_ms:>9.1f}")
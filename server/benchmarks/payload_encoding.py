@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+micro-benchmark for socket.io payload encodings, comparing the
+size and encode/decode time of json and msgpack for `get_room`
+acknowledgements and `new_message` events.
+CLI command to run, from the server directory:
+python3 -m benchmarks.payload_encoding [--messages 50 500]
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, UTC
+from time import perf_counter
+
+from bson import ObjectId
+
+from app.encoders import JSON, MsgPack, StdJSON, msgpack
+from app.schemas.models import response
+from app.utils import group_messages
+
+
+def make_message(i: int, when: datetime) -> dict:
+    """builds a serialized message"""
+    return {
+        "id": str(ObjectId()),
+        "text": f"message number {i}, with a bit of text to it",
+        "sender": f"user{i % 7}",
+        "when": when,
+    }
+
+
+def get_room_payload(size: int) -> dict:
+    """builds a `get_room` acknowledgement with `size` messages"""
+    start = datetime(2023, 1, 1, tzinfo=UTC)
+    messages = [
+        make_message(i, start + i * timedelta(minutes=15))
+        for i in range(size)
+    ]
+    members = [
+        {"id": str(ObjectId()), "username": f"user{i}"} for i in range(7)
+    ]
+    return response(
+        message="success",
+        status_code=200,
+        data={
+            "id": str(ObjectId()),
+            "name": "benchmark room",
+            "members": members,
+            "admins": members[:2],
+            "messages": group_messages(messages),
+            "next_cursor": messages[0]["id"] if messages else None,
+        },
+    )
+
+
+def new_message_payload() -> dict:
+    """builds a `new_message` event"""
+    message = make_message(0, datetime.now(UTC))
+    return {"message": message, "id": str(ObjectId()), "type": "room"}
+
+
+def timed(fn, arg, runs: int) -> float:
+    """returns the best of three rounds, in microseconds per call"""
+    best = float("inf")
+    for _ in range(3):
+        start = perf_counter()
+        for _ in range(runs):
+            fn(arg)
+        best = min(best, (perf_counter() - start) / runs)
+
+    return best * 1_000_000
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="payload encoding benchmark")
+    parser.add_argument(
+        "--messages",
+        type=int,
+        nargs="+",
+        default=[50, 500],
+        help="messages per get_room payload",
+    )
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    encoders = [("json", StdJSON)]
+    if JSON is not StdJSON:
+        encoders.append(("orjson", JSON))
+    if msgpack is not None:
+        encoders.append(("msgpack", MsgPack))
+    else:
+        print("msgpack is not installed, only json is measured")
+
+    payloads = [("new_message", new_message_payload())] + [
+        (f"get_room {size}", get_room_payload(size)) for size in args.messages
+    ]
+    print(
+        f"{'payload':<16} {'encoding':<8} {'bytes':>9}"
+        f" {'encode us':>10} {'decode us':>10}"
+    )
+    for name, payload in payloads:
+        for label, encoder in encoders:
+            encoded = encoder.dumpb(payload)
+            encode_us = timed(encoder.dumpb, payload, args.runs)
+            decode_us = timed(encoder.loads, encoded, args.runs)
+            print(
+                f"{name:<16} {label:<8} {len(encoded):>9}"
+                f" {encode_us:>10.1f} {decode_us:>10.1f}"
+            )
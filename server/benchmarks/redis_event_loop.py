@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+benchmark of event loop latency under concurrent socket.io
+connects, comparing the cache calls of `connect` made with the
+blocking redis client against the asyncio `Cache`. a probe task
+sleeps 1ms at a time and records how late it wakes up. needs the
+redis server from the settings, and writes to its socketio db.
+CLI command to run, from the server directory:
+python3 -m benchmarks.redis_event_loop [--connects 2000] [--concurrency 200]
+"""
+from argparse import ArgumentParser
+import asyncio
+from statistics import quantiles
+from time import perf_counter
+
+from bson import ObjectId
+from redis import Redis
+
+from app.db import Cache
+from app.settings import settings
+
+
+PROBE_INTERVAL = 0.001
+
+
+async def probe(lags: list[float], done: asyncio.Event) -> None:
+    """records how late each 1ms sleep wakes up, in ms"""
+    while not done.is_set():
+        start = perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append((perf_counter() - start - PROBE_INTERVAL) * 1000)
+
+
+async def blocking_connect(redis: Redis, user_id: str, sid: str) -> None:
+    """the cache calls of `connect`, before the asyncio cache"""
+    redis.get(user_id)
+    redis.set(f"bench:{user_id}", sid)
+
+
+async def async_connect(cache: Cache, user_id: str, sid: str) -> None:
+    """the cache calls of `connect`"""
+    await cache.get(user_id)
+    await cache.setv(f"bench:{user_id}", sid)
+
+
+async def run(connect, client, connects: int, concurrency: int) -> dict:
+    """runs `connects` connects, `concurrency` at a time"""
+    lags: list[float] = []
+    done = asyncio.Event()
+    prober = asyncio.create_task(probe(lags, done))
+    await asyncio.sleep(PROBE_INTERVAL)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> None:
+        async with semaphore:
+            await connect(client, str(ObjectId()), str(ObjectId()))
+
+    start = perf_counter()
+    await asyncio.gather(*(one() for _ in range(connects)))
+    elapsed = perf_counter() - start
+    done.set()
+    await prober
+
+    cuts = quantiles(lags, n=100) if len(lags) > 1 else [0.0] * 99
+    return {
+        "connects/s": connects / elapsed,
+        "probes": len(lags),
+        "p50 lag ms": cuts[49],
+        "p99 lag ms": cuts[98],
+        "max lag ms": max(lags, default=0.0),
+    }
+
+
+async def main(connects: int, concurrency: int) -> None:
+    """runs both variants and prints their numbers"""
+    blocking = Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_SOCKETIO_DB,
+        password=settings.REDIS_PASSWD,
+        decode_responses=True,
+    )
+    cache = Cache(db=settings.REDIS_SOCKETIO_DB, ttl=settings.REDIS_TTL)
+
+    results = {
+        "blocking": await run(
+            blocking_connect, blocking, connects, concurrency
+        ),
+        "asyncio": await run(async_connect, cache, connects, concurrency),
+    }
+
+    columns = list(results["asyncio"])
+    print(f"{'client':<10}" + "".join(f"{col:>13}" for col in columns))
+    for name, result in results.items():
+        print(
+            f"{name:<10}"
+            + "".join(f"{result[col]:>13.1f}" for col in columns)
+        )
+
+    keys = blocking.keys("bench:*")
+    for i in range(0, len(keys), 1000):
+        blocking.delete(*keys[i : i + 1000])
+    blocking.close()
+    await cache.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="redis event loop benchmark")
+    parser.add_argument("--connects", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.connects, args.concurrency))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+benchmark of the socket.io traffic caused by each typed keystroke,
+comparing a broadcast per keystroke against the throttled and
+coalesced `Typing` indicators. every broadcast is one message
+published through the client manager (rabbitmq) and one packet
+sent to each member of the conversation. runs on a simulated
+clock, so it needs no services and runs instantly.
+CLI command to run, from the server directory:
+python3 -m benchmarks.typing_amplification [--typists 3] [--members 50]
+"""
+from argparse import ArgumentParser
+import asyncio
+
+from app.db.typing import Typing
+from app.settings import settings
+
+
+C_ID = "conversation"
+
+
+class Clock:
+    """a clock moved forward by hand"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def coalesced(
+    typists: int,
+    seconds: float,
+    cps: float,
+    pause: float,
+) -> tuple[int, int]:
+    """
+    replays the keystrokes through `Typing`
+
+    :return the number of keystrokes and of broadcasts
+    """
+    clock = Clock()
+    typing = Typing(
+        throttle_ms=settings.TYPING_THROTTLE_MS,
+        interval_ms=settings.TYPING_INTERVAL_MS,
+        ttl_ms=settings.TYPING_TTL_MS,
+    )
+    typing.clock = clock
+
+    async def emit(*args, **kwargs) -> None:
+        pass
+
+    typing.emit = emit
+
+    # one typist's keystrokes and stops are evenly spread over
+    # bursts of `pause` seconds of typing followed by `pause` of rest
+    events: list[tuple[float, int, bool]] = []
+    for typist in range(typists):
+        offset = typist / (typists * cps)
+        t = offset
+        while t < seconds:
+            burst_end = t + pause
+            while t < min(burst_end, seconds):
+                events.append((t, typist, True))
+                t += 1 / cps
+            events.append((min(t, seconds), typist, False))
+            t = burst_end + pause
+    events.sort()
+
+    keystrokes = 0
+    next_flush = typing.interval
+    for when, typist, typed in events:
+        while next_flush <= when:
+            clock.now = next_flush
+            await typing.flush()
+            next_flush += typing.interval
+        clock.now = when
+        if typed:
+            keystrokes += 1
+            typing.start_typing(f"sid{typist}", C_ID, f"user{typist}")
+        else:
+            typing.stop_typing(f"sid{typist}", C_ID)
+    await typing.flush()
+
+    return keystrokes, typing.broadcasts
+
+
+async def main(
+    typists: int,
+    members: int,
+    seconds: float,
+    cps: float,
+    pause: float,
+) -> None:
+    """runs the simulation and prints the traffic per keystroke"""
+    keystrokes, broadcasts = await coalesced(typists, seconds, cps, pause)
+
+    # everyone in the conversation but the typist gets each broadcast
+    receivers = members - 1
+    results = {
+        "per keystroke": (keystrokes, keystrokes * receivers),
+        "coalesced": (broadcasts, broadcasts * receivers),
+    }
+
+    print(
+        f"{typists} typists, {members} members, {keystrokes} keystrokes"
+        f" in {seconds:.0f}s"
+    )
+    print(
+        f"{'strategy':<15}{'published':>12}{'delivered':>12}"
+        f"{'pub/key':>10}{'dlv/key':>10}"
+    )
+    for name, (published, delivered) in results.items():
+        print(
+            f"{name:<15}{published:>12}{delivered:>12}"
+            f"{published / keystrokes:>10.3f}"
+            f"{delivered / keystrokes:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="typing amplification benchmark")
+    parser.add_argument("--typists", type=int, default=3)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--cps", type=float, default=5, help="keys/s")
+    parser.add_argument(
+        "--pause", type=float, default=10, help="seconds per burst"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(args.typists, args.members, args.seconds, args.cps, args.pause)
+    )
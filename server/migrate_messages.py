@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+migrates chats and rooms from embedded message links to the
+chat-keyed messages collection.
+
+walks each collection in `_id` order, one batch at a time, tags the
+linked messages with their `chat_id`/`chat_type`, backfills
+`last_msg_at` and drops the `messages` array from the parent. the
+last migrated `_id` of each collection is saved to a checkpoint file
+after every batch, so an interrupted run resumes where it stopped.
+with `--buckets`, the day buckets used by the bucket storage layout
+are then backfilled from the messages collection.
+CLI command to run:
+python3 migrate_messages.py [--batch-size N] [--buckets] [--dry-run]
+"""
+from argparse import ArgumentParser
+import json
+from pathlib import Path
+from time import perf_counter
+
+from bson import ObjectId
+from pymongo import MongoClient, ReplaceOne, UpdateMany, UpdateOne
+
+from app.db import get_mongo_uri
+from app.settings import settings
+
+
+COLLECTIONS = {"chats": "chat", "rooms": "room"}
+
+
+def load_checkpoint(path: Path) -> dict:
+    """loads the last migrated id of each collection"""
+    if not path.exists():
+        return {}
+
+    return json.loads(path.read_text())
+
+
+def save_checkpoint(path: Path, checkpoint: dict) -> None:
+    """saves the last migrated id of each collection"""
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(checkpoint))
+    tmp.replace(path)
+
+
+def migrate_batch(
+    db,
+    name: str,
+    parents: list[dict],
+    chunk_size: int,
+    dry_run: bool,
+) -> int:
+    """
+    migrates one batch of chats or rooms
+
+    :return the number of messages tagged
+    """
+    c_type = COLLECTIONS[name]
+    message_ops = []
+    tagged = 0
+    for parent in parents:
+        msg_ids = [ref.id for ref in parent.get("messages") or []]
+        tagged += len(msg_ids)
+        for i in range(0, len(msg_ids), chunk_size):
+            message_ops.append(
+                UpdateMany(
+                    {"_id": {"$in": msg_ids[i : i + chunk_size]}},
+                    {"$set": {"chat_id": parent["_id"], "chat_type": c_type}},
+                )
+            )
+
+    last_ids = [p["last_msg"].id for p in parents if p.get("last_msg")]
+    last_msgs = {
+        msg["_id"]: msg
+        for msg in db.messages.find(
+            {"_id": {"$in": last_ids}},
+            {"text": 1, "sender": 1, "when": 1, "seq": 1},
+        )
+    }
+    parent_ops = []
+    for parent in parents:
+        update = {"$unset": {"messages": ""}}
+        last_msg = parent.get("last_msg")
+        if last_msg and last_msg.id in last_msgs:
+            msg = last_msgs[last_msg.id]
+            # embedded too, bucket storage reads no message document
+            update["$set"] = {
+                "last_msg_at": msg["when"],
+                "last_msg_doc": {"seq": None, **msg},
+            }
+        parent_ops.append(UpdateOne({"_id": parent["_id"]}, update))
+
+    if dry_run:
+        return tagged
+
+    # messages are tagged before their links are dropped, so a crash
+    # between the two writes is repaired by re-running the batch
+    if message_ops:
+        db.messages.bulk_write(message_ops, ordered=False)
+    db[name].bulk_write(parent_ops, ordered=False)
+
+    return tagged
+
+
+def backfill_buckets(
+    db,
+    name: str,
+    parents: list[dict],
+    chunk_size: int,
+    dry_run: bool,
+) -> int:
+    """
+    rebuilds the day buckets of one batch of chats or rooms,
+    streaming their messages in `when` order. backfilled buckets
+    are keyed by their `part` within the day, so re-running a
+    batch replaces them instead of duplicating them
+
+    :return the number of messages bucketed
+    """
+    c_type = COLLECTIONS[name]
+    size = settings.MESSAGE_BUCKET_SIZE
+    ops = []
+    bucketed = 0
+
+    def flush_bucket(bucket: dict) -> None:
+        nonlocal ops
+        if dry_run:
+            return
+        bucket["n_messages"] = len(bucket["messages"])
+        key = {k: bucket[k] for k in ("chat_id", "date", "part")}
+        ops.append(ReplaceOne(key, bucket, upsert=True))
+        if len(ops) >= chunk_size:
+            db.message_buckets.bulk_write(ops, ordered=False)
+            ops = []
+
+    for parent in parents:
+        bucket = None
+        messages = (
+            db.messages.find(
+                {"chat_id": parent["_id"]},
+                {"text": 1, "sender": 1, "when": 1, "seq": 1},
+            )
+            .sort([("when", 1), ("_id", 1)])
+            .batch_size(chunk_size)
+        )
+        for msg in messages:
+            bucketed += 1
+            date = msg["when"].date().isoformat()
+            if bucket is not None and (
+                bucket["date"] != date or len(bucket["messages"]) >= size
+            ):
+                flush_bucket(bucket)
+                part = bucket["part"] + 1 if bucket["date"] == date else 0
+                bucket = None
+            else:
+                part = 0
+            if bucket is None:
+                bucket = {
+                    "chat_id": parent["_id"],
+                    "chat_type": c_type,
+                    "date": date,
+                    "part": part,
+                    "messages": [],
+                }
+            bucket["messages"].append(msg)
+        if bucket is not None:
+            flush_bucket(bucket)
+
+    if ops:
+        db.message_buckets.bulk_write(ops, ordered=False)
+
+    return bucketed
+
+
+def migrate(
+    batch_size: int,
+    chunk_size: int,
+    checkpoint_path: Path,
+    buckets: bool,
+    dry_run: bool,
+) -> None:
+    """migrates all chats and rooms"""
+
+    db = MongoClient(get_mongo_uri())[settings.DB_NAME]
+    checkpoint = load_checkpoint(checkpoint_path)
+    start = perf_counter()
+    total_parents = total_messages = 0
+
+    phases = [(name, migrate_batch, True) for name in COLLECTIONS]
+    if buckets:
+        phases += [(name, backfill_buckets, False) for name in COLLECTIONS]
+
+    for name, migrate_fn, links_only in phases:
+        key = name if links_only else f"{name}_buckets"
+        last_id = checkpoint.get(key)
+        while True:
+            query = {"messages": {"$exists": True}} if links_only else {}
+            if last_id:
+                query["_id"] = {"$gt": ObjectId(last_id)}
+            projection = {"messages": 1, "last_msg": 1} if links_only else {}
+            parents = list(
+                db[name]
+                .find(query, projection or {"_id": 1})
+                .sort("_id", 1)
+                .limit(batch_size)
+            )
+            if not parents:
+                break
+
+            tagged = migrate_fn(db, name, parents, chunk_size, dry_run)
+            last_id = str(parents[-1]["_id"])
+            total_parents += len(parents)
+            total_messages += tagged
+            if not dry_run:
+                checkpoint[key] = last_id
+                save_checkpoint(checkpoint_path, checkpoint)
+
+            elapsed = perf_counter() - start
+            print(
+                f"{key}: {total_parents} conversations,"
+                f" {total_messages} messages"
+                f" ({total_messages / elapsed:.0f} msgs/s), last id {last_id}"
+            )
+
+    elapsed = perf_counter() - start
+    prefix = "DRY RUN: would migrate" if dry_run else "migrated"
+    print(
+        f"{prefix} {total_parents} conversations and {total_messages}"
+        f" messages in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=100,
+        help="conversations read per batch",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=1000,
+        help="message ids per update",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        default=Path(".migrate_messages.json"),
+        help="checkpoint file, delete it to start over",
+    )
+    parser.add_argument(
+        "--buckets",
+        action="store_true",
+        help="also backfill the day buckets of the bucket storage",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report what would be migrated without writing",
+    )
+    args = parser.parse_args()
+
+    migrate(
+        args.batch_size,
+        args.chunk_size,
+        args.checkpoint,
+        args.buckets,
+        args.dry_run,
+    )
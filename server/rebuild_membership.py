@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+rebuilds the redis membership index of every chat and room from
+mongo, e.g. after the index drifted or redis lost its data. each
+entry is replaced atomically, so the index stays usable while the
+command runs, and the entries of deleted rooms are dropped.
+CLI command to run:
+python3 rebuild_membership.py [--batch-size N]
+"""
+from argparse import ArgumentParser
+import asyncio
+from time import perf_counter
+
+from app.db import MEMBERSHIP, init_db, get_mongo_uri
+from app.models.chat import Chat
+from app.models.room import Room
+
+
+async def rebuild(batch_size: int) -> None:
+    """rebuilds the entries of all chats and rooms"""
+
+    await init_db(get_mongo_uri())
+    start = perf_counter()
+    total = 0
+    projections = {
+        Chat: {"user_1": 1, "user_2": 1, "is_deleted": 1},
+        Room: {"creator": 1, "members": 1, "admins": 1, "is_deleted": 1},
+    }
+    for cls, projection in projections.items():
+        cursor = (
+            cls.get_motor_collection()
+            .find({}, projection)
+            .sort("_id", 1)
+            .batch_size(batch_size)
+        )
+        batch = []
+        async for doc in cursor:
+            if doc.get("is_deleted"):
+                c_type = "chat" if cls is Chat else "room"
+                batch.append(MEMBERSHIP.drop(c_type, doc["_id"]))
+            elif cls is Chat:
+                members = [doc["user_1"].id, doc["user_2"].id]
+                batch.append(MEMBERSHIP.set_chat(doc["_id"], members))
+            else:
+                batch.append(
+                    MEMBERSHIP.set_room(
+                        doc["_id"],
+                        doc["creator"].id,
+                        [ref.id for ref in doc["members"]],
+                        [ref.id for ref in doc["admins"]],
+                    )
+                )
+            if len(batch) >= batch_size:
+                await asyncio.gather(*batch)
+                total += len(batch)
+                batch = []
+                print(f"{cls.Settings.name}: {total} conversations indexed")
+        await asyncio.gather(*batch)
+        total += len(batch)
+
+    elapsed = perf_counter() - start
+    print(f"rebuilt {total} conversations in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split("\n")[1].strip())
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="conversations written concurrently",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(rebuild(args.batch_size))
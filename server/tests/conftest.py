@@ -0,0 +1,68 @@
+"""
+shared fixtures. mongo is mocked with mongomock-motor and redis with
+fakeredis, whose lua support runs the scripts of `app.db`
+"""
+import os
+
+# read by the settings when the app is imported
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("SOCKETIO_MANAGER", "local")
+
+from beanie import init_beanie  # noqa: E402
+from fakeredis import FakeAsyncRedis  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+import pytest  # noqa: E402
+
+from app.db.sequences import Sequences  # noqa: E402
+from app.middlewares import chat as chat_middlewares  # noqa: E402
+from app.models.bucket import MessageBucket  # noqa: E402
+from app.models.chat import Chat  # noqa: E402
+from app.models.message import Message  # noqa: E402
+from app.models.read_state import ReadState  # noqa: E402
+from app.models.room import Room  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.settings import settings, MessageStorage  # noqa: E402
+
+
+@pytest.fixture
+async def db():
+    """initializes beanie on an empty mocked database"""
+    client = AsyncMongoMockClient()
+    await init_beanie(
+        database=client["popchat_test"],
+        document_models=[User, Chat, Room, Message, MessageBucket, ReadState],
+    )
+    return client["popchat_test"]
+
+
+@pytest.fixture
+async def redis():
+    """an empty fake redis"""
+    client = FakeAsyncRedis(decode_responses=True)
+    yield client
+    await client.flushall()
+    await client.aclose()
+
+
+@pytest.fixture
+def sequences(redis, monkeypatch) -> Sequences:
+    """sequence counters in the fake redis, used by the sends"""
+    counters = Sequences(redis, ttl=60)
+    monkeypatch.setattr(chat_middlewares, "SEQUENCES", counters)
+    return counters
+
+
+@pytest.fixture
+def bucket_storage(monkeypatch):
+    """stores messages in day buckets"""
+    monkeypatch.setattr(
+        settings, "MESSAGE_STORAGE", MessageStorage.BUCKET.value
+    )
+
+
+@pytest.fixture
+def collection_storage(monkeypatch):
+    """stores messages in their own collection"""
+    monkeypatch.setattr(
+        settings, "MESSAGE_STORAGE", MessageStorage.COLLECTION.value
+    )
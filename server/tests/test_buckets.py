@@ -0,0 +1,135 @@
+"""tests of the day buckets of bucket storage"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.middlewares.chat import (
+    append_message,
+    dump_with_messages,
+    fetch_bucket_messages,
+)
+from app.models.bucket import MessageBucket
+from app.models.chat import Chat
+from app.models.message import Message
+from app.settings import settings
+
+
+DAY = datetime(2024, 1, 2, 12)
+
+
+@pytest.fixture
+async def chat(db, sequences, bucket_storage, monkeypatch):
+    """an empty chat whose buckets hold two messages"""
+    monkeypatch.setattr(settings, "MESSAGE_BUCKET_SIZE", 2)
+    c_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {"_id": c_id, "is_deleted": False, "seq": 0}
+    )
+    return c_id
+
+
+def texts(messages: list[dict]) -> list[str]:
+    """returns the texts of a page"""
+    return [msg["text"] for msg in messages]
+
+
+async def send(c_id, text: str, when: datetime) -> Message:
+    """appends a message to the chat"""
+    message = Message(text=text, sender="ann", when=when, chat_type="chat")
+    assert await append_message(Chat, c_id, message)
+    return message
+
+
+async def test_day_spans_every_bucket(chat):
+    # a migrated part and two live buckets, all on the same day
+    await MessageBucket(
+        chat_id=chat,
+        chat_type="chat",
+        date=DAY.date().isoformat(),
+        n_messages=1,
+        part=0,
+        messages=[
+            {
+                "_id": PydanticObjectId(),
+                "text": "migrated",
+                "sender": "bob",
+                "when": DAY - timedelta(hours=1),
+                "seq": None,
+            }
+        ],
+    ).insert()
+    for n in range(3):
+        await send(chat, f"live {n}", DAY + timedelta(minutes=n))
+    await send(chat, "yesterday", DAY - timedelta(days=1))
+
+    assert await MessageBucket.find(MessageBucket.chat_id == chat).count() == 4
+
+    page, cursor = await fetch_bucket_messages(chat, limit=10)
+    assert cursor is None
+    assert texts(page) == [
+        "yesterday",
+        "migrated",
+        "live 0",
+        "live 1",
+        "live 2",
+    ]
+
+
+async def test_pages_by_limit(chat):
+    for n in range(5):
+        await send(chat, f"m{n}", DAY + timedelta(days=n % 2, minutes=n))
+
+    page, cursor = await fetch_bucket_messages(chat, limit=2)
+    assert texts(page) == ["m1", "m3"]
+    page, cursor = await fetch_bucket_messages(chat, before=cursor, limit=2)
+    assert texts(page) == ["m2", "m4"]
+    page, cursor = await fetch_bucket_messages(chat, before=cursor, limit=2)
+    assert texts(page) == ["m0"]
+    assert cursor is None
+
+    page, cursor = await fetch_bucket_messages(
+        chat, after=DAY.isoformat(), limit=3
+    )
+    assert texts(page) == ["m2", "m4", "m1"]
+    page, cursor = await fetch_bucket_messages(chat, after=cursor, limit=3)
+    assert texts(page) == ["m3"]
+    assert cursor is None
+
+
+async def test_same_ms_is_not_split(chat):
+    for n in range(3):
+        await send(chat, f"m{n}", DAY)
+
+    page, cursor = await fetch_bucket_messages(chat, limit=2)
+    assert len(page) == 3
+    assert cursor is None
+
+
+async def test_days_follow_timezone(chat):
+    # 23:30 UTC is the next day in UTC+2
+    await send(chat, "late", DAY.replace(hour=23, minute=30))
+    await send(chat, "noon", DAY)
+
+    # only the id and the serialized fields of the chat are used
+    parent = SimpleNamespace(id=chat, model_dump=dict)
+    data = await dump_with_messages(parent, tz="120")
+    assert [day["date"] for day in data["messages"]] == [
+        "2024-01-02",
+        "2024-01-03",
+    ]
+    data = await dump_with_messages(parent)
+    assert [day["date"] for day in data["messages"]] == ["2024-01-02"]
+
+
+async def test_last_message_is_embedded(chat):
+    sent = await send(chat, "hello", DAY)
+    await send(chat, "late", DAY - timedelta(minutes=1))
+
+    parent = await Chat.get_motor_collection().find_one({"_id": chat})
+    assert "last_msg" not in parent
+    assert parent["seq"] == 2
+    assert parent["last_msg_doc"]["_id"] == sent.id
+    assert parent["last_msg_doc"]["text"] == "hello"
+    assert parent["last_msg_doc"]["seq"] == 1
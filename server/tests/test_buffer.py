@@ -0,0 +1,115 @@
+"""tests of the write-behind message buffer"""
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.db.buffer import MessageBuffer
+from app.models.bucket import MessageBucket
+from app.models.chat import Chat
+from app.models.message import Message
+
+
+WHEN = datetime(2024, 1, 2, 12)
+
+
+@pytest.fixture
+async def chat_id(db):
+    """an empty chat"""
+    c_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {"_id": c_id, "is_deleted": False, "seq": 0}
+    )
+    return c_id
+
+
+def message(c_id, text: str, minutes: int = 0) -> Message:
+    """a message ready to be buffered, numbered by its minute"""
+    return Message(
+        id=PydanticObjectId(),
+        text=text,
+        sender="ann",
+        when=WHEN + timedelta(minutes=minutes),
+        chat_id=c_id,
+        chat_type="chat",
+        seq=minutes + 1,
+    )
+
+
+def failing(buffer: MessageBuffer, poison: str | None = None, times=None):
+    """
+    makes the writes of a buffer fail, while they include the
+    poison message, or `times` times
+    """
+    write = buffer.write
+    calls = []
+
+    async def fail(batch, retry=False):
+        calls.append(len(batch))
+        if poison is not None and any(m.text == poison for _, m in batch):
+            raise RuntimeError("poison")
+        if times is not None and len(calls) <= times:
+            raise RuntimeError("down")
+        await write(batch, retry)
+
+    buffer.write = fail
+    return calls
+
+
+async def test_flush_writes_messages_and_parent(chat_id, collection_storage):
+    buffer = MessageBuffer(max_size=10, interval_ms=10)
+    for n in range(3):
+        buffer.put(Chat, message(chat_id, f"m{n}", minutes=n))
+
+    await buffer.flush()
+
+    assert buffer.pending == []
+    assert await Message.find(Message.chat_id == chat_id).count() == 3
+    parent = await Chat.get_motor_collection().find_one({"_id": chat_id})
+    assert parent["last_msg_doc"]["text"] == "m2"
+    assert buffer.stats()["flushed"] == 3
+
+
+async def test_failed_flush_is_retried(chat_id, collection_storage):
+    buffer = MessageBuffer(max_size=10, interval_ms=10, max_retries=3)
+    failing(buffer, times=1)
+    buffer.put(Chat, message(chat_id, "hello"))
+
+    await buffer.flush()
+    assert len(buffer.pending) == 1
+    assert buffer.stats()["retrying"] == 1
+
+    await buffer.flush()
+    assert buffer.pending == []
+    assert buffer.attempts == {}
+    assert await Message.find(Message.chat_id == chat_id).count() == 1
+
+
+async def test_poison_message_is_dropped(chat_id, collection_storage):
+    buffer = MessageBuffer(max_size=10, interval_ms=10, max_retries=2)
+    failing(buffer, poison="bad")
+    buffer.put(Chat, message(chat_id, "good", minutes=0))
+    buffer.put(Chat, message(chat_id, "bad", minutes=1))
+    buffer.put(Chat, message(chat_id, "also good", minutes=2))
+
+    # stop drains the buffer, giving up on the poison message
+    await buffer.stop()
+
+    assert buffer.pending == []
+    stats = buffer.stats()
+    assert stats["dropped"] == 1
+    assert stats["retrying"] == 0
+    texts = {m.text for m in await Message.find_all().to_list()}
+    assert texts == {"good", "also good"}
+
+
+async def test_retried_bucket_push_is_not_repeated(chat_id, bucket_storage):
+    buffer = MessageBuffer(max_size=10, interval_ms=10)
+    batch = [(Chat, message(chat_id, f"m{n}", minutes=n)) for n in range(2)]
+
+    # the first write succeeded, but its result was lost
+    await buffer.write(batch)
+    await buffer.write(batch, retry=True)
+
+    buckets = await MessageBucket.find_all().to_list()
+    assert sum(len(bucket.messages) for bucket in buckets) == 2
@@ -0,0 +1,123 @@
+"""tests of the json and msgpack encoders"""
+from datetime import datetime, timedelta, timezone
+import json
+
+from bson import ObjectId
+from pydantic import BaseModel
+import pytest
+
+from app import encoders
+from app.encoders import FastJSONResponse, OrJSON, StdJSON
+from app.settings import settings
+
+
+OID = ObjectId()
+PAYLOAD = {
+    "id": OID,
+    "when": datetime(2024, 1, 2, 12, 30, 15, 250000),
+    "aware": datetime(2024, 1, 2, 12, tzinfo=timezone(timedelta(hours=1))),
+    "messages": [{"text": "hi", "seq": 1, "read": True, "to": None}],
+}
+EXPECTED = {
+    "id": str(OID),
+    "when": "2024-01-02T12:30:15.250000Z",
+    "aware": "2024-01-02T12:00:00+01:00",
+    "messages": [{"text": "hi", "seq": 1, "read": True, "to": None}],
+}
+
+
+class Model(BaseModel):
+    """a model nested in a payload"""
+
+    name: str
+
+
+@pytest.mark.parametrize("encoder", [StdJSON, OrJSON])
+def test_model_types_are_encoded(encoder):
+    assert json.loads(encoder.dumps(PAYLOAD)) == EXPECTED
+    assert json.loads(encoder.dumpb(PAYLOAD)) == EXPECTED
+    assert encoder.loads(encoder.dumps({"model": Model(name="a")})) == {
+        "model": {"name": "a"}
+    }
+    # socket.io passes the formatting kwargs of the json module
+    assert encoder.loads(encoder.dumps([1, 2], separators=(",", ":"))) == [1, 2]
+
+    with pytest.raises(TypeError):
+        encoder.dumps({"unknown": object()})
+
+
+def test_encoder_follows_the_settings(monkeypatch):
+    monkeypatch.setattr(settings, "JSON_ENCODER", "orjson")
+    assert encoders.get_json() is OrJSON
+
+    monkeypatch.setattr(encoders, "orjson", None)
+    assert encoders.get_json() is StdJSON
+
+    monkeypatch.setattr(settings, "JSON_ENCODER", "json")
+    assert encoders.get_json() is StdJSON
+
+
+def test_responses_are_rendered_by_the_encoder():
+    response = FastJSONResponse(PAYLOAD)
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == EXPECTED
+
+
+@pytest.fixture
+def msgpack_enabled(monkeypatch):
+    """msgpack may be negotiated, by connections of this test only"""
+    monkeypatch.setattr(settings, "MSGPACK_ENABLED", True)
+    monkeypatch.setattr(encoders, "SID_ENCODINGS", {})
+
+
+def test_msgpack_is_negotiated(msgpack_enabled):
+    assert encoders.negotiate("sid1", {"encoding": "msgpack"}) == "msgpack"
+    assert encoders.negotiate("sid2", {}) == "json"
+    assert encoders.negotiate("sid3", {"encoding": "cbor"}) == "json"
+    assert encoders.SID_ENCODINGS == {"sid1": "msgpack"}
+
+    encoders.forget("sid1")
+    encoders.forget("sid2")
+    assert encoders.SID_ENCODINGS == {}
+
+
+def test_json_is_kept_without_msgpack(msgpack_enabled, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(encoders, "msgpack", None)
+        assert encoders.negotiate("sid1", {"encoding": "msgpack"}) == "json"
+
+    monkeypatch.setattr(settings, "MSGPACK_ENABLED", False)
+    assert encoders.negotiate("sid1", {"encoding": "msgpack"}) == "json"
+    assert encoders.SID_ENCODINGS == {}
+
+
+def test_payloads_are_encoded_per_connection(msgpack_enabled):
+    encoders.negotiate("binary", {"encoding": "msgpack"})
+
+    packed = encoders.encode_for("binary", PAYLOAD)
+    assert isinstance(packed, bytes)
+    assert encoders.MsgPack.loads(packed) == EXPECTED
+    assert encoders.encode_for("binary", None) is None
+    assert encoders.encode_for("text", PAYLOAD) is PAYLOAD
+
+    assert encoders.encode_args(("new", {"n": 1})) == (
+        encoders.MsgPack.dumpb("new"),
+        encoders.MsgPack.dumpb({"n": 1}),
+    )
+
+
+async def test_acknowledgements_are_packed(msgpack_enabled):
+    @encoders.packed
+    async def handler(sid: str, payload: dict) -> dict:
+        """echoes the payload"""
+        return payload
+
+    encoders.negotiate("binary", {"encoding": "msgpack"})
+    assert handler.__doc__ == "echoes the payload"
+    assert await handler("text", {"n": 1}) == {"n": 1}
+    assert encoders.MsgPack.loads(await handler("binary", {"n": 1})) == {
+        "n": 1
+    }
+
+    encoders.forget("binary")
+    assert await handler("binary", {"n": 1}) == {"n": 1}
@@ -0,0 +1,119 @@
+"""tests of the per-user inbox"""
+from datetime import datetime, timedelta, UTC
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.db.inbox import Inbox
+from app.encoders import JSON
+
+
+NOW = datetime(2024, 1, 2, 12, tzinfo=UTC)
+
+
+class User:
+    """the part of a user the inbox reads"""
+
+    def __init__(self) -> None:
+        self.id = PydanticObjectId()
+        self.username = f"user{self.id}"
+
+
+@pytest.fixture
+def inbox(redis) -> Inbox:
+    """an empty inbox"""
+    return Inbox(redis, ttl=60)
+
+
+async def conversation(inbox: Inbox, name: str) -> str:
+    """the summary of a new conversation, without activity"""
+    c_id = str(PydanticObjectId())
+    await inbox.redis.hset(
+        Inbox.summary(c_id), "info", JSON.dumps({"id": c_id, "name": name})
+    )
+    return c_id
+
+
+async def built(inbox: Inbox) -> User:
+    """a user whose inbox is built and empty"""
+    user = User()
+    await inbox.redis.set(Inbox.marker(user.id), 1)
+    return user
+
+
+def message(text: str, seq: int) -> dict:
+    """a serialized message"""
+    return {"text": text, "sender": "ann", "seq": seq}
+
+
+async def test_touch_moves_conversations_forward_only(inbox):
+    user = await built(inbox)
+    first = await conversation(inbox, "first")
+    second = await conversation(inbox, "second")
+
+    await inbox.touch(first, [user.id], NOW, message("a", 1))
+    await inbox.touch(second, [user.id], NOW + timedelta(seconds=1))
+    page = await inbox.page(user)
+    assert [c["name"] for c in page] == ["second", "first"]
+
+    await inbox.touch(first, [user.id], NOW + timedelta(seconds=2))
+    # a late, older message changes neither the order nor the summary
+    await inbox.touch(second, [user.id], NOW, message("late", 7))
+    page = await inbox.page(user)
+    assert [c["name"] for c in page] == ["first", "second"]
+    assert page[0]["last_msg"]["text"] == "a"
+    assert page[1]["last_msg"] is None
+    assert page[1]["seq"] == 7
+    assert await inbox.seq(first) == 1
+
+
+async def test_inboxes_not_built_are_skipped(inbox):
+    user = User()
+    c_id = await conversation(inbox, "chat")
+
+    await inbox.touch(c_id, [user.id], NOW, message("a", 1))
+
+    assert not await inbox.redis.exists(Inbox.key(user.id))
+    assert await inbox.cached_ids(user) is None
+    assert await inbox.seq(c_id) == 1
+
+
+async def test_pages_with_ties(inbox):
+    user = await built(inbox)
+    c_ids = [await conversation(inbox, str(n)) for n in range(4)]
+    for c_id in c_ids[:3]:
+        await inbox.touch(c_id, [user.id], NOW + timedelta(seconds=1))
+    await inbox.touch(c_ids[3], [user.id], NOW)
+
+    seen = []
+    before = None
+    while True:
+        page = await inbox.page(user, before, limit=2)
+        if not page:
+            break
+        seen += [c["id"] for c in page]
+        before = page[-1]["id"]
+
+    assert seen == sorted(c_ids[:3], reverse=True) + [c_ids[3]]
+    with pytest.raises(ValueError):
+        await inbox.page(user, str(PydanticObjectId()))
+
+
+async def test_remove_and_drop(inbox):
+    user = await built(inbox)
+    other = await built(inbox)
+    c_id = await conversation(inbox, "room")
+    await inbox.touch(c_id, [user.id, other.id], NOW)
+
+    await inbox.remove(c_id, [user.id])
+    assert await inbox.cached_ids(user) == []
+    assert await inbox.cached_ids(other) == [c_id]
+
+    await inbox.add(c_id, [user.id])
+    assert await inbox.redis.zscore(Inbox.key(user.id), c_id) == (
+        NOW.timestamp() * 1000
+    )
+
+    await inbox.drop(c_id, [user.id, other.id])
+    assert await inbox.cached_ids(other) == []
+    assert not await inbox.redis.exists(Inbox.summary(c_id))
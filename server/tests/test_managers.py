@@ -0,0 +1,125 @@
+"""tests of the local-first socket.io client managers"""
+from beanie import PydanticObjectId
+import pytest
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from app import encoders
+from app.managers import LocalFirst, PerEncoding
+
+
+class RecordedManager(LocalFirst, AsyncPubSubManager, PerEncoding):
+    """a local-first manager whose broker records what is published"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.broker: list[dict] = []
+        self.down = False
+
+    async def _publish(self, data) -> None:
+        if self.down:
+            raise ConnectionError("broker down")
+        self.broker.append(data)
+
+
+@pytest.fixture
+async def manager():
+    """a manager with two connections on this node, in one room"""
+    manager = RecordedManager(queue_size=10)
+    server = socketio.AsyncServer(client_manager=manager)
+    manager.sent = []
+
+    async def send(eio_sid, pkt):
+        manager.sent.append((eio_sid, pkt.data))
+
+    server._send_eio_packet = send
+    manager.sids = [await manager.connect(f"eio{n}", "/") for n in range(2)]
+    for sid in manager.sids:
+        await manager.enter_room(sid, "/", "room1")
+    yield manager
+    await manager.stop()
+
+
+def received(manager) -> list[str]:
+    """the eio sids that got a packet"""
+    return sorted(eio_sid for eio_sid, _ in manager.sent)
+
+
+async def test_local_sids_are_never_published(manager):
+    await manager.emit("ping", {"n": 1}, room=manager.sids[0])
+    await manager.emit("ping", {"n": 2}, room=manager.sids)
+    await manager.stop()
+
+    assert received(manager) == ["eio0", "eio0", "eio1"]
+    assert manager.broker == []
+    assert manager.stats()["local_only"] == 2
+
+
+async def test_rooms_are_delivered_here_then_published(manager):
+    await manager.emit("ping", {"n": 1}, room="room1", skip_sid=manager.sids[0])
+    assert received(manager) == ["eio1"]
+
+    await manager.emit("ping", {"n": 2}, room=[manager.sids[0], "elsewhere"])
+    await manager.stop()
+
+    assert [message["data"]["n"] for message in manager.broker] == [1, 2]
+    assert manager.broker[0]["skip_sid"] == manager.sids[0]
+    assert manager.broker[0]["host_id"] == manager.host_id
+    assert manager.stats() == {"local_only": 0, "published": 2, "queued": 0}
+
+
+async def test_other_room_names_are_one_room(manager):
+    room = PydanticObjectId()
+    await manager.emit("ping", {}, room=room)
+    await manager.stop()
+
+    assert [message["room"] for message in manager.broker] == [room]
+
+
+async def test_emits_with_callbacks_keep_the_stock_path(manager):
+    async def callback(*args):
+        pass
+
+    await manager.emit("ping", {}, room=manager.sids[0], callback=callback)
+
+    # published by the emitter itself, with the ack routing
+    assert len(manager.broker) == 1
+    assert manager.broker[0]["callback"] is not None
+    assert manager.publisher is None
+
+
+async def test_a_failed_publish_does_not_stop_the_others(manager):
+    manager.down = True
+    await manager.emit("ping", {"n": 1}, room="room1")
+    await manager.outbox.join()
+
+    manager.down = False
+    await manager.emit("ping", {"n": 2}, room="room1")
+    await manager.stop()
+
+    assert [message["data"]["n"] for message in manager.broker] == [2]
+    assert len(manager.sent) == 4
+
+
+async def test_events_are_encoded_once_per_encoding(manager, monkeypatch):
+    monkeypatch.setitem(encoders.SID_ENCODINGS, manager.sids[1], "msgpack")
+    sid = await manager.connect("eio2", "/")
+    await manager.enter_room(sid, "/", "room1")
+
+    await manager.emit("ping", {"n": 1}, room="room1", skip_sid=sid)
+    await manager.emit("ping", ("a", {"n": 2}), room="room1")
+
+    sent = [pkt for eio_sid, pkt in manager.sent if eio_sid == "eio1"]
+    # a placeholder packet, then the msgpack bytes as an attachment
+    assert encoders.MsgPack.loads(sent[1]) == {"n": 1}
+    assert [encoders.MsgPack.loads(pkt) for pkt in sent[3:]] == [
+        "a",
+        {"n": 2},
+    ]
+    assert sorted(
+        (eio_sid, pkt) for eio_sid, pkt in manager.sent if eio_sid != "eio1"
+    ) == [
+        ("eio0", '2["ping","a",{"n":2}]'),
+        ("eio0", '2["ping",{"n":1}]'),
+        ("eio2", '2["ping","a",{"n":2}]'),
+    ]
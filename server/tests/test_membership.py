@@ -0,0 +1,101 @@
+"""tests of the redis membership index"""
+from beanie import PydanticObjectId
+from bson import DBRef
+import pytest
+
+from app.db.membership import MembershipIndex
+from app.models.chat import Chat
+from app.models.room import Room
+
+
+def ref(user_id) -> DBRef:
+    """a link to a user"""
+    return DBRef("users", user_id)
+
+
+@pytest.fixture
+def index(redis) -> MembershipIndex:
+    """an empty index"""
+    return MembershipIndex(redis, ttl=60)
+
+
+@pytest.fixture
+async def room(db):
+    """a room of three users, the first one its creator and admin"""
+    users = [PydanticObjectId() for _ in range(3)]
+    room_id = PydanticObjectId()
+    await Room.get_motor_collection().insert_one(
+        {
+            "_id": room_id,
+            "is_deleted": False,
+            "creator": ref(users[0]),
+            "members": [ref(user_id) for user_id in users],
+            "admins": [ref(users[0])],
+        }
+    )
+    return str(room_id), [str(user_id) for user_id in users]
+
+
+async def test_room_entry_is_built_on_first_use(index, room):
+    room_id, (creator, member, _) = room
+
+    assert await index.is_member("room", room_id, member)
+    assert not await index.is_member("room", room_id, PydanticObjectId())
+    assert await index.is_admin(room_id, creator)
+    assert not await index.is_admin(room_id, member)
+    assert await index.is_creator(room_id, creator)
+    assert await index.admins_among(room_id, [member, creator]) == [creator]
+    assert sorted(await index.members("room", room_id)) == sorted(room[1])
+    assert await index.redis.ttl(index.key("room", room_id, "members")) > 0
+
+
+async def test_changes_follow_the_entry(index, room):
+    room_id, (creator, member, other) = room
+    await index.load("room", room_id)
+    newcomer = str(PydanticObjectId())
+
+    await index.add_members(room_id, [newcomer])
+    await index.add_admin(room_id, member)
+    assert await index.is_member("room", room_id, newcomer)
+    assert await index.is_admin(room_id, member)
+
+    await index.remove_members(room_id, [member])
+    assert not await index.is_member("room", room_id, member)
+    assert not await index.is_admin(room_id, member)
+
+    await index.remove_admin(room_id, creator)
+    assert not await index.is_admin(room_id, creator)
+
+
+async def test_changes_skip_entries_not_built(index, room):
+    room_id, (_, member, _) = room
+    newcomer = str(PydanticObjectId())
+
+    # no partial set is left behind, the entry is built from mongo
+    await index.add_members(room_id, [newcomer])
+    assert not await index.redis.exists(index.key("room", room_id, "members"))
+    assert not await index.is_member("room", room_id, newcomer)
+    assert await index.is_member("room", room_id, member)
+
+
+async def test_chat_entry_and_missing_conversations(index, db):
+    users = [PydanticObjectId(), PydanticObjectId()]
+    chat_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {
+            "_id": chat_id,
+            "is_deleted": False,
+            "user_1": ref(users[0]),
+            "user_2": ref(users[1]),
+        }
+    )
+
+    assert await index.is_member("chat", str(chat_id), users[1])
+    assert not await index.is_member("room", str(chat_id), users[1])
+    assert not await index.is_member("chat", "not an id", users[1])
+
+    await index.drop("chat", str(chat_id))
+    await Chat.get_motor_collection().update_one(
+        {"_id": chat_id}, {"$set": {"is_deleted": True}}
+    )
+    assert not await index.is_member("chat", str(chat_id), users[1])
@@ -0,0 +1,152 @@
+"""tests of the full-text search of messages"""
+from datetime import datetime
+from types import SimpleNamespace
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.middlewares import chat as chat_middlewares
+from app.models.message import Message
+from app.routers import chat as chat_router
+
+
+class Messages:
+    """
+    the messages collection of a few conversations. mongomock has
+    no text index, so `$text` is matched by words and scored by
+    the number of words found, and the cursor stage is run here
+    """
+
+    def __init__(self, docs: list[dict]) -> None:
+        self.docs = docs
+        self.pipelines: list[list[dict]] = []
+
+    def aggregate(self, pipeline: list[dict]):
+        """runs the search stages of `search_conversation`"""
+        self.pipelines.append(pipeline)
+        match = pipeline[0]["$match"]
+        words = match["$text"]["$search"].lower().split()
+        results = []
+        for doc in self.docs:
+            score = sum(word in doc["text"].lower().split() for word in words)
+            if doc["chat_id"] == match["chat_id"] and score:
+                results.append({**doc, "score": float(score)})
+        for stage in pipeline[2:]:
+            if "$or" in stage.get("$match", {}):
+                after, tie = stage["$match"]["$or"]
+                results = [
+                    doc
+                    for doc in results
+                    if doc["score"] < after["score"]["$lt"]
+                    or doc["score"] == tie["score"]
+                    and doc["_id"] < tie["_id"]["$lt"]
+                ]
+        results.sort(key=lambda doc: (doc["score"], doc["_id"]), reverse=True)
+        return SimpleNamespace(to_list=self.to_list(results))
+
+    @staticmethod
+    def to_list(results: list[dict]):
+        async def to_list(length: int) -> list[dict]:
+            return [
+                {k: v for k, v in doc.items() if k != "chat_id"}
+                for doc in results[:length]
+            ]
+
+        return to_list
+
+
+@pytest.fixture
+def setup(collection_storage, monkeypatch):
+    """a user in two conversations, and one they are not in"""
+    user = SimpleNamespace(id=PydanticObjectId(), username="ann")
+    mine = [PydanticObjectId(), PydanticObjectId()]
+    other = PydanticObjectId()
+    messages = Messages(
+        [
+            {
+                "_id": PydanticObjectId(),
+                "chat_id": c_id,
+                "chat_type": "chat",
+                "text": text,
+                "sender": "bob",
+                "when": datetime(2024, 1, 2, 12, n),
+                "seq": n,
+            }
+            for n, (c_id, text) in enumerate(
+                [
+                    (mine[0], "lunch at noon"),
+                    (mine[1], "lunch or dinner"),
+                    (mine[1], "dinner"),
+                    (other, "lunch with someone else"),
+                ]
+            )
+        ]
+    )
+
+    async def ids(_user) -> list[str]:
+        return [str(c_id) for c_id in mine]
+
+    async def get_session(sid):
+        return str(user.id)
+
+    async def fetch_user(user_id):
+        return user
+
+    monkeypatch.setattr(chat_middlewares, "INBOX", SimpleNamespace(ids=ids))
+    monkeypatch.setattr(
+        Message, "get_motor_collection", classmethod(lambda cls: messages)
+    )
+    monkeypatch.setattr(chat_router.sio, "get_session", get_session)
+    monkeypatch.setattr(chat_router, "fetch_user_by_id_or_username", fetch_user)
+    return SimpleNamespace(mine=mine, other=other, messages=messages)
+
+
+async def search(payload: dict) -> dict:
+    """sends a search_messages event"""
+    return await chat_router.search_messages("sid", payload)
+
+
+async def test_only_the_users_conversations_are_searched(setup):
+    reply = await search({"query": "lunch"})
+    assert reply["status_code"] == 200
+    results = reply["data"]["results"]
+    assert sorted(r["message"]["text"] for r in results) == [
+        "lunch at noon",
+        "lunch or dinner",
+    ]
+    assert {r["id"] for r in results} == {str(c_id) for c_id in setup.mine}
+    # every search is a text search within one conversation
+    searched = {p[0]["$match"]["chat_id"] for p in setup.messages.pipelines}
+    assert searched == set(setup.mine)
+
+
+async def test_pages_follow_the_cursor(setup):
+    reply = await search({"query": "lunch dinner", "limit": 1})
+    [first] = reply["data"]["results"]
+    assert first["message"]["text"] == "lunch or dinner"
+    assert first["snippet"]
+
+    cursor = reply["data"]["next_cursor"]
+    reply = await search({"query": "lunch dinner", "cursor": cursor})
+    assert sorted(r["message"]["text"] for r in reply["data"]["results"]) == [
+        "dinner",
+        "lunch at noon",
+    ]
+    assert reply["data"]["next_cursor"] is None
+
+
+async def test_other_conversations_are_forbidden(setup):
+    reply = await search({"query": "lunch", "id": str(setup.other)})
+    assert reply["status_code"] == 403
+
+    reply = await search({"query": "lunch", "id": str(setup.mine[0])})
+    assert [r["message"]["text"] for r in reply["data"]["results"]] == [
+        "lunch at noon"
+    ]
+
+
+async def test_invalid_queries(setup):
+    assert (await search({"query": "x" * 101}))["status_code"] == 400
+    assert (await search({"query": "a", "limit": 0}))["status_code"] == 400
+    assert (await search({"query": "a", "cursor": "1:x"}))["status_code"] == 400
+    assert (await search({}))["status_code"] == 400
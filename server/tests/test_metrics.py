@@ -0,0 +1,21 @@
+"""tests of the metrics endpoint"""
+import httpx
+import pytest
+
+from app import create_app
+from app.settings import settings
+
+
+async def get_metrics() -> httpx.Response:
+    """requests the metrics without logging in"""
+    transport = httpx.ASGITransport(app=create_app())
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://popchat"
+    ) as client:
+        return await client.get("/api/metrics")
+
+
+@pytest.mark.parametrize("enabled, status_code", [(False, 404), (True, 401)])
+async def test_metrics_are_not_public(monkeypatch, enabled, status_code):
+    monkeypatch.setattr(settings, "METRICS_ENABLED", enabled)
+    assert (await get_metrics()).status_code == status_code
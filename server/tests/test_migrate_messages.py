@@ -0,0 +1,99 @@
+"""tests of the migration to the chat-keyed messages collection"""
+from datetime import datetime, timedelta
+
+from bson import DBRef, ObjectId
+import mongomock
+import pytest
+
+import migrate_messages
+from app.settings import settings
+
+
+WHEN = datetime(2024, 1, 2, 23, 58)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """a database with a chat and a room still linking their messages"""
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(migrate_messages, "MongoClient", lambda uri: client)
+    monkeypatch.setattr(settings, "MESSAGE_BUCKET_SIZE", 2)
+    db = client[settings.DB_NAME]
+    for name in ("chats", "rooms"):
+        msg_ids = [ObjectId() for _ in range(3)]
+        db.messages.insert_many(
+            [
+                {
+                    "_id": msg_id,
+                    "text": f"{name} {n}",
+                    "sender": "ann",
+                    "when": WHEN + timedelta(minutes=n),
+                }
+                for n, msg_id in enumerate(msg_ids)
+            ]
+        )
+        db[name].insert_one(
+            {
+                "messages": [DBRef("messages", msg_id) for msg_id in msg_ids],
+                "last_msg": DBRef("messages", msg_ids[-1]),
+                "is_deleted": False,
+            }
+        )
+    # migrated already, or never had messages
+    db.chats.insert_one({"is_deleted": False})
+    return db
+
+
+def snapshot(db) -> dict:
+    """every document of every collection"""
+    return {
+        name: sorted(db[name].find(), key=lambda doc: str(doc["_id"]))
+        for name in sorted(db.list_collection_names())
+    }
+
+
+def migrate(checkpoint, dry_run: bool = False) -> None:
+    """runs the migration with the bucket backfill"""
+    migrate_messages.migrate(
+        batch_size=1,
+        chunk_size=2,
+        checkpoint_path=checkpoint,
+        buckets=True,
+        dry_run=dry_run,
+    )
+
+
+def test_dry_run_writes_nothing(db, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    before = snapshot(db)
+
+    migrate(checkpoint, dry_run=True)
+
+    assert snapshot(db) == before
+    assert not checkpoint.exists()
+
+
+def test_migration_runs_once(db, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    migrate(checkpoint)
+
+    chat = db.chats.find_one({"last_msg": {"$exists": True}})
+    assert "messages" not in chat
+    assert chat["last_msg_at"] == WHEN + timedelta(minutes=2)
+    assert chat["last_msg_doc"]["text"] == "chats 2"
+    assert db.messages.count_documents({"chat_id": chat["_id"]}) == 3
+    assert db.messages.count_documents({"chat_type": "room"}) == 3
+    # two messages the first day, the bucket of the second is not full
+    buckets = list(db.message_buckets.find({"chat_id": chat["_id"]}))
+    assert sorted(
+        (b["date"], b["part"], b["n_messages"]) for b in buckets
+    ) == [("2024-01-02", 0, 2), ("2024-01-03", 0, 1)]
+
+    migrated = snapshot(db)
+    migrate(checkpoint)
+    assert snapshot(db) == migrated
+
+    # started over, every batch is found migrated or rewritten as is
+    checkpoint.unlink()
+    migrate(checkpoint)
+    assert snapshot(db) == migrated
@@ -0,0 +1,85 @@
+"""tests of the cursor pagination of message histories"""
+from datetime import datetime, timedelta
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.middlewares.chat import (
+    append_message,
+    fetch_bucket_messages,
+    fetch_messages,
+)
+from app.models.chat import Chat
+from app.models.message import Message
+
+
+WHEN = datetime(2024, 1, 2, 12)
+
+
+@pytest.fixture
+async def chat_id(db, sequences, collection_storage):
+    """a chat with messages m0 to m5, m2 and m3 sent in the same ms"""
+    c_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {"_id": c_id, "is_deleted": False, "seq": 0}
+    )
+    for n, minutes in enumerate([0, 1, 2, 2, 3, 4]):
+        message = Message(
+            text=f"m{n}",
+            sender="ann",
+            when=WHEN + timedelta(minutes=minutes),
+        )
+        await append_message(Chat, c_id, message)
+    return c_id
+
+
+def texts(page: list[Message]) -> list[str]:
+    """the texts of a page"""
+    return [message.text for message in page]
+
+
+async def test_pages_backwards_from_the_latest(chat_id):
+    page, cursor = await fetch_messages(chat_id, limit=2)
+    assert texts(page) == ["m4", "m5"]
+
+    seen = texts(page)
+    while cursor is not None:
+        page, cursor = await fetch_messages(chat_id, before=cursor, limit=2)
+        seen = texts(page) + seen
+
+    assert seen == [f"m{n}" for n in range(6)]
+
+
+async def test_pages_forwards(chat_id):
+    first = await Message.find_one(Message.text == "m0")
+    page, cursor = await fetch_messages(chat_id, after=str(first.id), limit=2)
+    assert texts(page) == ["m1", "m2"]
+
+    page, cursor = await fetch_messages(chat_id, after=cursor, limit=2)
+    assert texts(page) == ["m3", "m4"]
+
+    page, cursor = await fetch_messages(chat_id, after=cursor, limit=2)
+    assert texts(page) == ["m5"]
+    assert cursor is None
+
+
+async def test_timestamp_cursor(chat_id):
+    before = (WHEN + timedelta(minutes=2)).isoformat()
+    page, cursor = await fetch_messages(chat_id, before=before, limit=5)
+    assert texts(page) == ["m0", "m1"]
+    assert cursor is None
+
+
+async def test_invalid_arguments(chat_id):
+    first = await Message.find_one(Message.text == "m0")
+    last = await Message.find_one(Message.text == "m5")
+    with pytest.raises(ValueError):
+        await fetch_messages(chat_id, before=str(last.id), after=str(first.id))
+    with pytest.raises(ValueError):
+        await fetch_bucket_messages(
+            chat_id, before="2024-01-03", after="2024-01-01"
+        )
+    with pytest.raises(ValueError):
+        await fetch_messages(chat_id, limit=0)
+    with pytest.raises(ValueError):
+        await fetch_messages(chat_id, before=str(PydanticObjectId()))
@@ -0,0 +1,88 @@
+"""tests of the offline delivery queue and sync on reconnect"""
+import pytest
+
+from app.db.membership import MembershipIndex
+from app.db.pending import PendingQueue
+from app.db.presence import Presence
+from app.middlewares import chat as chat_middlewares
+from app.routers import chat as chat_router
+
+
+@pytest.fixture
+def pending(redis, monkeypatch) -> PendingQueue:
+    """an empty queue, read by the user `u1`"""
+    queue = PendingQueue(redis, max_len=100, max_age=60)
+
+    async def get_session(sid):
+        return "u1"
+
+    monkeypatch.setattr(chat_router.sio, "get_session", get_session)
+    monkeypatch.setattr(chat_router, "PENDING", queue)
+    monkeypatch.setattr(chat_middlewares, "PENDING", queue)
+    return queue
+
+
+async def sync(payload: dict | None = None) -> dict:
+    """sends a sync_pending event"""
+    return await chat_router.sync_pending("sid", payload)
+
+
+async def test_only_offline_members_get_the_event(redis, pending, monkeypatch):
+    membership = MembershipIndex(redis, ttl=60)
+    await membership.set_chat("c1", ["u1", "u2", "u3"])
+    presence = Presence(redis, ttl=30, heartbeat=10, coalesce_ms=10)
+    await presence.add("u2", "sid2", "bob", ["c1"])
+    monkeypatch.setattr(chat_middlewares, "MEMBERSHIP", membership)
+    monkeypatch.setattr(chat_middlewares, "PRESENCE", presence)
+
+    member_ids = await membership.members("chat", "c1")
+    await chat_middlewares.queue_for_offline(
+        member_ids, "u3", "new_message", {"text": "hi"}
+    )
+
+    assert await redis.xlen(pending.key("u1")) == 1
+    assert not await redis.exists(pending.key("u2"))
+    assert not await redis.exists(pending.key("u3"))
+
+
+async def test_sync_in_acknowledged_batches(pending):
+    for n in range(5):
+        await pending.push(["u1"], "new_message", {"n": n})
+
+    ack = None
+    seen = []
+    while True:
+        reply = await sync({"ack": ack, "limit": 2})
+        assert reply["status_code"] == 200
+        events = reply["data"]["events"]
+        if not events:
+            break
+        seen += [event["data"]["n"] for event in events]
+        ack = reply["data"]["ack"]
+
+    assert seen == [0, 1, 2, 3, 4]
+    # the final, empty batch acknowledged the last events
+    assert await pending.redis.xlen(pending.key("u1")) == 0
+
+
+async def test_unacknowledged_batch_is_read_again(pending):
+    await pending.push(["u1"], "new_message", {"n": 0})
+
+    first = await sync()
+    again = await sync()
+    assert first["data"] == again["data"]
+
+
+async def test_invalid_requests(pending):
+    assert (await sync({"ack": "nope"}))["status_code"] == 400
+    assert (await sync({"limit": -1}))["status_code"] == 400
+
+
+async def test_streams_are_bounded(redis):
+    queue = PendingQueue(redis, max_len=10, max_age=60)
+    for n in range(500):
+        await queue.push(["u1"], "new_message", {"n": n})
+
+    # trimming is approximate, whole nodes of the stream are dropped
+    assert await redis.xlen(queue.key("u1")) < 500
+    assert 0 < await redis.ttl(queue.key("u1")) <= 60
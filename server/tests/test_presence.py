@@ -0,0 +1,96 @@
+"""tests of the presence service"""
+import asyncio
+from time import time
+
+import pytest
+
+from app.db.presence import Presence
+
+
+class Clock:
+    """a clock in ms moved forward by hand, from the current time"""
+
+    def __init__(self) -> None:
+        self.now = int(time() * 1000)
+
+    def __call__(self) -> int:
+        return self.now
+
+
+def node(redis, clock: Clock) -> Presence:
+    """the presence service of one worker"""
+    presence = Presence(redis, ttl=30, heartbeat=10, coalesce_ms=10)
+    presence.now_ms = clock
+    return presence
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+async def test_online_while_any_device_is(redis, clock):
+    first, second = node(redis, clock), node(redis, clock)
+
+    await first.add("u1", "sid1", "ann", ["c1"])
+    await second.add("u1", "sid2", "ann", ["c1"])
+    await first.add("u2", "sid3", "bob", ["c1", "c2"])
+    assert first.changes == {
+        "u1": (True, "ann", ["c1"]),
+        "u2": (True, "bob", ["c1", "c2"]),
+    }
+    assert second.changes == {}
+
+    sids = await first.sids(["u1", "u2", "u3"])
+    assert sorted(sids["u1"]) == ["sid1", "sid2"]
+    assert sids["u3"] == []
+    assert await first.online(["u1", "u2", "u3"]) == {"u1", "u2"}
+
+    first.changes.clear()
+    await first.remove("sid1")
+    assert first.changes == {}
+    await second.remove("sid2")
+    assert second.changes == {"u1": (False, "ann", ["c1"])}
+    assert await first.online(["u1"]) == set()
+
+
+async def test_sids_of_a_dead_worker_expire(redis, clock):
+    dead, alive = node(redis, clock), node(redis, clock)
+    await dead.add("u1", "sid1", "ann", ["c1"])
+    await alive.add("u2", "sid2", "bob", ["c1"])
+
+    # only the live worker keeps its sids alive
+    clock.now += 20_000
+    await alive.refresh()
+    clock.now += 20_000
+    assert await alive.online(["u1", "u2"]) == {"u2"}
+
+    # the user comes back online, the expired sid is dropped
+    await alive.add("u1", "sid3", "ann", ["c1"])
+    assert alive.changes["u1"][0] is True
+    assert await alive.sids(["u1"]) == {"u1": ["sid3"]}
+
+
+async def test_changes_are_announced_per_conversation(redis, clock):
+    presence = node(redis, clock)
+    events = []
+
+    async def emit(event, data, to):
+        events.append((event, data, to))
+
+    presence.emit = emit
+    await presence.add("u1", "sid1", "ann", ["c1", "c2"])
+    await presence.add("u2", "sid2", "bob", ["c1"])
+    await presence.add("u3", "sid3", "cal", ["c2"])
+    await presence.remove("sid3")
+
+    task = asyncio.create_task(presence.announce())
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert sorted(events, key=lambda e: e[2]) == [
+        ("presence", {"online": ["ann", "bob"], "offline": []}, "c1"),
+        ("presence", {"online": ["ann"], "offline": ["cal"]}, "c2"),
+    ]
+    assert presence.changes == {}
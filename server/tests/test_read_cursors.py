@@ -0,0 +1,100 @@
+"""tests of the read cursors and unread counts"""
+from datetime import datetime, UTC
+from types import SimpleNamespace
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.db.inbox import Inbox
+from app.db.membership import MembershipIndex
+from app.db.read_cursors import ReadCursors
+from app.encoders import JSON
+from app.middlewares import chat as chat_middlewares
+from app.models.read_state import ReadState
+from app.routers import chat as chat_router
+
+
+@pytest.fixture
+async def setup(db, redis, monkeypatch):
+    """a chat of two users whose last message is numbered 5"""
+    user = SimpleNamespace(id=PydanticObjectId(), username="ann")
+    c_id = str(PydanticObjectId())
+    membership = MembershipIndex(redis, ttl=60)
+    inbox = Inbox(redis, ttl=60)
+    cursors = ReadCursors(coalesce_ms=10)
+
+    await membership.set_chat(c_id, [user.id, PydanticObjectId()])
+    await redis.hset(
+        Inbox.summary(c_id), "info", JSON.dumps({"id": c_id, "type": "chat"})
+    )
+    await redis.set(Inbox.marker(user.id), 1)
+    await inbox.touch(
+        c_id,
+        [user.id],
+        datetime.now(UTC),
+        {"text": "hi", "sender": "bob", "seq": 5},
+    )
+
+    async def get_session(sid):
+        return user.id
+
+    monkeypatch.setattr(chat_router.sio, "get_session", get_session)
+    for module in (chat_router, chat_middlewares):
+        monkeypatch.setattr(module, "INBOX", inbox)
+        monkeypatch.setattr(module, "READ_CURSORS", cursors)
+    monkeypatch.setattr(chat_router, "MEMBERSHIP", membership)
+    return SimpleNamespace(user=user, c_id=c_id, cursors=cursors)
+
+
+async def mark_read(payload: dict) -> dict:
+    """sends a mark_read event"""
+    return await chat_router.mark_read("sid", payload)
+
+
+async def test_unread_counts_follow_the_cursor(setup):
+    [chat] = await chat_middlewares.fetch_user_chats(setup.user)
+    assert chat["unread"] == 5
+
+    ack = await mark_read({"id": setup.c_id, "type": "chat", "seq": 3})
+    assert ack["status_code"] == 200
+    [chat] = await chat_middlewares.fetch_user_chats(setup.user)
+    assert chat["unread"] == 2
+
+    # written as a $max, so an older ack never moves it back
+    await setup.cursors.flush()
+    setup.cursors.mark(setup.user.id, setup.c_id, 1)
+    await setup.cursors.flush()
+    state = await ReadState.get(setup.user.id)
+    assert state.seqs == {setup.c_id: 3}
+
+
+async def test_seq_is_clamped_to_the_last_message(setup):
+    await mark_read({"id": setup.c_id, "type": "chat", "seq": 1000})
+
+    assert setup.cursors.pending == {str(setup.user.id): {setup.c_id: 5}}
+    [chat] = await chat_middlewares.fetch_user_chats(setup.user)
+    assert chat["unread"] == 0
+
+
+async def test_the_chat_type_is_checked(setup):
+    ack = await mark_read({"id": setup.c_id, "type": "room", "seq": 1})
+    assert ack["status_code"] == 403
+
+    ack = await mark_read({"id": setup.c_id, "seq": 1})
+    assert ack["status_code"] == 400
+    assert setup.cursors.pending == {}
+
+
+async def test_new_members_start_at_the_last_message(setup, sequences):
+    # joining the conversation whose last message is numbered 5
+    joined = SimpleNamespace(id=setup.c_id, seq=5)
+    await chat_middlewares.catch_up(joined, [setup.user.id])
+    [chat] = await chat_middlewares.fetch_user_chats(setup.user)
+    assert chat["unread"] == 0
+
+    # numbers handed out to messages not flushed yet count too
+    room = SimpleNamespace(id=PydanticObjectId(), seq=2)
+    await sequences.redis.set(sequences.key(room.id), 4)
+    await chat_middlewares.catch_up(room, [setup.user.id])
+    seqs = await setup.cursors.get(setup.user.id)
+    assert seqs[str(room.id)] == 4
@@ -0,0 +1,188 @@
+"""tests of the sequence numbers of messages and of sync"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.db.buffer import MessageBuffer
+from app.db.inbox import Inbox
+from app.db.membership import MembershipIndex
+from app.encoders import JSON
+from app.middlewares import chat as chat_middlewares
+from app.models.bucket import MessageBucket
+from app.models.chat import Chat
+from app.models.message import Message
+from app.settings import settings
+
+
+WHEN = datetime(2024, 1, 2, 12)
+
+
+@pytest.fixture
+async def setup(db, redis, sequences, monkeypatch):
+    """a chat of one user, with its indexes in fake redis"""
+    user = SimpleNamespace(id=PydanticObjectId(), username="ann")
+    c_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {"_id": c_id, "is_deleted": False, "seq": 0}
+    )
+    membership = MembershipIndex(redis, ttl=60)
+    await membership.set_chat(str(c_id), [user.id])
+    inbox = Inbox(redis, ttl=60)
+    await redis.set(Inbox.marker(user.id), 1)
+    await redis.hset(
+        Inbox.summary(c_id), "info", JSON.dumps({"id": str(c_id)})
+    )
+    await redis.zadd(Inbox.key(user.id), {str(c_id): 0})
+    buffer = MessageBuffer(max_size=100, interval_ms=10)
+
+    monkeypatch.setattr(chat_middlewares, "MEMBERSHIP", membership)
+    monkeypatch.setattr(chat_middlewares, "INBOX", inbox)
+    monkeypatch.setattr(chat_middlewares, "MESSAGE_BUFFER", buffer)
+    return SimpleNamespace(user=user, c_id=c_id, buffer=buffer)
+
+
+async def send(c_id, n: int, write_behind: bool, monkeypatch) -> Message:
+    """sends message number n, written through or buffered"""
+    monkeypatch.setattr(settings, "MESSAGE_WRITE_BEHIND", write_behind)
+    msg = {
+        "text": f"m{n}",
+        "sender": "ann",
+        "when": WHEN + timedelta(minutes=n),
+    }
+    message, error = await chat_middlewares.add_message(
+        str(c_id), msg, "chat"
+    )
+    assert error is None
+    return message
+
+
+@pytest.mark.parametrize("storage", ["collection_storage", "bucket_storage"])
+async def test_buffered_and_direct_appends_share_one_sequence(
+    setup, monkeypatch, request, storage
+):
+    request.getfixturevalue(storage)
+    modes = [True, False, True, True, False, True]
+    sent = [
+        await send(setup.c_id, n, mode, monkeypatch)
+        for n, mode in enumerate(modes)
+    ]
+    assert [message.seq for message in sent] == [1, 2, 3, 4, 5, 6]
+
+    # sync reads the buffered messages before they are flushed
+    synced = await chat_middlewares.messages_after(str(setup.c_id), 0, 10)
+    assert [message["seq"] for message in synced] == [1, 2, 3, 4, 5, 6]
+
+    await setup.buffer.flush()
+    assert setup.buffer.pending == []
+
+    if storage == "bucket_storage":
+        buckets = await MessageBucket.find_all().to_list()
+        stored = [m for bucket in buckets for m in bucket.messages]
+    else:
+        stored = await Message.get_motor_collection().find().to_list(None)
+    assert sorted(m["seq"] for m in stored) == [1, 2, 3, 4, 5, 6]
+
+    parent = await Chat.get_motor_collection().find_one({"_id": setup.c_id})
+    assert parent["seq"] == 6
+    assert parent["last_msg_doc"]["seq"] == 6
+    assert parent["last_msg_doc"]["text"] == "m5"
+
+    synced = await chat_middlewares.messages_after(str(setup.c_id), 4, 10)
+    assert [message["text"] for message in synced] == ["m4", "m5"]
+
+
+async def test_sync_returns_what_was_missed(setup, monkeypatch):
+    for n in range(5):
+        await send(setup.c_id, n, False, monkeypatch)
+
+    synced = await chat_middlewares.sync_messages(
+        setup.user, {str(setup.c_id): 2}, limit=2
+    )
+    page = synced[str(setup.c_id)]
+    assert [message["seq"] for message in page["messages"]] == [3, 4]
+    assert page["more"] is True
+
+    with pytest.raises(ValueError):
+        await chat_middlewares.sync_messages(
+            setup.user, {str(PydanticObjectId()): 0}
+        )
+    with pytest.raises(ValueError):
+        await chat_middlewares.sync_messages(
+            setup.user, {str(setup.c_id): -1}
+        )
+
+
+async def test_counters_are_seeded_from_the_high_water_mark(db, sequences):
+    c_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {"_id": c_id, "is_deleted": False, "seq": 41}
+    )
+
+    assert await sequences.next(Chat, c_id) == 42
+    # taken from redis alone once seeded
+    await Chat.get_motor_collection().delete_one({"_id": c_id})
+    assert await sequences.next(Chat, c_id) == 43
+    assert await sequences.redis.ttl(sequences.key(c_id)) > 0
+
+    await sequences.drop(c_id)
+    assert await sequences.next(Chat, c_id) is None
+    assert await sequences.next(Chat, PydanticObjectId()) is None
+
+
+async def test_only_the_last_number_is_released(db, sequences):
+    c_id = PydanticObjectId()
+    await Chat.get_motor_collection().insert_one(
+        {"_id": c_id, "is_deleted": False, "seq": 0}
+    )
+    first = await sequences.next(Chat, c_id)
+    second = await sequences.next(Chat, c_id)
+
+    assert not await sequences.release(c_id, first)
+    assert await sequences.release(c_id, second)
+    assert await sequences.next(Chat, c_id) == second
+
+
+async def test_the_flush_persists_the_high_water_mark(setup, monkeypatch):
+    for n in range(3):
+        await send(setup.c_id, n, True, monkeypatch)
+    parent = await Chat.get_motor_collection().find_one({"_id": setup.c_id})
+    assert parent["seq"] == 0
+
+    await setup.buffer.flush()
+    parent = await Chat.get_motor_collection().find_one({"_id": setup.c_id})
+    assert parent["seq"] == 3
+
+    # a lost counter is seeded again past every flushed message
+    await chat_middlewares.SEQUENCES.drop(setup.c_id)
+    message = await send(setup.c_id, 3, False, monkeypatch)
+    assert message.seq == 4
+
+
+@pytest.mark.parametrize("storage", ["collection_storage", "bucket_storage"])
+async def test_a_failed_insert_leaves_the_parent_as_it_was(
+    setup, sequences, monkeypatch, request, storage
+):
+    request.getfixturevalue(storage)
+    await send(setup.c_id, 0, False, monkeypatch)
+    before = await Chat.get_motor_collection().find_one({"_id": setup.c_id})
+
+    async def fail(*args, **kwargs):
+        raise RuntimeError("write failed")
+
+    message = Message(text="lost", sender="ann", when=WHEN)
+    with monkeypatch.context() as patch:
+        patch.setattr(Message, "insert", fail)
+        collection = MessageBucket.get_motor_collection()
+        patch.setattr(collection, "update_one", fail)
+        with pytest.raises(RuntimeError):
+            await chat_middlewares.append_message(Chat, setup.c_id, message)
+
+    after = await Chat.get_motor_collection().find_one({"_id": setup.c_id})
+    assert after["seq"] == before["seq"] == 1
+    assert after["last_msg_doc"] == before["last_msg_doc"]
+    assert after.get("last_msg") == before.get("last_msg")
+
+    # the number was given back, the next message takes it
+    assert await sequences.next(Chat, setup.c_id) == 2
@@ -0,0 +1,92 @@
+"""tests of the throttled, coalesced typing indicators"""
+import pytest
+
+from app.db.typing import Typing
+
+
+class Clock:
+    """a clock in seconds moved forward by hand"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def typing():
+    """indicators on a manual clock, recording their broadcasts"""
+    typing = Typing(throttle_ms=1000, interval_ms=200, ttl_ms=5000)
+    typing.clock = Clock()
+    typing.events = []
+
+    async def emit(event, data, to):
+        typing.events.append((event, data, to))
+
+    typing.emit = emit
+    return typing
+
+
+async def test_keystrokes_are_throttled_and_coalesced(typing):
+    for n in range(10):
+        typing.clock.now = n * 0.05
+        typing.start_typing("sid1", "c1", "ann")
+    typing.start_typing("sid2", "c1", "bob")
+    await typing.flush()
+
+    assert typing.events == [
+        (
+            "typing",
+            {"id": "c1", "typing": ["ann", "bob"], "stopped": [], "ttl": 5000},
+            "c1",
+        )
+    ]
+    assert typing.stats() == {
+        "connections": 2,
+        "received": 11,
+        "throttled": 9,
+        "broadcasts": 1,
+    }
+
+    # nothing new, nothing sent
+    await typing.flush()
+    assert len(typing.events) == 1
+
+    # heard again once the throttle is over
+    typing.clock.now = 1.5
+    assert typing.start_typing("sid1", "c1", "ann")
+
+
+async def test_stops_and_closed_connections(typing):
+    typing.start_typing("sid1", "c1", "ann")
+    typing.start_typing("sid1", "c2", "ann")
+    typing.start_typing("sid2", "c1", "bob")
+    typing.stop_typing("sid2", "c1")
+    typing.forget("sid1")
+    await typing.flush()
+
+    events = {to: data for _, data, to in typing.events}
+    assert events["c1"]["typing"] == []
+    assert sorted(events["c1"]["stopped"]) == ["ann", "bob"]
+    assert events["c2"]["stopped"] == ["ann"]
+    assert typing.active == {}
+
+    # stopping twice is not broadcast twice
+    typing.stop_typing("sid2", "c1")
+    assert typing.changes == {}
+
+
+async def test_a_failed_emit_does_not_stop_the_others(typing):
+    async def emit(event, data, to):
+        if to == "c1":
+            raise RuntimeError("broker down")
+        typing.events.append((event, data, to))
+
+    typing.emit = emit
+    typing.start_typing("sid1", "c1", "ann")
+    typing.start_typing("sid1", "c2", "ann")
+    await typing.flush()
+
+    assert [to for _, _, to in typing.events] == ["c2"]
+    assert typing.changes == {}
@@ -0,0 +1,137 @@
+"""tests of the process-local user cache"""
+import asyncio
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.db import user_cache
+from app.db.user_cache import UserCache
+from app.middlewares import chat as chat_middlewares
+from app.models.user import User
+
+
+def make_user(username: str, user_id=None) -> User:
+    """a user that is not in the database"""
+    return User(
+        id=user_id or PydanticObjectId(),
+        username=username,
+        email=f"{username}@example.com",
+        password="x",
+    )
+
+
+@pytest.fixture
+def cache(db, monkeypatch) -> UserCache:
+    """an empty cache of two users, used by the middlewares"""
+    cache = UserCache(max_size=2, ttl=60, channel="test:user_cache")
+    monkeypatch.setattr(chat_middlewares, "USER_CACHE", cache)
+    return cache
+
+
+async def test_hits_and_misses(cache):
+    ann = make_user("ann")
+    assert cache.get_by_id(ann.id) is None
+
+    cache.put(ann)
+    assert cache.get_by_id(ann.id) is ann
+    assert cache.get_by_username("ann") is ann
+    assert cache.get_by_username("bob") is None
+    assert cache.stats() == {
+        "size": 1,
+        "hits": 2,
+        "misses": 2,
+        "evictions": 0,
+        "invalidations": 0,
+    }
+
+
+async def test_least_recently_used_is_evicted(cache):
+    ann, bob, cat = make_user("ann"), make_user("bob"), make_user("cat")
+    cache.put(ann)
+    cache.put(bob)
+    # ann is used again, so bob is the one to go
+    assert cache.get_by_id(ann.id) is ann
+    cache.put(cat)
+
+    assert cache.get_by_id(bob.id) is None
+    assert cache.get_by_username("bob") is None
+    assert cache.get_by_id(ann.id) is ann
+    assert cache.get_by_id(cat.id) is cat
+    assert cache.stats()["evictions"] == 1
+
+
+async def test_entries_expire(cache, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(user_cache, "monotonic", lambda: now)
+    ann = make_user("ann")
+    cache.put(ann)
+
+    now += 59
+    assert cache.get_by_id(ann.id) is ann
+    now += 2
+    assert cache.get_by_username("ann") is None
+    assert cache.stats()["size"] == 0
+
+
+async def test_renamed_user_is_not_found_by_the_old_name(cache):
+    ann = make_user("ann")
+    cache.put(ann)
+
+    renamed = make_user("anne", user_id=ann.id)
+    cache.put(renamed)
+    assert cache.get_by_username("ann") is None
+    assert cache.get_by_username("anne") is renamed
+
+    await cache.invalidate(ann.id)
+    assert cache.get_by_id(ann.id) is None
+    assert cache.get_by_username("anne") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+async def wait_for(condition) -> None:
+    """gives the listener time to catch up"""
+    for _ in range(100):
+        if await condition():
+            return
+        await asyncio.sleep(0.01)
+
+
+async def test_invalidations_reach_other_workers(cache, redis):
+    other = UserCache(max_size=2, ttl=60, channel=cache.channel)
+    other.start(redis)
+
+    async def subscribed():
+        [(_, count)] = await redis.pubsub_numsub(cache.channel)
+        return count == 1
+
+    await wait_for(subscribed)
+    ann = make_user("ann")
+    other.put(ann)
+    cache.redis = redis
+    await cache.invalidate(ann.id)
+
+    async def evicted():
+        return ann.username not in other.usernames
+
+    await wait_for(evicted)
+    await other.stop()
+    assert other.get_by_id(ann.id) is None
+
+
+async def test_fetch_reads_through_the_cache(cache):
+    ann = make_user("ann")
+    await ann.insert()
+
+    found = await chat_middlewares.fetch_user_by_id_or_username("ann")
+    assert found.id == ann.id
+    assert cache.stats()["misses"] == 1
+    await User.find_one(User.id == ann.id).delete()
+
+    # served from the cache, by either key
+    found = await chat_middlewares.fetch_user_by_id_or_username(str(ann.id))
+    assert found.username == "ann"
+    assert await chat_middlewares.fetch_user_by_id_or_username("ann")
+    assert cache.stats()["hits"] == 2
+
+    await cache.invalidate(ann.id)
+    assert await chat_middlewares.fetch_user_by_id_or_username("ann") is None
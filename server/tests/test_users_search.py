@@ -0,0 +1,117 @@
+"""tests of the username prefix search"""
+import asyncio
+
+from beanie import PydanticObjectId
+import pytest
+
+from app.db.username_index import UsernameIndex
+from app.middlewares import auth as auth_middlewares
+from app.middlewares import chat as chat_middlewares
+from app.models.user import User
+from app.settings import settings
+
+
+USERNAMES = ["Alice", "alfred", "ALBERT", "bob", "al_capone", "Ally"]
+
+
+@pytest.fixture
+async def users(db, monkeypatch) -> dict[str, User]:
+    """users searched in mongo, with no username index loaded"""
+    index = UsernameIndex(max_size=100, channel="test:usernames")
+    monkeypatch.setattr(chat_middlewares, "USERNAME_INDEX", index)
+    users = {}
+    for username in USERNAMES:
+        users[username] = await User(
+            username=username,
+            email=f"{username.lower()}@example.com",
+            password="x",
+        ).insert()
+    return users
+
+
+async def search(user_id, term: str, **kwargs) -> list[str]:
+    """returns the usernames a search matches"""
+    matches = await chat_middlewares.users_search(user_id, term, **kwargs)
+    return [match["username"] for match in matches]
+
+
+async def test_prefix_is_matched_case_insensitively(users):
+    searcher = users["bob"].id
+    assert users["ALBERT"].username_lower == "albert"
+    expected = ["al_capone", "ALBERT", "alfred", "Alice", "Ally"]
+
+    assert await search(searcher, "al") == expected
+    assert await search(searcher, "AL") == expected
+    assert await search(searcher, "ali") == ["Alice"]
+    assert await search(searcher, "z") == []
+
+
+async def test_searcher_is_left_out(users):
+    assert await search(users["Alice"].id, "ali") == []
+
+
+async def test_pages_follow_the_last_username(users):
+    searcher = PydanticObjectId()
+    page = await search(searcher, "al", limit=2)
+    assert page == ["al_capone", "ALBERT"]
+
+    page = await search(searcher, "al", after=page[-1], limit=2)
+    assert page == ["alfred", "Alice"]
+
+    page = await search(searcher, "al", after=page[-1], limit=2)
+    assert page == ["Ally"]
+
+
+async def test_terms_are_never_patterns(users, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_PAGE_MAX", 10)
+    for term in [".*", "a|b", "^al", "al$", "a" * 200]:
+        with pytest.raises(ValueError):
+            await search(users["bob"].id, term)
+    with pytest.raises(ValueError):
+        await search(users["bob"].id, "al", limit=0)
+    assert len(await search(users["bob"].id, "a", limit=1000)) == 5
+
+
+@pytest.fixture
+async def index(users, redis, monkeypatch) -> UsernameIndex:
+    """the username index, loaded and listening for new users"""
+    index = chat_middlewares.USERNAME_INDEX
+    monkeypatch.setattr(auth_middlewares, "USERNAME_INDEX", index)
+    index.start(redis)
+    await wait_for(lambda: index.ready)
+    yield index
+    await index.stop()
+
+
+async def wait_for(condition) -> None:
+    """gives the listener time to catch up"""
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+async def test_index_answers_like_mongo(users, index):
+    searcher = users["bob"].id
+    assert index.stats()["size"] == len(USERNAMES)
+
+    assert await search(searcher, "AL") == [
+        "al_capone",
+        "ALBERT",
+        "alfred",
+        "Alice",
+        "Ally",
+    ]
+    page = await search(searcher, "al", after="ALBERT", limit=2)
+    assert page == ["alfred", "Alice"]
+    assert await search(users["Alice"].id, "ali") == []
+    assert index.stats()["hits"] == 3
+
+
+async def test_registered_users_are_searchable(index, monkeypatch):
+    monkeypatch.setattr(auth_middlewares, "create_passwd_hash", str)
+    await auth_middlewares.register_user("al@example.com", "Alan", "pw")
+
+    await wait_for(lambda: index.stats()["size"] == len(USERNAMES) + 1)
+    assert await search(PydanticObjectId(), "alan") == ["Alan"]